@@ -0,0 +1,257 @@
+"""
+Bounded-memory tiled inference for the Swin depth networks (NeWCRFs, DCDepth)
+at high resolution.
+
+tiled_forward splits the image into overlapping tiles whose position and size
+are multiples of window_alignment(model), runs them `batch_size` at a time and
+blends them with linear weights over the overlap, so the activation peak
+follows the tile size instead of the image size. fit_tiles picks the tile for
+an activation memory target. server_python/tiled_inference.py compares both
+against the full image.
+"""
+import math
+
+import numpy as np
+import torch
+
+from .memory import profile_peak_bytes
+
+
+def window_alignment(model, downsample=32):
+    """
+    Pixel multiple the tiles are aligned to: an aligned tile sees the same
+    first-stage window partition as the full image and is divisible by the
+    total stride of the backbone (96 px for Large12, 224 px for Large07)
+
+    Parameters
+    ----------
+    model : nn.Module
+        Network with a Swin `backbone` (NeWCRFs, DCDepth), or a DataParallel of it
+    downsample : int
+        Total stride of the backbone
+
+    Returns
+    -------
+    align : int
+        Least common multiple of `downsample` and patch_size * window_size
+    """
+    backbone = getattr(model, 'module', model).backbone
+    window = backbone.patch_embed.patch_size[0] * backbone.layers[0].window_size
+    return window * downsample // math.gcd(window, downsample)
+
+
+def tile_starts(length, tile, overlap, align):
+    """
+    Starts of the tiles of size `tile` that cover [0, length) sharing at least
+    `overlap` pixels with their neighbour. All are multiples of `align` except
+    the last one, which sits against the border
+
+    Parameters
+    ----------
+    length : int
+        Image size along the dimension
+    tile : int
+        Tile size along the dimension
+    overlap : int
+        Minimum overlap between neighbouring tiles
+    align : int
+        Alignment of the starts
+
+    Returns
+    -------
+    starts : list of int
+        Tile starts
+
+    Raises
+    ------
+    ValueError
+        If the overlap leaves a stride smaller than `align`
+    """
+    if tile >= length:
+        return [0]
+    stride = (tile - overlap) // align * align
+    if stride < align:
+        raise ValueError('Overlap {} leaves no stride multiple of {} for tile {}'.format(
+            overlap, align, tile))
+    return list(range(0, length - tile, stride)) + [length - tile]
+
+
+def feather_weights(tile, start, length, ramp, device=None, dtype=None):
+    """
+    1D blending weights of a tile: a linear ramp of `ramp` pixels on each side
+    that falls inside the image and 1 elsewhere (never 0, so every pixel stays
+    covered)
+
+    Returns
+    -------
+    weights : torch.Tensor [tile]
+        Blending weights
+    """
+    x = torch.arange(tile, device=device, dtype=dtype) + 0.5
+    weights = torch.ones(tile, device=device, dtype=dtype)
+    if start > 0:
+        weights = torch.minimum(weights, x / ramp)
+    if start + tile < length:
+        weights = torch.minimum(weights, (tile - x) / ramp)
+    return weights
+
+
+def tiled_forward(model, image, tile_size, overlap=32, align=32, batch_size=1):
+    """
+    Depth from overlapping tiles blended with linear weights
+
+    Parameters
+    ----------
+    model : callable
+        Maps an image batch [N,3,h,w] to a depth batch [N,C,h,w] of the same size
+    image : torch.Tensor [B,3,H,W]
+        Input images
+    tile_size : tuple of int
+        (height, width) of the tile, multiples of `align` (clipped to the image)
+    overlap : int
+        Minimum overlap between neighbouring tiles, which is also the blending ramp
+    align : int
+        Alignment of the tile starts (see window_alignment)
+    batch_size : int
+        Tiles per forward pass
+
+    Returns
+    -------
+    depth : torch.Tensor [B,C,H,W]
+        Blended depth map
+
+    Raises
+    ------
+    ValueError
+        If the output of the model does not have the size of the tile
+    """
+    B, _, H, W = image.shape
+    th, tw = min(tile_size[0], H), min(tile_size[1], W)
+    if (th, tw) == (H, W):
+        return model(image)
+
+    boxes = [(y, x) for y in tile_starts(H, th, overlap, align) for x in tile_starts(W, tw, overlap, align)]
+    ramp = max(overlap, 1)
+    depth = weight = None
+    for i in range(0, len(boxes), batch_size):
+        chunk = boxes[i: i + batch_size]
+        preds = model(torch.cat([image[:, :, y: y + th, x: x + tw] for y, x in chunk], 0))
+        if preds.shape[-2:] != (th, tw):
+            raise ValueError('Model output is {} but the tile is {}'.format(tuple(preds.shape[-2:]), (th, tw)))
+        if depth is None:
+            depth = preds.new_zeros(B, preds.shape[1], H, W)
+            weight = preds.new_zeros(1, 1, H, W)
+        for (y, x), pred in zip(chunk, preds.split(B, 0)):
+            w = feather_weights(th, y, H, ramp, preds.device, preds.dtype)[:, None] * \
+                feather_weights(tw, x, W, ramp, preds.device, preds.dtype)[None]
+            depth[:, :, y: y + th, x: x + tw] += pred * w
+            weight[:, :, y: y + th, x: x + tw] += w
+    return depth / weight
+
+
+def tile_sizes(length, overlap, align):
+    """
+    Valid tile sizes along one dimension, smallest first: multiples of `align`
+    whose stride (see tile_starts) is at least `align`, and the full length
+    """
+    sizes = [k * align for k in range(1, length // align + 1)
+             if k * align < length and (k * align - overlap) // align >= 1]
+    return sizes + [length]
+
+
+def num_tiles(length, tile, overlap, align):
+    """
+    Number of tiles tile_starts places along one dimension
+    """
+    if tile >= length:
+        return 1
+    stride = (tile - overlap) // align * align
+    return int(np.ceil((length - tile) / float(stride))) + 1
+
+
+def fit_tiles(model, image_size, max_memory_mb, overlap=32, align=32, max_batch=1, device='cpu'):
+    """
+    Tile (and tiles per forward pass) with the least total work whose
+    activation memory peak fits in `max_memory_mb`
+
+    The peak is the one of profile_peak_bytes (torch.cuda.max_memory_allocated
+    on CUDA): what PyTorch allocates during the forward pass, weights excluded.
+    Two measurements (full image and smallest tile) fit peak ~ a + b * pixels;
+    the candidates are walked from the fewest processed pixels (overlap
+    included) up and the first one the line lets through is measured, until
+    one really fits.
+
+    Parameters
+    ----------
+    model : callable
+        Maps an image batch [N,3,h,w] to a depth batch
+    image_size : tuple of int
+        (height, width) of the images that will be tiled
+    max_memory_mb : float
+        Activation memory target
+    overlap, align : int
+        As in tiled_forward
+    max_batch : int
+        Largest number of tiles per forward pass
+    device : str
+        Device of the measurement inputs
+
+    Returns
+    -------
+    tile_size : tuple of int
+        (height, width) of the tile
+    batch_size : int
+        Tiles per forward pass
+    peak : int
+        Measured peak in bytes
+
+    Raises
+    ------
+    ValueError
+        If not even the smallest tile fits the target, or if the full image
+        does not fit and there are no smaller tiles
+    """
+    height, width = image_size
+    target = max_memory_mb * 2 ** 20
+
+    def measure(batch, tile_h, tile_w):
+        x = torch.zeros(batch, 3, tile_h, tile_w, device=device)
+        with torch.no_grad():
+            if x.is_cuda:
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats(x.device)
+                allocated = torch.cuda.memory_allocated(x.device)
+                model(x)
+                return torch.cuda.max_memory_allocated(x.device) - allocated
+            return profile_peak_bytes(model, x)[0]
+
+    full = measure(1, height, width)
+    if full <= target:
+        return (height, width), 1, full
+
+    heights, widths = tile_sizes(height, overlap, align), tile_sizes(width, overlap, align)
+    small = (heights[0], widths[0])
+    if small == (height, width):
+        raise ValueError("With alignment {} and overlap {} there are no tiles smaller than {}x{} (peak {:.0f} MB)".format(
+            align, overlap, height, width, full / 2 ** 20))
+    base = measure(1, *small)
+    if base > target:
+        raise ValueError("Not even the smallest tile {} fits in {} MB (peak {:.0f} MB)".format(
+            small, max_memory_mb, base / 2 ** 20))
+    slope = (full - base) / float(height * width - small[0] * small[1])
+    intercept = base - slope * small[0] * small[1]
+
+    candidates = []
+    for tile_h in heights:
+        for tile_w in widths:
+            count = num_tiles(height, tile_h, overlap, align) * num_tiles(width, tile_w, overlap, align)
+            if (tile_h, tile_w) != (height, width):
+                candidates.append((count * tile_h * tile_w, -tile_h * tile_w, tile_h, tile_w, count))
+    for _, _, tile_h, tile_w, count in sorted(candidates):
+        for batch in range(min(max_batch, count), 0, -1):
+            if intercept + slope * batch * tile_h * tile_w > target:
+                continue
+            peak = base if (batch, tile_h, tile_w) == (1,) + small else measure(batch, tile_h, tile_w)
+            if peak <= target:
+                return (tile_h, tile_w), batch, peak
+    return small, 1, base
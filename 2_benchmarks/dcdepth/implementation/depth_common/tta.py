@@ -0,0 +1,119 @@
+"""
+Flip test-time augmentation: predict the image and its horizontal flip and
+blend them with the post_process_depth edge mask (from BTS/PackNet).
+
+One [2B,3,H,W] forward versus two [B,3,H,W] forwards (`batched`): on a GPU
+the batch keeps the device busy; on CPU a batch-1 forward already spreads each
+layer over every intra-op thread, so batch 2 takes the same time or longer and
+doubles the activation peak (PixelFormer Large07 at 480x640: 22.1 s and 218 MB
+with two forwards, 23.1 s and 434 MB with one; benchmark_pixel.py --tta).
+That is why `batched=None` picks by the device of the tensor.
+"""
+import torch
+
+
+def flip_lr(image):
+    """
+    Flip image horizontally
+
+    Parameters
+    ----------
+    image : torch.Tensor [B,3,H,W]
+        Image to be flipped
+
+    Returns
+    -------
+    image_flipped : torch.Tensor [B,3,H,W]
+        Flipped image
+    """
+    assert image.dim() == 4, 'You need to provide a [B,C,H,W] image to flip'
+    return torch.flip(image, [3])
+
+
+def fuse_inv_depth(inv_depth, inv_depth_hat, method='mean'):
+    """
+    Fuse inverse depth and flipped inverse depth maps
+
+    Parameters
+    ----------
+    inv_depth : torch.Tensor [B,1,H,W]
+        Inverse depth map
+    inv_depth_hat : torch.Tensor [B,1,H,W]
+        Flipped inverse depth map produced from a flipped image
+    method : str
+        Method that will be used to fuse the inverse depth maps
+
+    Returns
+    -------
+    fused_inv_depth : torch.Tensor [B,1,H,W]
+        Fused inverse depth map
+    """
+    if method == 'mean':
+        return 0.5 * (inv_depth + inv_depth_hat)
+    elif method == 'max':
+        return torch.max(inv_depth, inv_depth_hat)
+    elif method == 'min':
+        return torch.min(inv_depth, inv_depth_hat)
+    else:
+        raise ValueError('Unknown post-process method {}'.format(method))
+
+
+def post_process_depth(depth, depth_flipped, method='mean'):
+    """
+    Post-process an inverse and flipped inverse depth map
+
+    Parameters
+    ----------
+    inv_depth : torch.Tensor [B,1,H,W]
+        Inverse depth map
+    inv_depth_flipped : torch.Tensor [B,1,H,W]
+        Inverse depth map produced from a flipped image
+    method : str
+        Method that will be used to fuse the inverse depth maps
+
+    Returns
+    -------
+    inv_depth_pp : torch.Tensor [B,1,H,W]
+        Post-processed inverse depth map
+    """
+    B, C, H, W = depth.shape
+    inv_depth_hat = flip_lr(depth_flipped)
+    inv_depth_fused = fuse_inv_depth(depth, inv_depth_hat, method=method)
+    xs = torch.linspace(0., 1., W, device=depth.device,
+                        dtype=depth.dtype).repeat(B, C, H, 1)
+    mask = 1.0 - torch.clamp(20. * (xs - 0.05), 0., 1.)
+    mask_hat = flip_lr(mask)
+    return mask_hat * depth + mask * inv_depth_hat + \
+        (1.0 - mask - mask_hat) * inv_depth_fused
+
+
+def flip_tta(model, image, method='mean', batched=None):
+    """
+    Flip test-time augmentation: predicts depth for the image and its
+    horizontal flip and blends both with post_process_depth
+
+    Parameters
+    ----------
+    model : callable
+        Maps an image batch [N,3,H,W] to a depth batch [N,1,h,w]
+    image : torch.Tensor [B,3,H,W]
+        Input images
+    method : str
+        Method that will be used to fuse the depth maps ('mean', 'max' or 'min')
+    batched : bool or None
+        If True, image and flip go through `model` as one [2B,3,H,W] batch;
+        if False, two sequential passes. None picks batched for CUDA tensors
+        and sequential otherwise (see the module docstring)
+
+    Returns
+    -------
+    depth_pp : torch.Tensor [B,1,h,w]
+        Post-processed depth map
+    """
+    if batched is None:
+        batched = image.is_cuda
+    if batched:
+        depth, depth_flipped = model(torch.cat([image, flip_lr(image)], 0)).chunk(2, 0)
+    else:
+        depth, depth_flipped = model(image), model(flip_lr(image))
+    return post_process_depth(depth, depth_flipped, method=method)
@@ -8,7 +8,7 @@ from networks.DCDepth import DCDepth
 from pytorch_lightning import LightningModule
 from torch.optim import AdamW
 
-from utils import post_process_depth, flip_lr, compute_errors_pth, colormap, inv_normalize, colormap_magma
+from utils import flip_tta, compute_errors_pth, colormap, inv_normalize, colormap_magma
 from .registry import MODELS
 from .utils import SmoothRegularity
 
@@ -260,14 +260,11 @@ class DCTProg(LightningModule):
             # print('Has no valid depth.')
             return
 
-        depths = self.model(image)
-        depth = self.output2metric(depths[-1])
+        forward = lambda x: self.output2metric(self.model(x)[-1])
         if post_process:
-            image_flipped = flip_lr(image)
-            depth_flipped = self.output2metric(self.model(image_flipped)[-1])
-            pred_depth = post_process_depth(depth, depth_flipped)
+            pred_depth = flip_tta(forward, image)
         else:
-            pred_depth = depth
+            pred_depth = forward(image)
 
         pred_depth = pred_depth.squeeze()
         gt_depth = gt_depth.squeeze()
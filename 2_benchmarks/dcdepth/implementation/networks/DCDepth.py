@@ -103,8 +103,15 @@ class DCDepth(nn.Module):
             if param not in param_1x:
                 yield param
 
-    def forward(self, imgs: torch.Tensor, max_iters: int = None, return_freq_maps: bool = False):
-        assert imgs.shape[-2:] == self.img_size, f'Input image size {imgs.shape[-2:]} is not equal to {self.img_size}.'
+    def hidden_state(self, imgs: torch.Tensor):
+        """
+        Initial hidden state of the depth update (backbone, PFF decoder and CRFs)
+        :param imgs: (B, 3, H, W)
+        :return: (B, hidden_dim, H / 8, W / 8), one cell per DCT patch
+        """
+        # img_size None accepts any size (tiled inference, see server_python/tiled_inference.py); all configs use ape=False
+        assert self.img_size is None or imgs.shape[-2:] == self.img_size, \
+            f'Input image size {imgs.shape[-2:]} is not equal to {self.img_size}.'
 
         feats = self.backbone(imgs)
         pff_out = self.decoder(*feats)
@@ -121,10 +128,19 @@ class DCDepth(nn.Module):
                 torch.cat([e1, context], 1)
             )
         )
+        return gru_hidden
 
-        depths = self.update(gru_hidden, max_iters=max_iters)
+    def forward(self, imgs: torch.Tensor, max_iters: int = None, return_freq_maps: bool = False,
+                tol: float = None, per_patch: bool = False):
+        """
+        :param tol, per_patch: adaptive early exit of the depth update, see DepthUpdateModule.forward.
+                               In eval the iterations used are returned after the depths
+        """
+        gru_hidden = self.hidden_state(imgs)
+        depths = self.update(gru_hidden, max_iters=max_iters, tol=tol, per_patch=per_patch,
+                             return_freq_maps=return_freq_maps)
 
-        if self.training:
+        if self.training or return_freq_maps:
             return depths
         else:
-            return depths if return_freq_maps else depths[0]
+            return depths[0] if tol is None else (depths[0], depths[-1])
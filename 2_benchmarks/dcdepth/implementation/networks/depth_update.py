@@ -35,6 +35,13 @@ class DepthUpdateModule(nn.Module):
 
         # define modules
         self.dct = DCT2(self.patch_size)
+        # inverse DCT + unpatchify of freq2depth as one (p * p, p * p) matrix, see fused_freq2depth
+        dct_mtx = self.dct._dct_mtx
+        self.register_buffer('_idct_kernel',
+                             (torch.kron(dct_mtx, dct_mtx).t() * (self.scale * self.patch_size * 0.5)).contiguous(),
+                             persistent=False)
+        # eval fast path of forward: in-place updates and fused_freq2depth
+        self.fast_inference = True
         self.in_proj = InputProjection(hidden_dim, self.patch_size)
         self.gru = SepConvGRU(hidden_dim, self.in_proj.out_chs)
 
@@ -101,12 +108,27 @@ class DepthUpdateModule(nn.Module):
         """
         B, _, H, W = depth_freq.shape
 
-        depth = self.freq_mtx(depth_freq)
-        depth = self.dct.inv_transform(depth) * (self.scale * self.patch_size * 0.5)  # depth in log space or metric space
-        depth = unpatchify(depth).contiguous().unsqueeze(1)
+        # the inverse DCT stays in fp32 under autocast (mixed precision)
+        with torch.autocast(device_type=depth_freq.device.type, enabled=False):
+            depth = self.freq_mtx(depth_freq.float())
+            depth = self.dct.inv_transform(depth) * (self.scale * self.patch_size * 0.5)  # depth in log space or metric space
+            depth = unpatchify(depth).contiguous().unsqueeze(1)
 
         return depth
 
+    def fused_freq2depth(self, depth_freq: torch.Tensor):
+        """
+        Same as freq2depth, as one matmul with the precomputed inverse DCT kernel and one reshape
+        :param depth_freq: (b, p * p, h, w)
+        :return: depth in log space, (b, 1, h * p, w * p)
+        """
+        B, _, H, W = depth_freq.shape
+        p = self.patch_size
+
+        with torch.autocast(device_type=depth_freq.device.type, enabled=False):  # fp32, as in freq2depth
+            depth = torch.matmul(self._idct_kernel, depth_freq.float().reshape(B, p * p, H * W))  # (b, p * p, h * w)
+        return depth.view(B, p, p, H, W).permute(0, 3, 1, 4, 2).reshape(B, 1, H * p, W * p)
+
     def generate_freq_sequence(self, freq_map: torch.Tensor, idx: int):
         """
         Generate frequency sequence as the input of gru cell
@@ -125,17 +147,43 @@ class DepthUpdateModule(nn.Module):
 
         return sequence
 
-    def forward(self, gru_hidden: torch.Tensor, max_iters: int = None):
+    def update_magnitude(self, coe_update: torch.Tensor, per_patch: bool = False):
+        """
+        RMS change of the output depth (log or metric space) caused by a coefficient update. The DCT is
+        orthonormal, so this is the RMS of the coefficient update times the scale applied in freq2depth
+        :param coe_update: (B, C, H, W), the update of C <= p * p coefficients (the others being zero)
+        :param per_patch: one value per patch instead of one per image
+        :return: (B, H, W) if per_patch else (B, 1, 1)
+        """
+        factor = self.scale * self.patch_size * 0.5
+        mean_square = coe_update.float().square().sum(1) / self.patch_size ** 2
+        if per_patch:
+            return mean_square.sqrt() * factor
+        return mean_square.mean((1, 2)).sqrt().view(-1, 1, 1) * factor
+
+    def forward(self, gru_hidden: torch.Tensor, max_iters: int = None, tol: float = None, per_patch: bool = False,
+                return_freq_maps: bool = False):
         """
         Progressively predict the coefficient of each component
         :param gru_hidden:
         :param max_iters:
-        :return: depth in log space
+        :param tol: adaptive early exit (eval only). An image (or a patch, with per_patch) stops being refined
+                    after the first step whose update changes its depth by less than tol (RMS, output space);
+                    the loop ends once every image (patch) has stopped
+        :param per_patch: apply tol per patch instead of per image
+        :param return_freq_maps: keep the frequency map of every step (eval), otherwise freq_maps is empty
+        :return: depth in log space; in eval with tol, also the number of iterations used by each image (B,)
+                 or patch (B, 1, h, w)
         """
         B, _, H, W = gru_hidden.shape
 
-        # frequency map
-        freq_map = torch.zeros(B, self.patch_size ** 2, H, W).type_as(gru_hidden)
+        # in eval (with fast_inference) the frequency map is updated in place, without the scatter checks,
+        # and converted with fused_freq2depth. Inference only: in-place updates break backward
+        fast = self.fast_inference and not self.training
+
+        # frequency map, accumulated in (at least) fp32 also under autocast
+        freq_map = gru_hidden.new_zeros(B, self.patch_size ** 2, H, W,
+                                        dtype=torch.promote_types(gru_hidden.dtype, torch.float32))
 
         # store results
         depths = []
@@ -146,6 +194,13 @@ class DepthUpdateModule(nn.Module):
         if max_iters is None:
             max_iters = self.n_steps
         assert 0 < max_iters <= self.n_steps
+
+        # images (B, 1, 1) or patches (B, H, W) still being refined, and their iteration count
+        adaptive = tol is not None and not self.training
+        if adaptive:
+            active = torch.ones((B, H, W) if per_patch else (B, 1, 1), dtype=torch.bool, device=gru_hidden.device)
+            num_iters = torch.zeros(active.shape, dtype=torch.long, device=gru_hidden.device)
+
         for idx in range(max_iters):
             # update gru_hidden when idx > 0
             if idx > 0:
@@ -169,33 +224,55 @@ class DepthUpdateModule(nn.Module):
             # predict the coefficients
             out = self.heads(gru_hidden, idx)  # (b, o, h, w)
 
-            # scatter to correct position
-            if idx < self.n_steps - 1:
-                coe_update = torch.zeros(B, self.patch_size ** 2, H, W).type_as(gru_hidden)
-                self.scatter_freq(coe_update, out, idx)
-            else:
-                coe_update = out
+            # freeze the converged images / patches
+            if adaptive:
+                out = out * active.unsqueeze(1).type_as(out)
+                num_iters += active
+                active = active & (self.update_magnitude(out, per_patch) >= tol)
 
-            # update predicted coefficients
-            freq_map = coe_update + freq_map.detach()
+            if fast:
+                # add the update at its positions of the frequency map, in place
+                if idx < self.n_steps - 1:
+                    freq_map.scatter_add_(1, getattr(self, f'_indices_{idx}').expand_as(out), out.type_as(freq_map))
+                else:
+                    freq_map.add_(out)
 
-            # compute frequency regularity
-            if self.training:
-                if idx > 0:
-                    freq_reg = self.freq_reg(self.freq_mtx(freq_map))
+                # update current state
+                depth = self.fused_freq2depth(freq_map)
+            else:
+                # scatter to correct position
+                if idx < self.n_steps - 1:
+                    coe_update = torch.zeros(B, self.patch_size ** 2, H, W).type_as(gru_hidden)
+                    self.scatter_freq(coe_update, out, idx)
                 else:
-                    freq_reg = torch.zeros(1).type_as(gru_hidden)
-                freq_regs.append(freq_reg)
+                    coe_update = out
 
-            # update current state
-            depth = self.freq2depth(freq_map)
+                # update predicted coefficients
+                freq_map = coe_update + freq_map.detach()
+
+                # compute frequency regularity
+                if self.training:
+                    if idx > 0:
+                        freq_reg = self.freq_reg(self.freq_mtx(freq_map))
+                    else:
+                        freq_reg = torch.zeros(1).type_as(gru_hidden)
+                    freq_regs.append(freq_reg)
+
+                # update current state
+                depth = self.freq2depth(freq_map)
 
             # store intermediate results
             depths.append(depth)
-            freq_maps.append(freq_map.detach().clone())
+            if return_freq_maps:
+                freq_maps.append(freq_map.detach().clone())
+
+            if adaptive and not active.any():
+                break
 
         if self.training:
             return depths, freq_regs
+        elif adaptive:
+            return depths, freq_maps, (num_iters.unsqueeze(1) if per_patch else num_iters.view(B))
         else:
             return depths, freq_maps
 
@@ -322,6 +399,9 @@ class FrequencyModule(nn.Module):
         # layer norm
         self.norm = nn.LayerNorm(n_dim)
 
+        # eval path of InputProjection: forward_channels instead of forward
+        self.fast_inference = True
+
         self._init_weights()
 
     @torch.no_grad()
@@ -358,6 +438,61 @@ class FrequencyModule(nn.Module):
 
         return x.squeeze(1)  # (B * H * W, C)
 
+    def forward_channels(self, x: torch.Tensor):
+        """
+        Same as forward, in channel-first layout and without the per-pixel token sequences. The query only
+        depends on the cls token, so it is folded into the key projection (one logit per head, the key bias
+        cancels in the softmax). Keys and values are then a single 1x1 projection (a matmul over the channels)
+        with the layer norm folded in, and the attention is a softmax over the L axis. Inference only: the
+        projection is normalized in place
+        :param x: (B, L, H, W)
+        :return: (B, C, H, W)
+        """
+        B, L, H, W = x.shape
+        attn, norm = self.attn, self.norm
+        n_heads, head_dim, C = attn.num_heads, attn.head_dim, self.n_dim
+
+        # tokens, (B * L, C, H * W), and their layer norm statistics over the channels, (B * L, 1, H * W)
+        x = self.tokenize(x.view(B * L, 1, H, W)).view(B, L, C, H, W) + self.pos_embed[0, : L, :, None, None]
+        x = x.view(B * L, C, H * W)
+        average = x.new_full((1, C), 1. / C)
+        mean = torch.matmul(average, x)
+        rstd = torch.rsqrt((torch.matmul(average, x.square()) - mean.square()).clamp_min(0.) + norm.eps)
+
+        # key projection folded with the query, and value projection, (nH + C, C)
+        cls = norm(self.cls_token).view(C)
+        q = attn.q(cls).view(n_heads, head_dim) * attn.scale
+        w_k, w_v = attn.kv.weight.view(2, n_heads, head_dim, C).unbind(0)
+        weight = torch.cat([torch.einsum('hd,hdc->hc', q, w_k), w_v.reshape(C, C)], 0)
+        bias = q.new_zeros(n_heads + C)
+        if attn.kv.bias is not None:
+            bias[n_heads:] = attn.kv.bias[C:]
+        cls_proj = weight @ cls + bias  # logits and values of the cls token
+
+        # projections of the normalized tokens from the raw ones:
+        # W ((x - mean) * rstd * g + b) = (W g x - sum(W g) * mean) * rstd + W b
+        bias = bias + weight @ norm.bias
+        weight = weight * norm.weight
+        x = torch.matmul(weight, x).addcmul_(weight.sum(1)[:, None], mean, value=-1.).mul_(rstd).add_(bias[:, None])
+        x = x.view(B, L, n_heads + C, H, W)
+
+        # single-query attention over [cls, tokens], softmax over the L axis, (B, L + 1, nH, 1, H, W)
+        weights = torch.cat(
+            [
+                cls_proj[: n_heads].view(1, 1, n_heads, 1, 1).expand(B, 1, n_heads, H, W),
+                x[:, :, : n_heads]
+            ], 1
+        ).softmax(1).unsqueeze(3)
+
+        # weighted sum of the values, (B, C, H, W)
+        out = (x[:, :, n_heads:].view(B, L, n_heads, head_dim, H, W) * weights[:, 1:]).sum(1)
+        out = out + cls_proj[n_heads:].view(1, n_heads, head_dim, 1, 1) * weights[:, 0]
+        out = out.view(B, C, H * W)
+
+        # output projection and residual of the cls token
+        out = torch.matmul(attn.proj.weight, out) + (attn.proj.bias + self.cls_token.view(C))[:, None]
+        return out.view(B, C, H, W)
+
 
 class InputProjection(nn.Module):
     def __init__(self, hidden_dim: int, patch_size: int):
@@ -397,7 +532,10 @@ class InputProjection(nn.Module):
         #
         # Compute frequency feature
         #
-        sequence = self.depth_freq_in(freq_sequence).view(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
+        if self.depth_freq_in.fast_inference and not self.training:
+            sequence = self.depth_freq_in.forward_channels(freq_sequence)
+        else:
+            sequence = self.depth_freq_in(freq_sequence).view(B, H, W, -1).permute(0, 3, 1, 2).contiguous()
 
         # concat and attn
         out = self.fuse(
@@ -1,5 +1,6 @@
 import os
 import os.path as osp
+from functools import partial
 from argparse import ArgumentParser
 import glob 
 from PIL import Image 
@@ -10,7 +11,7 @@ import torch
 import torchvision.transforms as transforms 
 
 from models.utils import MetricTool
-from utils import compute_errors_pth, flip_lr, post_process_depth
+from utils import compute_errors_pth, flip_tta
 
 try:
     from mmcv import Config
@@ -21,6 +22,8 @@ from dataloaders import DATAMODULES
 from models import MODELS
 from tqdm import tqdm
 from utils import inv_normalize
+# Inferencia por tiles compartida con el servidor de profundidad (ver depth_common/__init__.py)
+from depth_common.tiling import fit_tiles, tiled_forward, window_alignment
 
 
 def parse_args():
@@ -54,6 +57,38 @@ def parse_args():
         help='Path to a directory to save the results.'
     )
     # --- FIN DE LA CORRECCIÓN ---
+    parser.add_argument(
+        '--tile_size',
+        type=int,
+        nargs=2,
+        default=None,
+        help='Tiled inference in process_folder: tile height and width (multiples of the window alignment).'
+    )
+    parser.add_argument(
+        '--max_memory_mb',
+        type=float,
+        default=None,
+        help='Tiled inference in process_folder: pick the tile for this peak activation memory target.'
+    )
+    parser.add_argument(
+        '--tile_overlap',
+        type=int,
+        default=32,
+        help='Minimum overlap between tiles, also the feathering ramp.'
+    )
+    parser.add_argument(
+        '--tile_batch',
+        type=int,
+        default=1,
+        help='Tiles per forward pass (at most, with --max_memory_mb).'
+    )
+    parser.add_argument(
+        '--precision',
+        type=str,
+        choices=['fp32', 'bf16'],
+        default='fp32',
+        help='process_folder: bf16 runs the network under CPU autocast (the inverse DCT stays in fp32).'
+    )
 
     return parser.parse_args()
 
@@ -94,6 +129,30 @@ def process_folder(args, cfg, post_process: bool):
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
     ])
 
+    # Red completa a profundidad métrica; con --precision bf16 bajo autocast de CPU
+    def depth_fn(x):
+        with torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.precision == 'bf16'):
+            output = model(x)[-1]
+        return to_metric_depth(output.float(), cfg.model.output_space)
+
+    # Inferencia por tiles: el pico de activaciones sigue al tile y no a la imagen
+    tile_size, tile_batch = args.tile_size, args.tile_batch
+    if tile_size or args.max_memory_mb:
+        model.img_size = None  # Acepta el tamaño de cada tile
+        align = window_alignment(model)
+    fitted = {}  # (alto, ancho) de la entrada -> (tile, tiles por forward) de fit_tiles
+
+    def tiles_for(image_size):
+        if not args.max_memory_mb:
+            return tile_size, tile_batch
+        if image_size not in fitted:
+            size, batch, peak = fit_tiles(depth_fn, image_size, args.max_memory_mb, args.tile_overlap, align,
+                                          args.tile_batch)
+            print(f"{image_size[0]}x{image_size[1]}: tiles de {size[0]}x{size[1]} de a {batch} "
+                  f"(pico {peak / 2**20:.0f} MB)")
+            fitted[image_size] = size, batch
+        return fitted[image_size]
+
     # Buscamos las imágenes DENTRO de la subcarpeta 'images'
     search_path = osp.join(args.input_dir, 'images')
     print(f"Buscando imágenes en la subcarpeta específica: {search_path}")
@@ -112,15 +171,15 @@ def process_folder(args, cfg, post_process: bool):
         image_tensor = transform(image_pil).unsqueeze(0).to(device)
 
         # Inferencia
-        depths = model(image_tensor)
-        depth = to_metric_depth(depths[-1], cfg.model.output_space)
-        
+        forward = depth_fn
+        if tile_size is not None or args.max_memory_mb:
+            size, batch = tiles_for(tuple(image_tensor.shape[-2:]))
+            forward = partial(tiled_forward, forward, tile_size=size, overlap=args.tile_overlap,
+                              align=align, batch_size=batch)
         if post_process:
-            image_flipped = flip_lr(image_tensor)
-            depth_flipped = to_metric_depth(model(image_flipped)[-1], cfg.model.output_space)
-            pred_depth = post_process_depth(depth, depth_flipped)
+            pred_depth = flip_tta(forward, image_tensor)
         else:
-            pred_depth = depth
+            pred_depth = forward(image_tensor)
             
         pred_depth = pred_depth.squeeze().cpu().numpy()
 
@@ -209,14 +268,11 @@ def test(post_process: bool):
         gt_depth = batch['depth'].to(device)
         has_valid_depth = batch['has_valid_depth']
 
-        depths = model(image)
-        depth = to_metric_depth(depths[-1], cfg.model.output_space)
+        forward = lambda x: to_metric_depth(model(x)[-1], cfg.model.output_space)
         if post_process:
-            image_flipped = flip_lr(image)
-            depth_flipped = to_metric_depth(model(image_flipped)[-1], cfg.model.output_space)
-            pred_depth = post_process_depth(depth, depth_flipped)
+            pred_depth = flip_tta(forward, image)
         else:
-            pred_depth = depth
+            pred_depth = forward(image)
 
         pred_depth = pred_depth.squeeze()
 
@@ -1,10 +1,15 @@
 # Archivo: ~/Documentos/PixelFormer/benchmark_pixel.py
 import time
 import os
+import argparse
 import torch
 import numpy as np
+from PIL import Image
 from tqdm import tqdm # Barra de progreso
-from infer_flask_pixelformer import DepthService, MODEL_PATH, BACKBONE_PATH
+from infer_flask_pixelformer import DepthService, MODEL_PATH
+from worker_pool import benchmark_pool
+from fast_load import profile_peak_bytes
+from depth_common.tta import flip_tta
 
 # --- CONFIGURACIÓN ---
 IMG_DIR = os.path.expanduser("~/Documentos/benchmark_images")
@@ -16,7 +21,7 @@ def run_benchmark():
     
     # 1. Cargar el Modelo (Tal cual lo hace tu servidor)
     print("-> Cargando Servicio y Modelo...")
-    service = DepthService(MODEL_PATH, BACKBONE_PATH)
+    service = DepthService(MODEL_PATH)
     
     # 2. Obtener imágenes
     images = [os.path.join(IMG_DIR, f) for f in os.listdir(IMG_DIR) if f.endswith(".jpg")]
@@ -57,5 +62,72 @@ def run_benchmark():
     print(f"FPS Estimado:     {fps:.4f} FPS")
     print("="*40 + "\n")
 
+def run_worker_sweep(args):
+    """Barrido workers x threads del pool de procesos: throughput y p99."""
+    print(f"=== BENCHMARK: POOL DE WORKERS (PIXELFORMER) ===")
+    service = DepthService(MODEL_PATH)
+
+    images = [os.path.join(IMG_DIR, f) for f in os.listdir(IMG_DIR) if f.endswith(".jpg")]
+    if not images:
+        print("ERROR: No hay imágenes en ~/Documentos/benchmark_images")
+        return
+    inputs = [service.transform(Image.open(p).convert('RGB')).unsqueeze(0) for p in images]
+
+    benchmark_pool(service.model, inputs, args.sweep_workers, args.sweep_threads,
+                   num_requests=args.requests)
+
+def run_tta_comparison(args):
+    """Flip-TTA con dos forwards secuenciales contra un solo forward de batch 2 (flip_tta)."""
+    print(f"=== BENCHMARK: FLIP-TTA SECUENCIAL VS BATCH (PIXELFORMER) ===")
+    service = DepthService(MODEL_PATH)
+    model = service.model
+
+    images = [os.path.join(IMG_DIR, f) for f in os.listdir(IMG_DIR) if f.endswith(".jpg")]
+    if not images:
+        print("ERROR: No hay imágenes en ~/Documentos/benchmark_images")
+        return
+    inputs = [service.transform(Image.open(p).convert('RGB')).unsqueeze(0) for p in images]
+
+    def sequential(image):
+        return flip_tta(model, image, batched=False)
+
+    def batched(image):
+        return flip_tta(model, image, batched=True)
+
+    results = {}
+    with torch.no_grad():
+        max_abs = max(float((sequential(x) - batched(x)).abs().max()) for x in inputs)
+        for name, fn in (('sin_tta', model), ('secuencial', sequential), ('batch', batched)):
+            fn(inputs[0])  # Warmup
+            times = []
+            for i in tqdm(range(args.requests), desc=name):
+                start = time.time()
+                fn(inputs[i % len(inputs)])
+                times.append(time.time() - start)
+            results[name] = (np.mean(times) * 1000, profile_peak_bytes(fn, inputs[0])[0] / 2**20)
+
+    print(f"\n{'modo':<12} {'mean_ms':>10} {'peak_MB':>10}")
+    for name, (mean_ms, peak_mb) in results.items():
+        print(f"{name:<12} {mean_ms:10.1f} {peak_mb:10.1f}")
+    print(f"max |secuencial - batch|: {max_abs:.2e} m")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark de PixelFormer en CPU')
+    parser.add_argument('--sweep_workers', type=int, nargs='+', default=None,
+                        help='si se indica, barre el pool de workers con estos tamaños')
+    parser.add_argument('--sweep_threads', type=int, nargs='+', default=[1, 2, 4],
+                        help='hilos por worker a probar en el barrido')
+    parser.add_argument('--tta', action='store_true',
+                        help='compara flip-TTA secuencial (2 forwards) contra un forward de batch 2')
+    parser.add_argument('--requests', type=int, default=ITERATIONS,
+                        help='requests por configuración del barrido')
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    run_benchmark()
\ No newline at end of file
+    args = parse_args()
+    if args.sweep_workers:
+        run_worker_sweep(args)
+    elif args.tta:
+        run_tta_comparison(args)
+    else:
+        run_benchmark()
\ No newline at end of file
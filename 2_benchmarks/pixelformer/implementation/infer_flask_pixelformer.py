@@ -1,13 +1,16 @@
 import os
 import sys
 import time
+import argparse
+import threading
+from collections import OrderedDict
 import torch
 import numpy as np
 from torchvision import transforms
 from PIL import Image
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from collections import OrderedDict
+import json
 import base64
 from io import BytesIO
 
@@ -15,6 +18,9 @@ from io import BytesIO
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 PIXELFORMER_SRC_PATH = os.path.join(SCRIPT_DIR, "pixelformer")
 sys.path.append(PIXELFORMER_SRC_PATH)
+# Utilidades compartidas con los servidores de profundidad de DeepDSO
+DEPTH_SERVER_PATH = os.path.abspath(os.path.join(SCRIPT_DIR, "..", "..", "..", "3_deepdso_slam", "server_python"))
+sys.path.append(DEPTH_SERVER_PATH)
 
 try:
     from networks.PixelFormer import PixelFormer
@@ -23,43 +29,46 @@ except ImportError as e:
     print(f"Detalle del error: {e}")
     sys.exit(1)
 
+from micro_batcher import MicroBatcher, FrameDropped
+from worker_pool import WorkerPool, single_threaded, run_forked
+from depth_encoding import available_encodings, encode_depth, negotiate
+from depth_cache import DepthCache
+from fast_load import load_pretrained
+from fused_attention import set_fused_attention
+from quantize import quantize_dynamic, read_split, accuracy_gate, print_report
+from precision import PRECISIONS, with_precision
+from keyframe_depth import KeyframeDepth, PoseNet, NYU_INTRINSICS
+from depth_common.tta import flip_tta
+from stage_metrics import StageMetrics, instrument_app, stage, record, time_encoder_decoder
+
 # --- 2. CONFIGURACIÓN DEL MODELO ---
-MODEL_PATH = os.path.join(SCRIPT_DIR, "pretrained/checkpoints/nyu.pth")
-BACKBONE_PATH = os.path.join(SCRIPT_DIR, "pretrained/backbone/swin_large_patch4_window7_224_22k.pth")
-
-# --- FUNCIÓN DE UTILIDAD: Limpiar llaves 'module.' ---
-def clean_state_dict(state_dict):
-    new_state_dict = OrderedDict()
-    for k, v in state_dict.items():
-        name = k
-        if name.startswith('module.'):
-            name = name[7:]
-        new_state_dict[name] = v
-    return new_state_dict
+# Si existe la versión convertida con `fast_load.py` (mapeable en memoria) se usa esa
+MODEL_PATH = os.path.join(SCRIPT_DIR, "pretrained/checkpoints/nyu.safetensors")
+if not os.path.exists(MODEL_PATH):
+    MODEL_PATH = os.path.join(SCRIPT_DIR, "pretrained/checkpoints/nyu.pth")
+# Split con ground truth para el control de precisión del modo int8
+QUANT_SPLIT = os.path.join(SCRIPT_DIR, "data_splits/nyudepthv2_test_files_with_gt.txt")
 
 # --- 3. CLASE DE SERVICIO ---
 class DepthService:
-    def __init__(self, model_path, backbone_path):
+    def __init__(self, model_path):
         self.device = torch.device("cpu")
         print(f"INFO: Configurando dispositivo: {self.device}")
         print("INFO: Cargando modelo PixelFormer (Versión LARGE07)...")
         
         try:
-            self.model = PixelFormer(version='large07', inv_depth=False, max_depth=10.0, pretrained=backbone_path)
-            
+            # nyu.pth trae todos los pesos (strict=True): no hace falta leer ni
+            # inicializar el backbone Swin de ImageNet-22k antes de cargarlo
             print(f"INFO: Cargando pesos de NYU desde {model_path}...")
-            checkpoint = torch.load(model_path, map_location=self.device)
-            
-            if 'model' in checkpoint:
-                state_dict = checkpoint['model']
-            else:
-                state_dict = checkpoint
-            
-            state_dict = clean_state_dict(state_dict)
-            self.model.load_state_dict(state_dict, strict=True)
+            # Un solo hilo intra-op: --workers hace fork de este proceso después (ver worker_pool.py)
+            with single_threaded():
+                self.model = load_pretrained(
+                    lambda: PixelFormer(version='large07', inv_depth=False, max_depth=10.0, pretrained=None),
+                    model_path)
             
             self.model.to(self.device)
-            self.model.eval()
+            # Reparte el forward en 'encoder' (Swin) y 'decoder' (PQI + SAM + cabeza) en /metrics
+            time_encoder_decoder(self.model, self.model.backbone)
             print("INFO: ¡Modelo PixelFormer cargado exitosamente!")
 
         except Exception as e:
@@ -75,48 +84,257 @@ class DepthService:
             transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
         ])
 
-    def predict_depth(self, image_source):
+        # Micro-batching, pool de workers, caché, int8, bf16 y keyframes opcionales (ver enable_batching /
+        # enable_worker_pool / enable_cache / enable_quantization / enable_precision / enable_keyframes)
+        self.batcher = None
+        self.pool = None
+        self.cache = None
+        self.quantization = None
+        self.precision = 'fp32'
+        self.keyframes = None
+
+    def enable_keyframes(self, pose_model_path=None, max_sessions=8, **options):
         """
-        Predice el mapa de profundidad desde una imagen.
-        
+        Modo keyframe por sesión (X-Session-Id): el modelo corre solo en los keyframes y los
+        demás frames reciben la profundidad del último keyframe reproyectada con la pose del
+        header X-Camera-Pose o, si no viene, con la del PoseNet de Monodepth2 de
+        `pose_model_path` (ver keyframe_depth.py). Los requests sin sesión corren el modelo.
+
+        Args:
+            max_sessions: sesiones con keyframe en memoria (se olvida la menos reciente)
+            options: umbrales de KeyframeDepth (max_interval, max_rotation_deg, ...)
+        """
+        # Como el modelo: construir el PoseNet con un solo hilo deja hacer el fork de --workers
+        with single_threaded():
+            self.pose_net = PoseNet(pose_model_path) if pose_model_path else None
+        self.keyframe_options = options
+        self.max_sessions = max_sessions
+        self.keyframes = OrderedDict()  # sesión -> (KeyframeDepth, lock)
+        self.keyframes_lock = threading.Lock()
+        # Para volver de la entrada normalizada a la imagen en [0, 1]
+        self.image_mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+        self.image_std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+        print(f"INFO: Modo keyframe activo (pose: {'PoseNet ' + pose_model_path if pose_model_path else 'X-Camera-Pose'})")
+
+    def session_keyframes(self, session):
+        """(KeyframeDepth, lock) de la sesión, creado si no existe."""
+        with self.keyframes_lock:
+            entry = self.keyframes.pop(session, None)
+            if entry is None:
+                entry = (KeyframeDepth(NYU_INTRINSICS, (480, 640), self.pose_net, **self.keyframe_options),
+                         threading.Lock())
+            self.keyframes[session] = entry
+            while len(self.keyframes) > self.max_sessions:
+                self.keyframes.popitem(last=False)
+        return entry
+
+    def infer_keyframes(self, img_tensor, session, deadline=None, tta=False, camera_pose=None):
+        """
+        Como infer(), en modo keyframe: solo los keyframes pasan por el modelo.
+        timing["keyframe"] trae si el frame fue keyframe (y por qué) o la antigüedad y
+        la calidad de la reproyección (ver KeyframeDepth.__call__).
+        """
+        start_time = time.time()
+        keyframes, lock = self.session_keyframes(session)
+        timing = {}
+
+        def depth_fn():
+            pred_depth, infer_timing = self.infer(img_tensor, session, deadline, tta)
+            timing.update(infer_timing)
+            return pred_depth
+
+        image = (img_tensor * self.image_std + self.image_mean).unsqueeze(0).to(self.device)
+        with lock, torch.no_grad():
+            pred_depth, info = keyframes(image, depth_fn, camera_pose)
+        if not info["keyframe"]:
+            record('propagate', (time.time() - start_time) * 1000)
+        timing["keyframe"] = info
+        timing["inference_ms"] = round((time.time() - start_time) * 1000, 2)
+        return pred_depth, timing
+
+    def enable_precision(self, precision):
+        """
+        Ejecuta el modelo bajo autocast de CPU con `precision` ('bf16'); la softmax y el
+        cumsum de los bins quedan en fp32 y la profundidad sale en fp32 (ver precision.py).
+        Debe llamarse antes de enable_batching / enable_worker_pool.
+        """
+        self.model = with_precision(self.model, precision)
+        self.precision = precision
+
+    def enable_quantization(self, data_path, split_file=QUANT_SPLIT, num_samples=16, max_abs_rel_delta=0.01):
+        """
+        Pasa los nn.Linear del modelo a int8 (cuantización dinámica) si abs_rel sobre
+        `num_samples` imágenes del split no empeora más de `max_abs_rel_delta`.
+        El control de precisión corre en un proceso hijo (run_forked), así el servidor
+        puede crear el WorkerPool después. Debe llamarse antes de enable_batching /
+        enable_worker_pool.
+
+        Returns:
+            True si el modelo int8 quedó activo
+        """
+        from utils import compute_errors
+
+        # La copia conserva los hooks de /metrics del modelo original
+        with single_threaded():
+            quantized = quantize_dynamic(self.model)
+
+        def predictor(model):
+            def predict(img):
+                with torch.no_grad():
+                    return model(self.transform(img).unsqueeze(0).to(self.device)).squeeze().cpu().numpy()
+            return predict
+
+        samples = read_split(split_file, data_path, num_samples=num_samples)
+        # Las inferencias del control, con todos los hilos, en un hijo: el fork de
+        # --workers se colgaría si el proceso ya ejecutó regiones paralelas
+        accepted, report = run_forked(accuracy_gate, predictor(self.model), predictor(quantized), samples,
+                                      compute_errors, 1000.0, 1e-3, 10.0, max_abs_rel_delta)
+        print_report("PixelFormer", accepted, report)
+        self.quantization = dict(report, enabled=accepted)
+        if accepted:
+            self.model = quantized
+        return accepted
+
+    def enable_batching(self, max_batch_size, max_wait_ms, max_queue=0):
+        """
+        Agrupa requests concurrentes en un solo forward de hasta `max_batch_size` imágenes.
+        Con `max_queue > 0` la cola de inferencia queda acotada (ver MicroBatcher).
+        """
+        self.batcher = MicroBatcher(self.model, max_batch_size, max_wait_ms, max_queue)
+        print(f"INFO: Micro-batching activo (max_batch_size={max_batch_size}, "
+              f"max_wait_ms={max_wait_ms}, max_queue={max_queue})")
+
+    def enable_worker_pool(self, num_workers, num_threads):
+        """
+        Reparte los requests entre `num_workers` procesos con `num_threads` hilos
+        intra-op y núcleos propios cada uno. Debe llamarse antes de la primera inferencia.
+        """
+        self.pool = WorkerPool(self.model, num_workers, num_threads)
+        print(f"INFO: Pool de {num_workers} workers con {num_threads} hilos cada uno")
+
+    def enable_cache(self, max_mb, ttl_s=0):
+        """Reutiliza la profundidad de frames idénticos (hash de los bytes de la imagen)."""
+        self.cache = DepthCache(int(max_mb * 1024 * 1024), ttl_s)
+        print(f"INFO: Caché de profundidad activa ({max_mb} MB, ttl={ttl_s}s)")
+
+    def infer(self, img_tensor, session=None, deadline=None, tta=False):
+        """
+        Ejecuta el modelo sobre un tensor (C, H, W) ya preprocesado.
+
+        Args:
+            session: id de sesión del cliente (un frame nuevo reemplaza al que espera)
+            deadline: instante time.time() tras el cual el frame se descarta
+            tta: flip-TTA (imagen y espejo, mezclados con post_process_depth)
+
+        Returns:
+            (pred_depth, timing) con pred_depth de forma (1, 1, H, W)
+
+        Raises:
+            FrameDropped si el frame se descartó en la cola
+        """
+        start_time = time.time()
+        if tta:
+            # No pasa por el micro-batcher (ni por su cola ni su deadline). En CPU
+            # flip_tta hace dos forwards: uno de batch 2 tarda lo mismo y duplica la
+            # memoria pico (ver benchmark_pixel.py --tta)
+            forward = self.pool.run if self.pool is not None else self.model
+            with torch.no_grad(), stage('forward'):
+                pred_depth = flip_tta(forward, img_tensor.unsqueeze(0).to(self.device))
+            timing = {"tta": True}
+        elif self.batcher is not None:
+            pred_depth, timing = self.batcher.submit(img_tensor.to(self.device), session, deadline)
+            pred_depth = pred_depth.unsqueeze(0)
+            record('queue', timing["queue_ms"])
+            record('forward', timing["batch_forward_ms"])
+        elif self.pool is not None:
+            with stage('forward'):
+                pred_depth = self.pool.run(img_tensor.unsqueeze(0).to(self.device))
+            timing = {}
+        else:
+            with torch.no_grad():
+                pred_depth = self.model(img_tensor.unsqueeze(0).to(self.device))
+            timing = {}
+        timing["inference_ms"] = round((time.time() - start_time) * 1000, 2)
+        return pred_depth, timing
+
+    def predict_depth_map(self, image_source, session=None, deadline=None, tta=False, camera_pose=None):
+        """
+        Predice la profundidad métrica sin empaquetarla.
+
         Args:
             image_source: Puede ser un stream, PIL Image, o bytes
-            
+            session, deadline, tta: ver infer()
+            camera_pose: pose cámara->mundo (4, 4) del frame, para el modo keyframe
+
         Returns:
-            dict con estructura dinBody compatible con Android
+            (depth_map, timing, (original_width, original_height)) con depth_map
+            un array float32 (H, W) en metros
         """
+        cache_key = None
+        if self.cache is not None and not isinstance(image_source, Image.Image):
+            if hasattr(image_source, 'read'):
+                image_source = image_source.read()
+            cache_key = DepthCache.key(image_source, "PixelFormer", "large07", 480, 640, tta)
+            depth_map = self.cache.get(cache_key)
+            if depth_map is not None:
+                original_size = Image.open(BytesIO(image_source)).size
+                return depth_map, {"cache": "hit", "inference_ms": 0.0}, original_size
+
         # Convertir el input a PIL Image
-        if isinstance(image_source, bytes):
-            img = Image.open(BytesIO(image_source)).convert('RGB')
-        elif hasattr(image_source, 'read'):  # Es un stream
-            img = Image.open(image_source).convert('RGB')
-        else:  # Ya es PIL Image
-            img = image_source.convert('RGB')
+        with stage('decode'):
+            if isinstance(image_source, bytes):
+                img = Image.open(BytesIO(image_source)).convert('RGB')
+            elif hasattr(image_source, 'read'):  # Es un stream
+                img = Image.open(image_source).convert('RGB')
+            else:  # Ya es PIL Image
+                img = image_source.convert('RGB')
         
         # Guardar dimensiones originales
-        original_width, original_height = img.size
+        original_size = img.size
         
         # Preprocesar
-        img_tensor = self.transform(img).unsqueeze(0).to(self.device)
+        with stage('preprocess'):
+            img_tensor = self.transform(img)
 
-        # Inferencia
-        with torch.no_grad():
-            start_time = time.time()
-            pred_depth = self.model(img_tensor)
-            inference_time = time.time() - start_time
+        # Inferencia (o reproyección del keyframe de la sesión)
+        if self.keyframes is not None and session is not None:
+            pred_depth, timing = self.infer_keyframes(img_tensor, session, deadline, tta, camera_pose)
+        else:
+            pred_depth, timing = self.infer(img_tensor, session, deadline, tta)
         
         # Procesar salida
-        depth_map = pred_depth.squeeze().cpu().numpy()
+        with stage('postprocess'):
+            depth_map = pred_depth.squeeze().cpu().numpy()
+        # La profundidad reproyectada es aproximada: no se cachea
+        if cache_key is not None and timing.get("keyframe", {}).get("keyframe", True):
+            self.cache.put(cache_key, depth_map)
+            timing["cache"] = "miss"
+        return depth_map, timing, original_size
+
+    def predict_depth(self, image_source, session=None, deadline=None, tta=False, camera_pose=None):
+        """
+        Predice el mapa de profundidad desde una imagen.
         
-        # Normalizar para visualización (0-255)
-        depth_normalized = ((depth_map - depth_map.min()) / 
-                           (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
+        Args:
+            image_source: Puede ser un stream, PIL Image, o bytes
+            session, deadline, tta, camera_pose: ver predict_depth_map()
+            
+        Returns:
+            dict con estructura dinBody compatible con Android
+        """
+        depth_map, timing, (original_width, original_height) = self.predict_depth_map(
+            image_source, session, deadline, tta, camera_pose)
         
-        # Convertir a base64 para transmisión eficiente
-        depth_img = Image.fromarray(depth_normalized, mode='L')
-        buffered = BytesIO()
-        depth_img.save(buffered, format="PNG")
-        depth_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        with stage('encode'):
+            # Normalizar para visualización (0-255)
+            depth_normalized = ((depth_map - depth_map.min()) / 
+                               (depth_map.max() - depth_map.min()) * 255).astype(np.uint8)
+            
+            # Convertir a base64 para transmisión eficiente
+            depth_img = Image.fromarray(depth_normalized, mode='L')
+            buffered = BytesIO()
+            depth_img.save(buffered, format="PNG")
+            depth_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
         
         return {
             "status": "success",
@@ -125,10 +343,7 @@ class DepthService:
                 "version": "large07",
                 "backbone": "swin_transformer"
             },
-            "timing": {
-                "inference_ms": round(inference_time * 1000, 2),
-                "timestamp": time.time()
-            },
+            "timing": dict(timing, timestamp=time.time()),
             "image_info": {
                 "original_width": original_width,
                 "original_height": original_height,
@@ -150,13 +365,16 @@ if not os.path.exists(MODEL_PATH):
     print(f"ERROR: No se encuentra el modelo en {MODEL_PATH}")
     sys.exit(1)
 
-if not os.path.exists(BACKBONE_PATH):
-    print(f"ERROR: No se encuentra el backbone en {BACKBONE_PATH}")
-    sys.exit(1)
-
-depth_service = DepthService(MODEL_PATH, BACKBONE_PATH)
+depth_service = DepthService(MODEL_PATH)
 
 # --- 5. SERVIDOR FLASK ---
+# Deadline por defecto de cada request en ms (0 = sin deadline); ver --deadline_ms
+DEADLINE_MS = 0.0
+# Flip-TTA por defecto (ver --tta); cada request puede pedir '?tta=0/1'
+TTA = False
+# Latencia por etapa de cada request, expuesta en /metrics
+metrics = StageMetrics()
+
 app = Flask(__name__)
 CORS(app)  # Permitir CORS para requests desde Android
 
@@ -184,13 +402,116 @@ def info():
         "server": {
             "version": "2.0",
             "framework": "PyTorch + Flask",
-            "device": "CPU"
+            "device": "CPU",
+            "quantization": depth_service.quantization,
+            "precision": depth_service.precision,
+            "tta_default": TTA,
+            "keyframes": None if depth_service.keyframes is None else {
+                session: keyframes.stats() for session, (keyframes, _) in list(depth_service.keyframes.items())
+            },
+            "workers": None if depth_service.pool is None else {
+                "num_workers": depth_service.pool.num_workers,
+                "threads_per_worker": depth_service.pool.num_threads
+            },
+            "batching": None if depth_service.batcher is None else {
+                "max_batch_size": depth_service.batcher.max_batch_size,
+                "max_wait_ms": depth_service.batcher.max_wait * 1000,
+                "batch_histogram": depth_service.batcher.stats(),
+                "max_queue": depth_service.batcher.queue.maxsize,
+                "queued": depth_service.batcher.queue.qsize(),
+                "dropped": depth_service.batcher.drop_stats()
+            }
         },
+        "depth_encodings": available_encodings(),
         "endpoints": {
             "predict": "/api/v1/predict",
             "health": "/health",
-            "info": "/api/v1/info"
+            "info": "/api/v1/info",
+            "cache_stats": "/api/v1/cache/stats",
+            "metrics": "/metrics"
+        }
+    })
+
+def request_schedule(start_time):
+    """
+    Lee la sesión y el deadline del request:
+    - header 'X-Session-Id' (o campo 'session_id'): un frame nuevo de la sesión
+      reemplaza al anterior si este todavía no entró al modelo
+    - header 'X-Deadline-Ms': presupuesto desde la llegada del request
+      (por defecto DEADLINE_MS; 0 = sin deadline)
+    """
+    session = request.headers.get('X-Session-Id') or request.values.get('session_id')
+    deadline_ms = float(request.headers.get('X-Deadline-Ms', DEADLINE_MS))
+    deadline = start_time + deadline_ms / 1000.0 if deadline_ms > 0 else None
+    return session, deadline
+
+def request_camera_pose():
+    """
+    Header 'X-Camera-Pose': pose cámara->mundo del frame, 16 valores (4x4 por filas,
+    separados por comas o espacios), para el modo keyframe. None si no viene.
+    """
+    value = request.headers.get('X-Camera-Pose')
+    if not value:
+        return None
+    values = [float(v) for v in value.replace(',', ' ').split()]
+    if len(values) != 16:
+        raise ValueError(f"X-Camera-Pose debe tener 16 valores, tiene {len(values)}")
+    return torch.tensor(values).view(4, 4)
+
+def request_tta():
+    """'?tta=1' (o campo 'tta') activa el flip-TTA para este request; por defecto TTA."""
+    value = request.values.get('tta')
+    return TTA if value is None else value in ('1', 'true')
+
+def binary_response(depth_map, encoding, timing, start_time):
+    """Respuesta binaria con la profundidad codificada y los metadatos en headers."""
+    with stage('encode'):
+        body, mimetype, headers = encode_depth(depth_map, encoding, max_depth=10.0)
+    response = Response(body, mimetype=mimetype)
+    response.headers.update(headers)
+    timing = dict(timing, total_ms=round((time.time() - start_time) * 1000, 2))
+    response.headers['X-Timing'] = json.dumps(timing)
+    return response
+
+def invalid_format_response(e):
+    return jsonify({
+        "status": "error",
+        "error": {
+            "code": "INVALID_FORMAT",
+            "message": str(e)
         }
+    }), 400
+
+def invalid_pose_response(e):
+    return jsonify({
+        "status": "error",
+        "error": {
+            "code": "INVALID_CAMERA_POSE",
+            "message": str(e)
+        }
+    }), 400
+
+def dropped_response(e):
+    return jsonify({
+        "status": "dropped",
+        "error": {
+            "code": "FRAME_DROPPED",
+            "reason": e.reason,
+            "message": "El frame se descartó antes de la inferencia"
+        }
+    }), 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Histogramas de latencia por etapa en formato de texto de Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/v1/cache/stats', methods=['GET'])
+def cache_stats():
+    """Contadores de la caché de profundidad (null si está desactivada)"""
+    return jsonify({
+        "status": "success",
+        "cache": None if depth_service.cache is None else depth_service.cache.stats()
     })
 
 @app.route('/api/v1/predict', methods=['POST'])
@@ -203,25 +524,41 @@ def predict():
     - application/json con campo 'image_base64' (string base64)
     
     Retorna:
-    - JSON con estructura dinBody compatible con Android
+    - JSON con estructura dinBody compatible con Android, o
+    - la profundidad métrica en binario si se pide una codificación con
+      '?format=' o el header Accept (ver depth_encoding)
     """
     start_time = time.time()
     
     try:
+        try:
+            encoding = negotiate(request.args.get('format'), request.headers.get('Accept'))
+        except ValueError as e:
+            return invalid_format_response(e)
+        session, deadline = request_schedule(start_time)
+        tta = request_tta()
+        try:
+            camera_pose = request_camera_pose()
+        except ValueError as e:
+            return invalid_pose_response(e)
+
         # Opción 1: Imagen como archivo multipart
-        if 'image' in request.files:
-            file = request.files['image']
-            print(f"INFO: Procesando imagen desde multipart (nombre: {file.filename})")
-            result = depth_service.predict_depth(file.stream)
-            
-        # Opción 2: Imagen como base64 en JSON
-        elif request.is_json and 'image_base64' in request.json:
-            image_base64 = request.json['image_base64']
-            print("INFO: Procesando imagen desde base64...")
-            image_bytes = base64.b64decode(image_base64)
-            result = depth_service.predict_depth(image_bytes)
-            
-        else:
+        with stage('parse'):
+            if 'image' in request.files:
+                file = request.files['image']
+                print(f"INFO: Procesando imagen desde multipart (nombre: {file.filename})")
+                image_source = file.stream
+                
+            # Opción 2: Imagen como base64 en JSON
+            elif request.is_json and 'image_base64' in request.json:
+                image_base64 = request.json['image_base64']
+                print("INFO: Procesando imagen desde base64...")
+                image_source = base64.b64decode(image_base64)
+                
+            else:
+                image_source = None
+
+        if image_source is None:
             return jsonify({
                 "status": "error",
                 "error": {
@@ -229,13 +566,25 @@ def predict():
                     "message": "Se requiere 'image' (multipart) o 'image_base64' (JSON)"
                 }
             }), 400
+
+        if encoding is not None:
+            depth_map, timing, _ = depth_service.predict_depth_map(image_source, session, deadline, tta, camera_pose)
+            print(f"INFO: ✓ Predicción exitosa ({encoding})")
+            return binary_response(depth_map, encoding, timing, start_time)
+
+        result = depth_service.predict_depth(image_source, session, deadline, tta, camera_pose)
         
         # Añadir tiempo total de request
         total_time = time.time() - start_time
         result['timing']['total_ms'] = round(total_time * 1000, 2)
         
         print(f"INFO: ✓ Predicción exitosa en {total_time:.2f}s")
-        return jsonify(result)
+        with stage('encode'):
+            return jsonify(result)
+
+    except FrameDropped as e:
+        print(f"INFO: Frame descartado ({e.reason})")
+        return dropped_response(e)
         
     except Exception as e:
         print(f"ERROR: {e}")
@@ -254,34 +603,138 @@ def predict():
 def predict_raw():
     """
     Endpoint alternativo que devuelve el array de profundidad completo.
-    ⚠️ ADVERTENCIA: Puede generar JSONs muy grandes (varios MB)
+    ⚠️ ADVERTENCIA: Sin '?format=' ni Accept binario genera JSONs muy grandes (varios MB)
     """
+    start_time = time.time()
     if 'image' not in request.files:
         return jsonify({"error": "Falta 'image'"}), 400
     
     try:
-        file = request.files['image']
-        img = Image.open(file.stream).convert('RGB')
-        img_tensor = depth_service.transform(img).unsqueeze(0).to(depth_service.device)
-
-        with torch.no_grad():
-            start_time = time.time()
-            pred_depth = depth_service.model(img_tensor)
-            inference_time = time.time() - start_time
-        
-        depth_map = pred_depth.squeeze().cpu().numpy().tolist()
-        
-        return jsonify({
-            "status": "success",
-            "model": "PixelFormer (Large07)",
-            "inference_time_ms": round(inference_time * 1000, 2),
-            "depth_map": depth_map  # ⚠️ Array completo
-        })
+        try:
+            encoding = negotiate(request.args.get('format'), request.headers.get('Accept'))
+        except ValueError as e:
+            return invalid_format_response(e)
+        session, deadline = request_schedule(start_time)
+        tta = request_tta()
+        try:
+            camera_pose = request_camera_pose()
+        except ValueError as e:
+            return invalid_pose_response(e)
+        with stage('parse'):
+            file = request.files['image']
+        depth_map, timing, _ = depth_service.predict_depth_map(file.stream, session, deadline, tta, camera_pose)
+
+        if encoding is not None:
+            return binary_response(depth_map, encoding, timing, start_time)
+
+        with stage('encode'):
+            depth_map = depth_map.tolist()
+            
+            return jsonify({
+                "status": "success",
+                "model": "PixelFormer (Large07)",
+                "inference_time_ms": timing["inference_ms"],
+                "depth_map": depth_map  # ⚠️ Array completo
+            })
+
+    except FrameDropped as e:
+        return dropped_response(e)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Servidor PixelFormer para Android')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='máximo de imágenes por forward (1 = sin micro-batching)')
+    parser.add_argument('--batch_wait_ms', type=float, default=10.0,
+                        help='espera máxima para completar un batch desde el primer request')
+    parser.add_argument('--max_queue', type=int, default=0,
+                        help='frames en espera como máximo (0 = cola sin límite); '
+                             'un frame nuevo de una sesión reemplaza al que espera')
+    parser.add_argument('--deadline_ms', type=float, default=0.0,
+                        help='deadline por defecto de cada request; si vence en la cola '
+                             'se responde "dropped" sin inferir (0 = sin deadline)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='procesos de inferencia (0 = inferir en el proceso del servidor); '
+                             'no se combina con el micro-batching, --max_queue ni --deadline_ms')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='hilos intra-op de PyTorch por worker')
+    parser.add_argument('--tta', action='store_true',
+                        help='flip-TTA por defecto (dos forwards, ~2x la latencia); '
+                             'cada request puede pedir ?tta=0/1')
+    parser.add_argument('--cache_mb', type=float, default=0,
+                        help='memoria de la caché de profundidad por contenido (0 = desactivada)')
+    parser.add_argument('--cache_ttl_s', type=float, default=0,
+                        help='vigencia de cada entrada de la caché (0 = sin vencimiento)')
+    parser.add_argument('--fused_attn', action='store_true',
+                        help='atención de ventanas con F.scaled_dot_product_attention (PyTorch >= 2.1)')
+    parser.add_argument('--quantize', action='store_true',
+                        help='int8 dinámico en los nn.Linear, solo si pasa el control de abs_rel')
+    parser.add_argument('--quant_data_path', type=str, default=None,
+                        help='raíz de NYU Depth V2 (imágenes y ground truth del split)')
+    parser.add_argument('--quant_split', type=str, default=QUANT_SPLIT)
+    parser.add_argument('--quant_samples', type=int, default=16)
+    parser.add_argument('--quant_max_abs_rel_delta', type=float, default=0.01,
+                        help='empeoramiento máximo de abs_rel aceptado para usar int8')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='fp32',
+                        help='bf16: inferencia con autocast de CPU (ver server_python/precision.py)')
+    parser.add_argument('--keyframes', action='store_true',
+                        help='por sesión, el modelo corre solo en keyframes y el resto de los frames '
+                             'reproyecta su profundidad (ver server_python/keyframe_depth.py)')
+    parser.add_argument('--pose_model_path', type=str, default=None,
+                        help='modelo de Monodepth2 con pose_encoder.pth/pose.pth para estimar la pose '
+                             'cuando el request no trae X-Camera-Pose')
+    parser.add_argument('--keyframe_max_interval', type=int, default=10,
+                        help='frames máximos entre keyframes')
+    parser.add_argument('--keyframe_max_rotation_deg', type=float, default=5.0)
+    parser.add_argument('--keyframe_max_translation', type=float, default=0.1,
+                        help='traslación máxima relativa a la profundidad mediana del keyframe')
+    parser.add_argument('--keyframe_max_hole_fraction', type=float, default=0.1)
+    parser.add_argument('--keyframe_max_photometric_error', type=float, default=0.1)
+    parser.add_argument('--server_timing', action='store_true',
+                        help='agrega Server-Timing a todas las respuestas '
+                             '(si no, solo a los requests con X-Server-Timing: 1)')
+    args = parser.parse_args()
+    # La cola acotada y el deadline son del micro-batcher; el pool no tiene cola propia
+    if args.workers > 0 and (args.batch_size > 1 or args.max_queue > 0 or args.deadline_ms > 0):
+        parser.error('--workers no se combina con --batch_size, --max_queue ni --deadline_ms')
+    return args
+
 if __name__ == '__main__':
+    args = parse_args()
+    DEADLINE_MS = args.deadline_ms
+    TTA = args.tta
+    instrument_app(app, metrics, args.server_timing)
+    if args.cache_mb > 0:
+        depth_service.enable_cache(args.cache_mb, args.cache_ttl_s)
+    if args.fused_attn:
+        num_modules = set_fused_attention(depth_service.model)
+        print(f"INFO: Atención fusionada activa en {num_modules} WindowAttention")
+    if args.quantize and args.precision != 'fp32':
+        sys.exit(f"ERROR: --quantize (int8) y --precision {args.precision} no se combinan")
+    if args.quantize:
+        if args.quant_data_path is None:
+            print("ERROR: --quantize requiere --quant_data_path para el control de precisión; se mantiene fp32")
+        else:
+            depth_service.enable_quantization(args.quant_data_path, args.quant_split,
+                                              args.quant_samples, args.quant_max_abs_rel_delta)
+    if args.precision != 'fp32':
+        depth_service.enable_precision(args.precision)
+        print(f"INFO: Precisión {args.precision} (autocast de CPU)")
+    if args.keyframes:
+        depth_service.enable_keyframes(args.pose_model_path,
+                                       max_interval=args.keyframe_max_interval,
+                                       max_rotation_deg=args.keyframe_max_rotation_deg,
+                                       max_translation=args.keyframe_max_translation,
+                                       max_hole_fraction=args.keyframe_max_hole_fraction,
+                                       max_photometric_error=args.keyframe_max_photometric_error)
+    if args.workers > 0:
+        depth_service.enable_worker_pool(args.workers, args.threads)
+    elif args.batch_size > 1 or args.max_queue > 0 or args.deadline_ms > 0:
+        depth_service.enable_batching(args.batch_size, args.batch_wait_ms, args.max_queue)
+
     print("=" * 60)
     print("INFO: Servidor PixelFormer para Android iniciado")
     print("INFO: Endpoints disponibles:")
@@ -289,6 +742,8 @@ if __name__ == '__main__':
     print("  - GET  /api/v1/info     -> Info del modelo")
     print("  - POST /api/v1/predict  -> Predicción (recomendado)")
     print("  - POST /api/v1/predict_raw -> Array completo (DEBUG)")
+    print("  - GET  /api/v1/cache/stats -> Contadores de la caché")
+    print("  - GET  /metrics         -> Latencia por etapa (Prometheus)")
     print("=" * 60)
-    print(f"INFO: Escuchando en puerto 5000...")
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    print(f"INFO: Escuchando en puerto {args.port}...")
+    app.run(host='0.0.0.0', port=args.port, debug=False, threaded=True)
\ No newline at end of file
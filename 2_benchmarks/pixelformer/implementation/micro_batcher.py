@@ -0,0 +1,196 @@
+import time
+import queue
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import torch
+
+
+class FrameDropped(Exception):
+    """
+    El frame no llegó a inferencia. `reason` es uno de:
+    - 'superseded': llegó un frame más nuevo de la misma sesión
+    - 'deadline': venció su deadline antes de tener resultado (en la cola o
+      durante el forward de su batch, que sigue pero ya no se espera)
+    - 'queue_full': la cola acotada ya estaba llena
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class LatestFrameQueue:
+    """
+    Cola FIFO acotada con una sola entrada por sesión.
+
+    Si una sesión encola un frame mientras el anterior sigue esperando, el nuevo
+    ocupa el lugar del viejo en la cola (latest-frame-wins) y `put` devuelve el
+    frame reemplazado para que el llamador lo descarte.
+    """
+
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.cond = threading.Condition()
+
+    def put(self, key, item):
+        with self.cond:
+            replaced = self.items.get(key)
+            if replaced is None and self.maxsize and len(self.items) >= self.maxsize:
+                raise FrameDropped('queue_full')
+            self.items[key] = item
+            self.cond.notify()
+            return replaced
+
+    def remove(self, key, item):
+        """Saca la entrada de `key` si todavía es `item`; True si estaba en la cola."""
+        with self.cond:
+            if self.items.get(key) is not item:
+                return False
+            del self.items[key]
+            return True
+
+    def get(self, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout):
+                raise queue.Empty
+            return self.items.popitem(last=False)[1]
+
+    def qsize(self):
+        with self.cond:
+            return len(self.items)
+
+
+class MicroBatcher:
+    """
+    Agrupa requests concurrentes en un solo forward del modelo.
+
+    Los handlers de Flask llaman a `submit(tensor)` con un tensor (C, H, W).
+    Un hilo de fondo junta hasta `max_batch_size` tensores o espera como máximo
+    `max_wait_ms` desde que llega el primero, los apila en un batch, ejecuta
+    `forward_fn` una vez y reparte cada salida a su request.
+
+    Con `max_queue > 0` la cola queda acotada; los frames que no entran, los que
+    reemplaza un frame más nuevo de su sesión y los que vencen su deadline
+    terminan en `FrameDropped` sin pasar por el modelo.
+    """
+
+    def __init__(self, forward_fn, max_batch_size=4, max_wait_ms=10.0, max_queue=0):
+        self.forward_fn = forward_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = LatestFrameQueue(max_queue)
+        self.histogram = Counter()
+        self.dropped = Counter()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, tensor, session=None, deadline=None):
+        """
+        Encola un tensor y devuelve (salida, info) cuando su batch termina.
+
+        Args:
+            session: id de la sesión del cliente; None = el request no reemplaza a nadie
+            deadline: instante (time.time()) a partir del cual ya no vale la pena inferir
+
+        Raises:
+            FrameDropped si el frame se descartó antes de llegar al modelo
+        """
+        future = Future()
+        key = future if session is None else session
+        item = (tensor, future, time.time(), deadline)
+        try:
+            replaced = self.queue.put(key, item)
+        except FrameDropped as e:
+            self._drop(future, e.reason)
+            raise
+        if replaced is not None:
+            self._drop(replaced[1], 'superseded')
+        if deadline is None:
+            return future.result()
+        # El deadline se cumple aunque el frame ya esté en un forward de varios segundos
+        try:
+            return future.result(timeout=max(deadline - time.time(), 0))
+        except FutureTimeout:
+            self.queue.remove(key, item)
+            self._drop(future, 'deadline')
+            return future.result()  # FrameDropped, o el resultado si llegó justo
+
+    def stats(self):
+        with self.lock:
+            return {str(size): count for size, count in sorted(self.histogram.items())}
+
+    def drop_stats(self):
+        with self.lock:
+            return dict(self.dropped)
+
+    def _drop(self, future, reason):
+        if self._resolve(future, exception=FrameDropped(reason)):
+            with self.lock:
+                self.dropped[reason] += 1
+
+    @staticmethod
+    def _resolve(future, result=None, exception=None):
+        """Completa `future`; False si ya estaba completo (p. ej. el request se dio
+        por vencido mientras su batch corría, o el resultado le ganó al deadline)."""
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+            return True
+        except InvalidStateError:
+            return False
+
+    def _collect(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            if deadline is None:
+                item = self.queue.get()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if item[3] is not None and item[3] < time.time():
+                self._drop(item[1], 'deadline')
+                continue
+            batch.append(item)
+            if deadline is None:
+                deadline = time.time() + self.max_wait
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            tensors, futures, enqueued, _ = zip(*batch)
+            start_time = time.time()
+            try:
+                with torch.no_grad():
+                    outputs = self.forward_fn(torch.stack(tensors))
+            except Exception as e:
+                for future in futures:
+                    self._resolve(future, exception=e)
+                continue
+            forward_time = time.time() - start_time
+
+            with self.lock:
+                self.histogram[len(batch)] += 1
+            histogram = self.stats()
+
+            for i, future in enumerate(futures):
+                self._resolve(future, (outputs[i], {
+                    "batch_size": len(batch),
+                    "queue_ms": round((start_time - enqueued[i]) * 1000, 2),
+                    "batch_forward_ms": round(forward_time * 1000, 2),
+                    "batch_histogram": histogram
+                }))
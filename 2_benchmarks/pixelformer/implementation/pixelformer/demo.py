@@ -26,7 +26,7 @@ from OpenGL.arrays import vbo
 from OpenGL.GL import shaders
 import glm
 
-from utils import post_process_depth, flip_lr
+from utils import flip_tta
 from networks.PixelFormer import PixelFormer
 
 
@@ -280,12 +280,11 @@ class Window(QtWidgets.QWidget):
             with torch.no_grad():
                 image = Variable(torch.from_numpy(input_images)).cuda()
                 # Predict
-                depth_est = self.model(image)
                 post_process = True
                 if post_process:
-                    image_flipped = flip_lr(image)
-                    depth_est_flipped = self.model(image_flipped)
-                    depth_cropped = post_process_depth(depth_est, depth_est_flipped)
+                    depth_cropped = flip_tta(self.model, image)
+                else:
+                    depth_cropped = self.model(image)
 
             depth = np.zeros((height_depth, width_depth), dtype=np.float32)
             if args.crop == 'kbcrop':
@@ -0,0 +1,15 @@
+"""
+Helpers shared by the depth servers and the NeWCRFs, PixelFormer and DCDepth
+trees.
+
+This directory (server_python/depth_common) is the source. Each model tree
+carries an identical copy next to its utils.py, so its scripts import it as
+`depth_common` from their own directory whatever the working directory or
+sys.path order; tests/test_depth_common.py fails if a copy drifts:
+
+    3_deepdso_slam/DeepDSO/newcrfs/depth_common
+    2_benchmarks/pixelformer/implementation/pixelformer/depth_common
+    2_benchmarks/dcdepth/implementation/depth_common
+
+Edit the files here and copy the directory over the three.
+"""
@@ -28,12 +28,14 @@ class BCP(nn.Module):
         x = self.drop(x)
         x = self.fc2(x)
         x = self.drop(x)
-        bins = torch.softmax(x, dim=1)
-        bins = bins / bins.sum(dim=1, keepdim=True)
-        bin_widths = (self.max_depth - self.min_depth) * bins
-        bin_widths = nn.functional.pad(bin_widths, (1, 0), mode='constant', value=self.min_depth)
-        bin_edges = torch.cumsum(bin_widths, dim=1)
-        centers = 0.5 * (bin_edges[:, :-1] + bin_edges[:, 1:])
+        # bin softmax and cumsum stay in fp32 under autocast (bin edges accumulate 256 widths)
+        with torch.autocast(device_type=x.device.type, enabled=False):
+            bins = torch.softmax(x.float(), dim=1)
+            bins = bins / bins.sum(dim=1, keepdim=True)
+            bin_widths = (self.max_depth - self.min_depth) * bins
+            bin_widths = nn.functional.pad(bin_widths, (1, 0), mode='constant', value=self.min_depth)
+            bin_edges = torch.cumsum(bin_widths, dim=1)
+            centers = 0.5 * (bin_edges[:, :-1] + bin_edges[:, 1:])
         n, dout = centers.size()
         centers = centers.contiguous().view(n, dout, 1, 1)
         return centers
@@ -156,7 +158,7 @@ class DispHead(nn.Module):
 
     def forward(self, x, centers, scale):
         x = self.conv1(x)
-        x = x.softmax(dim=1)
+        x = x.float().softmax(dim=1)  # fp32 bin probabilities under autocast, like the centers
         x = torch.sum(x * centers, dim=1, keepdim=True)
         if scale > 1:
             x = upsample(x, scale_factor=scale)
@@ -107,6 +107,53 @@ class WindowAttention(nn.Module):
 
         trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
+        # (key, bias) gathered in eval mode, see get_relative_position_bias
+        self._relative_position_bias_cache = None
+        # Route the attention through F.scaled_dot_product_attention (PyTorch >= 2.1)
+        self.fused_attn = False
+
+    def get_relative_position_bias(self):
+        """ Relative position bias with shape of (nH, Wh*Ww, Wh*Ww).
+
+        In eval mode without autograd the gathered bias is kept and reused until
+        the table changes (new storage after load/to(), or an in-place update).
+        """
+        table = self.relative_position_bias_table
+        if self.training or torch.is_grad_enabled():
+            return self._gather_relative_position_bias()
+        key = (table.data_ptr(), table._version, table.device, table.dtype)
+        cache = self._relative_position_bias_cache
+        if cache is None or cache[0] != key:
+            cache = (key, self._gather_relative_position_bias())
+            self._relative_position_bias_cache = cache
+        return cache[1]
+
+    def _gather_relative_position_bias(self):
+        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
+        return relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
+
+    def fused_attention(self, q, k, v, mask=None):
+        """ The attention of forward as a single F.scaled_dot_product_attention
+        call, with the relative position bias (plus the SW-MSA mask) passed as
+        an additive attn_mask. Used when self.fused_attn is set.
+
+        Args:
+            q, k, v: (num_windows*B, nH, N, head_dim)
+            mask: (0/-inf) mask with shape of (num_windows, Wh*Ww, Wh*Ww) or None
+
+        Returns:
+            x: (num_windows*B, nH, N, head_dim)
+        """
+        B_, nH, N, D = q.shape
+        attn_mask = self.get_relative_position_bias().unsqueeze(0)  # 1, nH, Wh*Ww, Wh*Ww
+        if mask is not None:
+            nW = mask.shape[0]
+            attn_mask = attn_mask + mask.unsqueeze(1)  # nW, nH, Wh*Ww, Wh*Ww
+            q, k, v = q.view(-1, nW, nH, N, D), k.view(-1, nW, nH, N, D), v.view(-1, nW, nH, N, v.shape[-1])
+        x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask.to(q.dtype),
+                                           dropout_p=self.attn_drop.p if self.training else 0., scale=self.scale)
+        return x.view(B_, nH, N, -1)
 
     def forward(self, x, v, mask=None):
         """ Forward function.
@@ -120,13 +167,16 @@ class WindowAttention(nn.Module):
         kv = self.kv(v).reshape(B_, N, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         k, v = kv[0], kv[1]  # make torchscript happy (cannot use tensor as tuple)
 
+        if self.fused_attn:
+            x = self.fused_attention(q, k, v, mask).transpose(1, 2).reshape(B_, N, C)
+            x = self.proj(x)
+            x = self.proj_drop(x)
+            return x
+
         q = q * self.scale
         attn = (q @ k.transpose(-2, -1))
 
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
+        attn = attn + self.get_relative_position_bias().unsqueeze(0)
 
         if mask is not None:
             nW = mask.shape[0]
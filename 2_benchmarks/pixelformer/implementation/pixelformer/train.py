@@ -13,7 +13,7 @@ from tqdm import tqdm
 
 from tensorboardX import SummaryWriter
 
-from utils import post_process_depth, flip_lr, silog_loss, compute_errors, eval_metrics, \
+from utils import flip_tta, silog_loss, compute_errors, eval_metrics, \
                        block_print, enable_print, normalize_result, inv_normalize, convert_arg_line_to_args
 from networks.PixelFormer import PixelFormer
 
@@ -104,11 +104,10 @@ def online_eval(model, dataloader_eval, gpu, ngpus, post_process=False):
                 # print('Invalid depth. continue.')
                 continue
 
-            pred_depth = model(image)
             if post_process:
-                image_flipped = flip_lr(image)
-                pred_depth_flipped = model(image_flipped)
-                pred_depth = post_process_depth(pred_depth, pred_depth_flipped)
+                pred_depth = flip_tta(model, image)
+            else:
+                pred_depth = model(image)
 
             pred_depth = pred_depth.cpu().numpy().squeeze()
             gt_depth = gt_depth.cpu().numpy().squeeze()
@@ -26,7 +26,7 @@ from OpenGL.arrays import vbo
 from OpenGL.GL import shaders
 import glm
 
-from utils import post_process_depth, flip_lr
+from utils import autocast_forward, flip_tta
 from networks.NewCRFDepth import NewCRFDepth
 
 
@@ -41,6 +41,9 @@ parser.add_argument('--input_width',     type=int,   help='input width',  defaul
 parser.add_argument('--dataset',         type=str,   help='dataset this model trained on',  default='nyu')
 parser.add_argument('--crop',            type=str,   help='crop: kbcrop, edge, non',  default='non')
 parser.add_argument('--video',           type=str,   help='video path',  default='')
+parser.add_argument('--precision',       type=str,   help='fp32, or bf16 (autocast)', choices=['fp32', 'bf16'], default='fp32')
+parser.add_argument('--keyframes',                   help='run the model on keyframes only, warp their depth to other frames', action='store_true')
+parser.add_argument('--pose_model_path', type=str,   help='monodepth2 model folder with pose_encoder.pth and pose.pth', default='')
 
 args = parser.parse_args()
 
@@ -122,6 +125,7 @@ class Window(QtWidgets.QWidget):
     def __init__(self, parent=None):
         QtWidgets.QWidget.__init__(self, parent)
         self.model = None
+        self.keyframes = None
         self.capture = None
         self.glWidget = GLWidget()
         
@@ -250,6 +254,22 @@ class Window(QtWidgets.QWidget):
         # Update the point cloud
         self.updateCloud()
     
+    def keyframe_depth(self, top, left, shape, depth_fn):
+        if self.keyframes is None:
+            if not args.pose_model_path:
+                sys.exit('--keyframes needs --pose_model_path (the demo has no camera poses)')
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'server_python'))
+            from keyframe_depth import KeyframeDepth, PoseNet
+            # NYU intrinsics of the rectified input, shifted by the crop
+            intrinsics = (518.8579, 518.8579, width_rgb / 2 - left, height_rgb / 2 - top)
+            self.keyframes = KeyframeDepth(intrinsics, shape, PoseNet(args.pose_model_path, device='cuda'))
+        rgb = self.glWidget.rgb[top:top + shape[0], left:left + shape[1]].transpose(2, 0, 1)
+        rgb = torch.from_numpy(np.ascontiguousarray(rgb)).float().unsqueeze(0).cuda()
+        depth, info = self.keyframes(rgb, depth_fn)
+        print('keyframe ({})'.format(info['reason']) if info['keyframe'] else
+              'propagated, {} frames old'.format(info['age']))
+        return depth
+
     def updateCloud(self):
         print('== updateCloud')
         rgb8 = qimage_to_np(self.inputViewer.pixmap().toImage())
@@ -280,12 +300,18 @@ class Window(QtWidgets.QWidget):
             with torch.no_grad():
                 image = Variable(torch.from_numpy(input_images)).cuda()
                 # Predict
-                depth_est = self.model(image)
                 post_process = True
+                predict = autocast_forward(self.model, args.precision)
                 if post_process:
-                    image_flipped = flip_lr(image)
-                    depth_est_flipped = self.model(image_flipped)
-                    depth_cropped = post_process_depth(depth_est, depth_est_flipped)
+                    depth_fn = lambda: flip_tta(predict, image)
+                else:
+                    depth_fn = lambda: predict(image)
+                if args.keyframes:
+                    top, left = (top_margin, left_margin) if args.crop == 'kbcrop' else \
+                        (32, 32) if args.crop == 'edge' else (0, 0)
+                    depth_cropped = self.keyframe_depth(top, left, input_image_cropped.shape[:2], depth_fn)
+                else:
+                    depth_cropped = depth_fn()
 
             depth = np.zeros((height_depth, width_depth), dtype=np.float32)
             if args.crop == 'kbcrop':
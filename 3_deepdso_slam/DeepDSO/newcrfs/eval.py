@@ -6,7 +6,7 @@ import argparse
 import numpy as np
 from tqdm import tqdm
 
-from utils import post_process_depth, flip_lr, compute_errors
+from utils import flip_tta, compute_errors
 from networks.NewCRFDepth import NewCRFDepth
 
 
@@ -69,11 +69,10 @@ def eval(model, dataloader_eval, post_process=False):
                 # print('Invalid depth. continue.')
                 continue
 
-            pred_depth = model(image)
             if post_process:
-                image_flipped = flip_lr(image)
-                pred_depth_flipped = model(image_flipped)
-                pred_depth = post_process_depth(pred_depth, pred_depth_flipped)
+                pred_depth = flip_tta(model, image)
+            else:
+                pred_depth = model(image)
 
             pred_depth = pred_depth.cpu().numpy().squeeze()
             gt_depth = gt_depth.cpu().numpy().squeeze()
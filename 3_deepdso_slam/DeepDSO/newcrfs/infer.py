@@ -33,7 +33,9 @@ from OpenGL.arrays import vbo
 from OpenGL.GL import shaders
 import glm
 
-from utils import post_process_depth, flip_lr
+from utils import autocast_forward, flip_tta
+# Tiled inference is shared with the depth server (see depth_common/__init__.py)
+from depth_common.tiling import fit_tiles, tiled_forward, window_alignment
 from networks.NewCRFDepth import NewCRFDepth
 from PIL import Image
 from matplotlib import cm
@@ -48,6 +50,11 @@ parser.add_argument('--input_width',     type=int,   help='input width',  defaul
 parser.add_argument('--dataset',         type=str,   help='dataset this model trained on',  default='nyu')
 parser.add_argument('--crop',            type=str,   help='crop: kbcrop, edge, non',  default='non')
 parser.add_argument('--video',           type=str,   help='video path',  default='../seq_02.mp4')
+parser.add_argument('--tile_size',       type=int,   help='tiled inference: tile height and width', nargs=2, default=None)
+parser.add_argument('--max_memory_mb',   type=float, help='tiled inference: peak activation memory target', default=None)
+parser.add_argument('--tile_overlap',    type=int,   help='minimum overlap between tiles', default=32)
+parser.add_argument('--tile_batch',      type=int,   help='tiles per forward pass', default=1)
+parser.add_argument('--precision',       type=str,   help='fp32, or bf16 (autocast)', choices=['fp32', 'bf16'], default='fp32')
 
 args = parser.parse_args()
 
@@ -161,15 +168,27 @@ else:
 input_images = np.expand_dims(input_image_cropped, axis=0)
 input_images = np.transpose(input_images, (0, 3, 1, 2))
 
+# Tiled inference: peak activation memory follows the tile, not the image
+network = autocast_forward(model, args.precision)
+predict = network
+tile_size, tile_batch = args.tile_size, args.tile_batch
+if tile_size or args.max_memory_mb:
+    align = window_alignment(model)
+if args.max_memory_mb:
+    tile_size, tile_batch, _ = fit_tiles(network, input_images.shape[-2:], args.max_memory_mb,
+                                         args.tile_overlap, align, args.tile_batch, device='cuda')
+    print('Tiles of {}x{}, {} per forward'.format(tile_size[0], tile_size[1], tile_batch))
+if tile_size:
+    predict = lambda x: tiled_forward(network, x, tile_size, args.tile_overlap, align, tile_batch)
+
 with torch.no_grad():
     image = Variable(torch.from_numpy(input_images)).cuda()
     # Predict
-    depth_est = model(image)
     post_process = True
     if post_process:
-        image_flipped = flip_lr(image)
-        depth_est_flipped = model(image_flipped)
-        depth_cropped = post_process_depth(depth_est, depth_est_flipped)
+        depth_cropped = flip_tta(predict, image)
+    else:
+        depth_cropped = predict(image)
 
 depth = np.zeros((height_depth, width_depth), dtype=np.float32)
 
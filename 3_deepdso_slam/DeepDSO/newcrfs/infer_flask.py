@@ -3,12 +3,13 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import sys
+import argparse
 import numpy as np
 import PIL.Image as pil
 import cv2
 import torch
 from torchvision import transforms
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 
 #--- Añadir Monodepth2 al path
 monodepth2_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'monodepth2'))
@@ -21,6 +22,13 @@ from layers import disp_to_depth
 # Configuración del Servidor Flask
 app = Flask(__name__)
 
+# Modo de transporte de /predict:
+#   'file' -> lee build/test.jpg y escribe depthcrfs.txt (modo original)
+#   'raw'  -> bytes crudos del frame en el body, profundidad binaria en la respuesta
+TRANSPORT = 'file'
+DEPTH_DTYPES = {'float32': '<f4', 'float16': '<f2'}
+DEPTH_DTYPE = 'float32'
+
 #--- Carga del Modelo Monodepth2
 model_name = "mono+stereo_640x192"
 model_path = os.path.join(monodepth2_path, "models", model_name)
@@ -49,42 +57,116 @@ def load_model():
 
 encoder, depth_decoder, feed_width, feed_height = load_model()
 
-# Ruta del Servidor
-@app.route('/predict', methods=['POST'])
-def predict():
-    try:
-        image_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'build', 'test.jpg'))
-        if not os.path.exists(image_path):
-            return jsonify({"error": "No se encontró test.jpg en la carpeta build"}), 400
 
-        input_image = pil.open(image_path).convert('RGB')
-        original_width, original_height = input_image.size
+def decode_raw_frame(data, width, height, channels):
+    """Convierte los bytes crudos (gris o BGR, uint8) del body en una imagen PIL RGB.
+    """
+    expected = width * height * channels
+    if len(data) != expected:
+        raise ValueError("El body tiene {} bytes, se esperaban {} ({}x{}x{})".format(
+            len(data), expected, width, height, channels))
+
+    frame = np.frombuffer(data, dtype=np.uint8)
+    if channels == 1:
+        frame = np.repeat(frame.reshape(height, width, 1), 3, axis=2)
+    elif channels == 3:
+        frame = frame.reshape(height, width, 3)[:, :, ::-1]
+    else:
+        raise ValueError("X-Frame-Channels debe ser 1 (gris) o 3 (BGR)")
+    return pil.fromarray(np.ascontiguousarray(frame), 'RGB')
+
+
+def predict_depth(input_image):
+    """Ejecuta Monodepth2 sobre una imagen PIL y devuelve la profundidad
+    (float32, resolución original) como array de NumPy.
+    """
+    original_width, original_height = input_image.size
+    input_image = input_image.resize((feed_width, feed_height), pil.LANCZOS)
+    input_image = transforms.ToTensor()(input_image).unsqueeze(0)
+
+    with torch.no_grad():
+        input_image = input_image.to('cpu')
+        features = encoder(input_image)
+        outputs = depth_decoder(features)
+        disp = outputs[("disp", 0)]
+        _, depth = disp_to_depth(disp, 0.1, 100)
 
-        input_image = input_image.resize((feed_width, feed_height), pil.LANCZOS)
-        input_image = transforms.ToTensor()(input_image).unsqueeze(0)
+        depth_resized = torch.nn.functional.interpolate(depth, (original_height, original_width), mode="bilinear", align_corners=False)
+        return depth_resized.squeeze().cpu().numpy()
 
-        with torch.no_grad():
-            input_image = input_image.to('cpu')
-            features = encoder(input_image)
-            outputs = depth_decoder(features)
 
-        disp = outputs[("disp", 0)]
-        _, depth = disp_to_depth(disp, 0.1, 100)
+def predict_file():
+    image_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'build', 'test.jpg'))
+    if not os.path.exists(image_path):
+        return jsonify({"error": "No se encontró test.jpg en la carpeta build"}), 400
+
+    depth_numpy = predict_depth(pil.open(image_path).convert('RGB'))
+
+    output_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'build', 'depthcrfs.txt'))
+    f = cv2.FileStorage(output_path, cv2.FILE_STORAGE_WRITE)
+    f.write('mat1', depth_numpy)
+    f.release()
+
+    return jsonify({"status": "success"})
+
 
-        depth_resized = torch.nn.functional.interpolate(
-            depth, (original_height, original_width), mode="bilinear", align_corners=False)
+def predict_raw():
+    # Formato del request: body = width*height*channels bytes uint8 (fila mayor)
+    try:
+        width = int(request.headers['X-Frame-Width'])
+        height = int(request.headers['X-Frame-Height'])
+        channels = int(request.headers.get('X-Frame-Channels', 1))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Se requieren los headers X-Frame-Width y X-Frame-Height"}), 400
+
+    dtype = request.headers.get('X-Depth-Dtype', DEPTH_DTYPE)
+    if dtype not in DEPTH_DTYPES:
+        return jsonify({"error": "X-Depth-Dtype debe ser uno de {}".format(sorted(DEPTH_DTYPES))}), 400
+
+    try:
+        input_image = decode_raw_frame(request.get_data(cache=False), width, height, channels)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        depth_numpy = depth_resized.squeeze().cpu().numpy()
+    depth_numpy = predict_depth(input_image)
 
-        output_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'build', 'depthcrfs.txt'))
-        f = cv2.FileStorage(output_path, cv2.FILE_STORAGE_WRITE)
-        f.write('mat1', depth_numpy)
-        f.release()
+    # Formato de la respuesta: body = height*width valores little-endian (fila mayor)
+    response = Response(depth_numpy.astype(DEPTH_DTYPES[dtype]).tobytes(),
+                        mimetype='application/octet-stream')
+    response.headers['X-Depth-Width'] = str(depth_numpy.shape[1])
+    response.headers['X-Depth-Height'] = str(depth_numpy.shape[0])
+    response.headers['X-Depth-Dtype'] = dtype
+    return response
+
+
+# Ruta del Servidor
+@app.route('/predict', methods=['POST'])
+def predict():
+    try:
+        if TRANSPORT == 'raw':
+            return predict_raw()
+        return predict_file()
 
-        return jsonify({"status": "success"})
     except Exception as e:
         print(f"Error en la predicción: {e}")
         return jsonify({"error": str(e)}), 500
 
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Servidor de profundidad Monodepth2 para DSO.')
+    parser.add_argument('--transport', type=str, choices=['file', 'raw'], default='file',
+                        help="'file': test.jpg -> depthcrfs.txt (original); "
+                             "'raw': frame crudo en el body -> profundidad binaria en la respuesta")
+    parser.add_argument('--depth_dtype', type=str, choices=sorted(DEPTH_DTYPES), default='float32',
+                        help='tipo por defecto de la profundidad en modo raw '
+                             '(el cliente puede cambiarlo con X-Depth-Dtype)')
+    parser.add_argument('--port', type=int, default=5000)
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    args = parse_args()
+    TRANSPORT = args.transport
+    DEPTH_DTYPE = args.depth_dtype
+    print("==> Transporte de /predict: {}".format(TRANSPORT))
+    app.run(host='0.0.0.0', port=args.port)
@@ -3,6 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.utils.checkpoint as checkpoint
 import numpy as np
+from functools import lru_cache
 from timm.models.layers import DropPath, to_2tuple, trunc_normal_
 
 
@@ -59,6 +60,35 @@ def window_reverse(windows, window_size, H, W):
     return x
 
 
+@lru_cache(maxsize=32)
+def shifted_window_mask(Hp, Wp, window_size, shift_size, device, dtype):
+    """ Attention mask for SW-MSA, memoised per padded resolution, window, shift,
+    device and dtype: at a fixed input size every layer builds it only once.
+
+    Returns:
+        attn_mask: (0/-100) mask with shape of (num_windows, Wh*Ww, Wh*Ww).
+            Shared between calls, it must not be modified in place.
+    """
+    img_mask = torch.zeros((1, Hp, Wp, 1), device=device, dtype=dtype)  # 1 Hp Wp 1
+    h_slices = (slice(0, -window_size),
+                slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    w_slices = (slice(0, -window_size),
+                slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    cnt = 0
+    for h in h_slices:
+        for w in w_slices:
+            img_mask[:, h, w, :] = cnt
+            cnt += 1
+
+    mask_windows = window_partition(img_mask, window_size)  # nW, window_size, window_size, 1
+    mask_windows = mask_windows.view(-1, window_size * window_size)
+    attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
+    attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+    return attn_mask
+
+
 class WindowAttention(nn.Module):
     """ Window based multi-head self attention (W-MSA) module with relative position bias.
     It supports both of shifted and non-shifted window.
@@ -106,6 +136,53 @@ class WindowAttention(nn.Module):
 
         trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
+        # (key, bias) gathered in eval mode, see get_relative_position_bias
+        self._relative_position_bias_cache = None
+        # Route the attention through F.scaled_dot_product_attention (PyTorch >= 2.1)
+        self.fused_attn = False
+
+    def get_relative_position_bias(self):
+        """ Relative position bias with shape of (nH, Wh*Ww, Wh*Ww).
+
+        In eval mode without autograd the gathered bias is kept and reused until
+        the table changes (new storage after load/to(), or an in-place update).
+        """
+        table = self.relative_position_bias_table
+        if self.training or torch.is_grad_enabled():
+            return self._gather_relative_position_bias()
+        key = (table.data_ptr(), table._version, table.device, table.dtype)
+        cache = self._relative_position_bias_cache
+        if cache is None or cache[0] != key:
+            cache = (key, self._gather_relative_position_bias())
+            self._relative_position_bias_cache = cache
+        return cache[1]
+
+    def _gather_relative_position_bias(self):
+        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
+        return relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
+
+    def fused_attention(self, q, k, v, mask=None):
+        """ The attention of forward as a single F.scaled_dot_product_attention
+        call, with the relative position bias (plus the SW-MSA mask) passed as
+        an additive attn_mask. Used when self.fused_attn is set.
+
+        Args:
+            q, k, v: (num_windows*B, nH, N, head_dim)
+            mask: (0/-inf) mask with shape of (num_windows, Wh*Ww, Wh*Ww) or None
+
+        Returns:
+            x: (num_windows*B, nH, N, head_dim)
+        """
+        B_, nH, N, D = q.shape
+        attn_mask = self.get_relative_position_bias().unsqueeze(0)  # 1, nH, Wh*Ww, Wh*Ww
+        if mask is not None:
+            nW = mask.shape[0]
+            attn_mask = attn_mask + mask.unsqueeze(1)  # nW, nH, Wh*Ww, Wh*Ww
+            q, k, v = q.view(-1, nW, nH, N, D), k.view(-1, nW, nH, N, D), v.view(-1, nW, nH, N, v.shape[-1])
+        x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask.to(q.dtype),
+                                           dropout_p=self.attn_drop.p if self.training else 0., scale=self.scale)
+        return x.view(B_, nH, N, -1)
 
     def forward(self, x, v, mask=None):
         """ Forward function.
@@ -118,13 +195,23 @@ class WindowAttention(nn.Module):
         qk = self.qk(x).reshape(B_, N, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k = qk[0], qk[1]  # make torchscript happy (cannot use tensor as tuple)
 
+        # assert self.dim % v.shape[-1] == 0, "self.dim % v.shape[-1] != 0"
+        # repeat_num = self.dim // v.shape[-1]
+        # v = v.view(B_, N, self.num_heads // repeat_num, -1).transpose(1, 2).repeat(1, repeat_num, 1, 1)
+
+        assert self.dim == v.shape[-1], "self.dim != v.shape[-1]"
+        v = v.view(B_, N, self.num_heads, -1).transpose(1, 2)
+
+        if self.fused_attn:
+            x = self.fused_attention(q, k, v, mask).transpose(1, 2).reshape(B_, N, C)
+            x = self.proj(x)
+            x = self.proj_drop(x)
+            return x
+
         q = q * self.scale
         attn = (q @ k.transpose(-2, -1))
 
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
-        attn = attn + relative_position_bias.unsqueeze(0)
+        attn = attn + self.get_relative_position_bias().unsqueeze(0)
 
         if mask is not None:
             nW = mask.shape[0]
@@ -135,13 +222,6 @@ class WindowAttention(nn.Module):
             attn = self.softmax(attn)
 
         attn = self.attn_drop(attn)
-        
-        # assert self.dim % v.shape[-1] == 0, "self.dim % v.shape[-1] != 0"
-        # repeat_num = self.dim // v.shape[-1]
-        # v = v.view(B_, N, self.num_heads // repeat_num, -1).transpose(1, 2).repeat(1, repeat_num, 1, 1)
-
-        assert self.dim == v.shape[-1], "self.dim != v.shape[-1]"
-        v = v.view(B_, N, self.num_heads, -1).transpose(1, 2)
 
         x = (attn @ v).transpose(1, 2).reshape(B_, N, C)
         x = self.proj(x)
@@ -331,23 +411,7 @@ class BasicCRFLayer(nn.Module):
         # calculate attention mask for SW-MSA
         Hp = int(np.ceil(H / self.window_size)) * self.window_size
         Wp = int(np.ceil(W / self.window_size)) * self.window_size
-        img_mask = torch.zeros((1, Hp, Wp, 1), device=x.device)  # 1 Hp Wp 1
-        h_slices = (slice(0, -self.window_size),
-                    slice(-self.window_size, -self.shift_size),
-                    slice(-self.shift_size, None))
-        w_slices = (slice(0, -self.window_size),
-                    slice(-self.window_size, -self.shift_size),
-                    slice(-self.shift_size, None))
-        cnt = 0
-        for h in h_slices:
-            for w in w_slices:
-                img_mask[:, h, w, :] = cnt
-                cnt += 1
-
-        mask_windows = window_partition(img_mask, self.window_size)  # nW, window_size, window_size, 1
-        mask_windows = mask_windows.view(-1, self.window_size * self.window_size)
-        attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
-        attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+        attn_mask = shifted_window_mask(Hp, Wp, self.window_size, self.shift_size, x.device, x.dtype)
 
         for blk in self.blocks:
             blk.H, blk.W = H, W
@@ -12,7 +12,7 @@ import cv2
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
-from utils import post_process_depth, flip_lr
+from utils import flip_tta
 from networks.NewCRFDepth import NewCRFDepth
 
 
@@ -89,12 +89,11 @@ def test(params):
         for _, sample in enumerate(tqdm(dataloader.data)):
             image = Variable(sample['image'].cuda())
             # Predict
-            depth_est = model(image)
             post_process = True
             if post_process:
-                image_flipped = flip_lr(image)
-                depth_est_flipped = model(image_flipped)
-                depth_est = post_process_depth(depth_est, depth_est_flipped)
+                depth_est = flip_tta(model, image)
+            else:
+                depth_est = model(image)
 
             pred_depth = depth_est.cpu().numpy().squeeze()
 
@@ -109,79 +109,34 @@ class silog_loss(nn.Module):
         return torch.sqrt((d ** 2).mean() - self.variance_focus * (d.mean() ** 2)) * 10.0
 
 
-def flip_lr(image):
-    """
-    Flip image horizontally
-
-    Parameters
-    ----------
-    image : torch.Tensor [B,3,H,W]
-        Image to be flipped
-
-    Returns
-    -------
-    image_flipped : torch.Tensor [B,3,H,W]
-        Flipped image
-    """
-    assert image.dim() == 4, 'You need to provide a [B,C,H,W] image to flip'
-    return torch.flip(image, [3])
-
-
-def fuse_inv_depth(inv_depth, inv_depth_hat, method='mean'):
-    """
-    Fuse inverse depth and flipped inverse depth maps
-
-    Parameters
-    ----------
-    inv_depth : torch.Tensor [B,1,H,W]
-        Inverse depth map
-    inv_depth_hat : torch.Tensor [B,1,H,W]
-        Flipped inverse depth map produced from a flipped image
-    method : str
-        Method that will be used to fuse the inverse depth maps
-
-    Returns
-    -------
-    fused_inv_depth : torch.Tensor [B,1,H,W]
-        Fused inverse depth map
-    """
-    if method == 'mean':
-        return 0.5 * (inv_depth + inv_depth_hat)
-    elif method == 'max':
-        return torch.max(inv_depth, inv_depth_hat)
-    elif method == 'min':
-        return torch.min(inv_depth, inv_depth_hat)
-    else:
-        raise ValueError('Unknown post-process method {}'.format(method))
+# Flip-TTA is shared with the depth servers (see depth_common/__init__.py)
+from depth_common.tta import flip_lr, fuse_inv_depth, post_process_depth, flip_tta  # noqa: F401
 
 
-def post_process_depth(depth, depth_flipped, method='mean'):
+def autocast_forward(model, precision='fp32'):
     """
-    Post-process an inverse and flipped inverse depth map
+    Wraps a depth network so that it runs under autocast with the given precision
 
     Parameters
     ----------
-    inv_depth : torch.Tensor [B,1,H,W]
-        Inverse depth map
-    inv_depth_flipped : torch.Tensor [B,1,H,W]
-        Inverse depth map produced from a flipped image
-    method : str
-        Method that will be used to fuse the inverse depth maps
+    model : callable
+        Maps an image batch [N,3,H,W] to a depth batch [N,1,h,w]
+    precision : str
+        'fp32' (no autocast) or 'bf16' (bfloat16 autocast on the device of the input)
 
     Returns
     -------
-    inv_depth_pp : torch.Tensor [B,1,H,W]
-        Post-processed inverse depth map
+    forward : callable
+        Same signature as `model`, always returning a float32 depth batch
     """
-    B, C, H, W = depth.shape
-    inv_depth_hat = flip_lr(depth_flipped)
-    inv_depth_fused = fuse_inv_depth(depth, inv_depth_hat, method=method)
-    xs = torch.linspace(0., 1., W, device=depth.device,
-                        dtype=depth.dtype).repeat(B, C, H, 1)
-    mask = 1.0 - torch.clamp(20. * (xs - 0.05), 0., 1.)
-    mask_hat = flip_lr(mask)
-    return mask_hat * depth + mask * inv_depth_hat + \
-           (1.0 - mask - mask_hat) * inv_depth_fused
+    if precision not in ('fp32', 'bf16'):
+        raise ValueError('Unknown precision {}, expected fp32 or bf16'.format(precision))
+
+    def forward(image):
+        with torch.autocast(image.device.type, dtype=torch.bfloat16, enabled=precision == 'bf16'):
+            depth = model(image)
+        return depth.float()
+    return forward
 
 
 class DistributedSamplerNoEvenlyDivisible(Sampler):
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""Latencia y diferencia numérica de cada backend de Monodepth2 contra eager.
+
+    python benchmark_backends.py --backends eager deploy torchscript onnx
+
+Si no se pasa --torchscript / --onnx se exporta el artefacto a un directorio temporal.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import PIL.Image as pil
+from torchvision import transforms
+
+from depth_backends import BACKENDS, export, load_backend, monodepth2_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark de los backends de Monodepth2.')
+    parser.add_argument('--image_dir', type=str, default=os.path.expanduser("~/Documentos/benchmark_images"))
+    parser.add_argument('--model_name', type=str, default='mono+stereo_640x192')
+    parser.add_argument('--backends', type=str, nargs='+', choices=BACKENDS, default=BACKENDS)
+    parser.add_argument('--torchscript', type=str, default=None, help='artefacto ya exportado')
+    parser.add_argument('--onnx', type=str, default=None, help='artefacto ya exportado')
+    parser.add_argument('--iterations', type=int, default=50)
+    return parser.parse_args()
+
+
+def time_backend(backend, inputs, iterations):
+    backend(inputs[0])  # Warmup
+    times = []
+    for i in range(iterations):
+        start = time.time()
+        backend(inputs[i % len(inputs)])
+        times.append(time.time() - start)
+    return np.array(times) * 1000
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model_path = os.path.join(monodepth2_path, "models", args.model_name)
+    images = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir) if f.endswith(".jpg"))
+    if not images:
+        raise SystemExit("ERROR: No hay imágenes en {}".format(args.image_dir))
+
+    eager = load_backend('eager', model_path)
+    inputs = []
+    for path in images:
+        image = pil.open(path).convert('RGB').resize((eager.feed_width, eager.feed_height), pil.LANCZOS)
+        inputs.append(transforms.ToTensor()(image).unsqueeze(0))
+    references = [eager(x) for x in inputs]
+
+    tmp_dir = tempfile.mkdtemp()
+    artifacts = {'torchscript': args.torchscript, 'onnx': args.onnx}
+    for fmt, suffix in (('torchscript', '.ts'), ('onnx', '.onnx')):
+        if fmt in args.backends and artifacts[fmt] is None:
+            artifacts[fmt] = os.path.join(tmp_dir, args.model_name + suffix)
+            export(model_path, fmt, artifacts[fmt])
+
+    print("=== BENCHMARK: BACKENDS DE MONODEPTH2 ({} imágenes, {} iteraciones) ===".format(
+        len(inputs), args.iterations))
+    print("{:<12} {:>9} {:>9} {:>9} {:>8} {:>12} {:>12}".format(
+        'backend', 'mean_ms', 'p50_ms', 'p99_ms', 'FPS', 'max_abs_m', 'mean_rel'))
+    for name in args.backends:
+        backend = eager if name == 'eager' else load_backend(name, model_path, artifacts.get(name))
+        latencies = time_backend(backend, inputs, args.iterations)
+        abs_diff = [(backend(x) - ref).abs() for x, ref in zip(inputs, references)]
+        max_abs = max(float(d.max()) for d in abs_diff)
+        mean_rel = float(np.mean([float((d / ref).mean()) for d, ref in zip(abs_diff, references)]))
+        print("{:<12} {:9.2f} {:9.2f} {:9.2f} {:8.2f} {:12.3e} {:12.3e}".format(
+            name, latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 99),
+            1000.0 / latencies.mean(), max_abs, mean_rel))
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Tiempo y memoria por frame del DepthDecoder de Monodepth2: las 4 escalas
+(entrenamiento) contra solo ("disp", 0), que es lo que leen los servidores.
+
+    python benchmark_decoder.py --iterations 100
+
+La memoria es el pico de bytes asignados por el decoder durante un forward
+(medido con el profiler de PyTorch) y los bytes que retiene el dict de salida.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+import numpy as np
+import PIL.Image as pil
+import torch
+from torchvision import transforms
+
+from depth_backends import load_monodepth2, monodepth2_path
+from fast_load import profile_peak_bytes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark del DepthDecoder por escalas.')
+    parser.add_argument('--image_dir', type=str, default=os.path.expanduser("~/Documentos/benchmark_images"))
+    parser.add_argument('--model_name', type=str, default='mono+stereo_640x192')
+    parser.add_argument('--iterations', type=int, default=100)
+    return parser.parse_args()
+
+
+def time_decoder(decode, features, iterations):
+    decode(features[0])  # Warmup
+    times = []
+    for i in range(iterations):
+        start = time.time()
+        decode(features[i % len(features)])
+        times.append(time.time() - start)
+    return np.array(times) * 1000
+
+
+def peak_memory(decode, features):
+    """(pico de bytes asignados durante `decode`, bytes retenidos en la salida)."""
+    peak, outputs = profile_peak_bytes(decode, features)
+    retained = sum(v.numel() * v.element_size() for v in outputs.values())
+    return peak, retained
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    model_path = os.path.join(monodepth2_path, "models", args.model_name)
+    images = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir) if f.endswith(".jpg"))
+    if not images:
+        raise SystemExit("ERROR: No hay imágenes en {}".format(args.image_dir))
+
+    encoder, depth_decoder, feed_width, feed_height = load_monodepth2(model_path)
+    features = []
+    with torch.no_grad():
+        for path in images:
+            image = pil.open(path).convert('RGB').resize((feed_width, feed_height), pil.LANCZOS)
+            features.append(encoder(transforms.ToTensor()(image).unsqueeze(0)))
+
+    modes = [
+        ('all_scales', lambda f: depth_decoder(f)),
+        ('scale_0', lambda f: depth_decoder(f, scales=(0,))),
+    ]
+    print("=== BENCHMARK: DEPTHDECODER POR ESCALAS ({}x{}, {} imágenes, {} iteraciones) ===".format(
+        feed_width, feed_height, len(features), args.iterations))
+    print("{:<12} {:>9} {:>9} {:>9} {:>12} {:>12}".format(
+        'modo', 'mean_ms', 'p50_ms', 'p99_ms', 'peak_MB', 'retained_KB'))
+    results = {}
+    with torch.no_grad():
+        for name, decode in modes:
+            latencies = time_decoder(decode, features, args.iterations)
+            peak, retained = peak_memory(decode, features[0])
+            results[name] = (latencies.mean(), peak, retained)
+            print("{:<12} {:9.2f} {:9.2f} {:9.2f} {:12.2f} {:12.1f}".format(
+                name, latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 99),
+                peak / 2**20, retained / 1024.0))
+
+        max_abs = max(float((depth_decoder(f)[("disp", 0)] - depth_decoder(f, scales=(0,))[("disp", 0)]).abs().max())
+                      for f in features)
+
+    (full_ms, full_peak, full_retained), (ms, peak, retained) = results['all_scales'], results['scale_0']
+    print("\nAhorro por frame: {:.2f} ms ({:.1f}%), pico {:.2f} MB, retenido {:.1f} KB; max |diff| disp 0: {:.1e}".format(
+        full_ms - ms, 100.0 * (full_ms - ms) / full_ms, (full_peak - peak) / 2**20,
+        (full_retained - retained) / 1024.0, max_abs))
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Asignaciones de memoria y latencia del DepthUpdateModule de DCDepth en eval,
+con y sin los caminos rápidos (flags fast_inference).
+
+    python benchmark_depth_update.py --iterations 5
+    python benchmark_depth_update.py --config dct_eigen_pff \
+        --checkpoint ../../2_benchmarks/dcdepth/implementation/checkpoints/dcdepth_eigen.pth
+
+    original   torch.zeros + scatter_freq (con su assert) por paso, clon del
+               mapa de frecuencias por paso, freq2depth (permute/reshape/
+               matmul por parche/unpatchify) y FrequencyModule.forward con
+               secuencias de tokens por píxel
+    rapido     scatter_add_ en el mapa preasignado, sin asserts ni historial
+               de mapas y fused_freq2depth (un matmul + un reshape)
+    canales    además FrequencyModule.forward_channels (sin tokens por píxel)
+
+Sin --checkpoint se mide sobre un estado oculto aleatorio (B, 192, H/8, W/8)
+a la resolución de cada dataset: la cantidad de trabajo no depende de los
+pesos. Con --checkpoint el estado oculto sale de DCDepth.hidden_state sobre
+--image (o ruido) y la diferencia máxima valida los caminos rápidos contra el
+original con los pesos reales.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+
+import numpy as np
+import PIL.Image as pil
+import torch
+from torchvision import transforms
+
+from fast_load import load_pretrained, profile_memory
+from model_registry import isolated_imports
+from infer_multi import DCDEPTH_PATH, IMAGENET_NORMALIZE
+
+# Resolución de entrada de los configs de DCDepth
+RESOLUTIONS = {'nyu': (480, 640), 'kitti': (352, 1216)}
+
+# (nombre, fast_inference de DepthUpdateModule, de FrequencyModule, return_freq_maps):
+# el original siempre guardaba los mapas de frecuencias
+MODES = [
+    ('original', False, False, True),
+    ('rapido', True, False, False),
+    ('canales', True, True, False),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='DepthUpdateModule: camino original vs rápido en eval.')
+    parser.add_argument('--datasets', type=str, nargs='+', choices=list(RESOLUTIONS), default=list(RESOLUTIONS),
+                        help='resoluciones a medir sin --checkpoint (con él, la del config)')
+    parser.add_argument('--hidden_dim', type=int, default=192)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--config', type=str, default=None, help='config de DCDepth (con --checkpoint)')
+    parser.add_argument('--checkpoint', type=str, default=None)
+    parser.add_argument('--image', type=str, default=None, help='imagen para el estado oculto (con --checkpoint)')
+    return parser.parse_args()
+
+
+def load_update_module(args):
+    """(DepthUpdateModule, {dataset: función que devuelve el estado oculto})."""
+    with isolated_imports(DCDEPTH_PATH):
+        import models  # noqa: F401 (resuelve el import circular networks <-> models)
+        from networks.depth_update import DepthUpdateModule
+        if args.checkpoint:
+            try:
+                from mmcv import Config
+            except ImportError:
+                from mmengine import Config
+            from models import MODELS
+
+    if not args.checkpoint:
+        torch.manual_seed(0)
+        module = DepthUpdateModule(args.hidden_dim, 8, scale=float(np.log(80.0))).eval()
+
+        def random_state(height, width):
+            return lambda: torch.tanh(torch.randn(1, args.hidden_dim, height // 8, width // 8))
+        return module, {dataset: random_state(*RESOLUTIONS[dataset]) for dataset in args.datasets}
+
+    cfg = Config.fromfile(os.path.join(DCDEPTH_PATH, 'configs', '{}.yaml'.format(args.config)))
+    cfg.model.pretrain = None
+    model = load_pretrained(lambda: MODELS.build({'type': cfg.model.type, 'cfg': cfg}), args.checkpoint).model
+    size = (cfg.dataset.input_height, cfg.dataset.input_width)
+
+    def hidden_state():
+        if args.image:
+            transform = transforms.Compose([transforms.Resize(size), transforms.ToTensor(), IMAGENET_NORMALIZE])
+            image = transform(pil.open(args.image).convert('RGB')).unsqueeze(0)
+        else:
+            image = torch.rand(1, 3, size[0], size[1])
+        return model.hidden_state(image)
+    return model.update, {cfg.dataset.name: hidden_state}
+
+
+def set_fast_inference(module, update, frequency):
+    module.fast_inference = update
+    module.in_proj.depth_freq_in.fast_inference = frequency
+
+
+def time_calls(fn, iterations):
+    fn()  # Warmup
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    module, hidden_states = load_update_module(args)
+    print("{:<12} {:<9} {:>8} {:>10} {:>9} {:>10} {:>10} {:>9}".format(
+        'dataset', 'modo', 'allocs', 'alloc_MB', 'peak_MB', 'update_ms', 'f2d_ms', 'max_abs'))
+    with torch.no_grad():
+        for dataset, hidden_state in hidden_states.items():
+            hidden = hidden_state()
+            freq_map = torch.randn(1, 64, hidden.shape[2], hidden.shape[3])
+            reference = None
+            for name, fast_update, fast_frequency, return_freq_maps in MODES:
+                set_fast_inference(module, fast_update, fast_frequency)
+                update = lambda: module(hidden, return_freq_maps=return_freq_maps)
+                freq2depth = module.fused_freq2depth if fast_update else module.freq2depth
+                stats, outputs = profile_memory(update)
+                latencies = time_calls(update, args.iterations)
+                f2d = time_calls(lambda: freq2depth(freq_map), args.iterations * 20)
+                # Diferencia máxima con el original en las profundidades de todos los pasos
+                reference = outputs[0] if reference is None else reference
+                max_abs = max(float((a - b).abs().max()) for a, b in zip(reference, outputs[0]))
+                print("{:<12} {:<9} {:8d} {:10.1f} {:9.1f} {:10.1f} {:10.2f} {:9.1e}".format(
+                    dataset, name, stats['allocations'], stats['allocated_bytes'] / 2**20,
+                    stats['peak_bytes'] / 2**20, latencies.mean(), f2d.mean(), max_abs))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Frente de Pareto iteraciones / latencia / precisión del refinamiento DCT
+progresivo de DCDepth (DepthUpdateModule), para elegir el presupuesto de CPU.
+
+    python benchmark_early_exit.py --config dct_nyu_pff --checkpoint checkpoints/dcdepth_nyu.pth \\
+        --data_path ~/datasets/nyu_depth_v2/official_splits/test --num_samples 32
+
+Por imagen se calcula una sola vez el estado inicial (backbone + PFF + CRFs,
+DCDepth.hidden_state) y sobre él se corre el DepthUpdateModule con:
+
+    fijo       max_iters = 1 .. n_steps
+    imagen     early exit con cada --tols, una decisión por imagen
+    parche     early exit con cada --tols, una decisión por parche de 8x8
+
+Las métricas son las de compute_errors_pth del árbol de DCDepth. La tolerancia
+es el cambio RMS de la profundidad en el espacio de salida del modelo: en los
+modelos 'log' 0.01 equivale a ~1% de cambio relativo. Escribe <output>.csv y,
+si está matplotlib, <output>.png.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import csv
+import time
+import argparse
+from collections import defaultdict
+
+import numpy as np
+import PIL.Image as pil
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+
+from fast_load import load_pretrained
+from model_registry import isolated_imports
+from quantize import METRICS, read_split
+from infer_multi import DCDEPTH_PATH, PIXELFORMER_PATH, IMAGENET_NORMALIZE
+
+# (split con ground truth, divisor de los PNG de profundidad) por dataset del config
+SPLITS = {
+    'nyu': (os.path.join(PIXELFORMER_PATH, 'data_splits', 'nyudepthv2_test_files_with_gt.txt'), 1000.0),
+    'kitti_eigen': (os.path.join(DCDEPTH_PATH, 'data_splits', 'eigen_test_files_with_gt.txt'), 256.0),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pareto iteraciones vs métricas del early exit de DCDepth.')
+    parser.add_argument('--config', type=str, default='dct_nyu_pff')
+    parser.add_argument('--checkpoint', type=str, required=True)
+    parser.add_argument('--data_path', type=str, required=True)
+    parser.add_argument('--gt_path', type=str, default=None, help='raíz del ground truth (KITTI); por defecto data_path')
+    parser.add_argument('--split', type=str, default=None, help='por defecto el split de test del dataset del config')
+    parser.add_argument('--num_samples', type=int, default=32)
+    parser.add_argument('--tols', type=float, nargs='+', default=[0.002, 0.005, 0.01, 0.02, 0.05])
+    parser.add_argument('--output', type=str, default='early_exit_pareto')
+    return parser.parse_args()
+
+
+def load_dcdepth(config, checkpoint):
+    with isolated_imports(DCDEPTH_PATH):
+        try:
+            from mmcv import Config
+        except ImportError:
+            from mmengine import Config
+        from models import MODELS
+        from utils import compute_errors_pth
+
+    cfg = Config.fromfile(os.path.join(DCDEPTH_PATH, 'configs', '{}.yaml'.format(config)))
+    cfg.model.pretrain = None
+    prog = load_pretrained(lambda: MODELS.build({'type': cfg.model.type, 'cfg': cfg}), checkpoint)
+    return prog, cfg, compute_errors_pth
+
+
+def settings(n_steps, tols):
+    """[(serie, etiqueta, kwargs de DepthUpdateModule.forward)]."""
+    points = [('fijo', str(k), dict(max_iters=k)) for k in range(1, n_steps + 1)]
+    for series, per_patch in (('imagen', False), ('parche', True)):
+        points += [(series, 'tol={:g}'.format(tol), dict(tol=tol, per_patch=per_patch)) for tol in tols]
+    return points
+
+
+def run_update(update, hidden, kwargs):
+    """(profundidad final en el espacio de salida, iteraciones medias, ms)."""
+    start = time.perf_counter()
+    outputs = update(hidden, **kwargs)
+    elapsed = (time.perf_counter() - start) * 1000
+    iterations = outputs[2].float().mean().item() if 'tol' in kwargs else float(len(outputs[0]))
+    return outputs[0][-1], iterations, elapsed
+
+
+def save_plot(rows, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("AVISO: sin matplotlib, no se genera {}".format(path))
+        return
+    fig, axes = plt.subplots(1, 2, figsize=(12, 4.5))
+    for series, marker in (('fijo', 'o-'), ('imagen', 's--'), ('parche', '^--')):
+        points = sorted((r for r in rows if r['serie'] == series), key=lambda r: r['iters'])
+        axes[0].plot([r['iters'] for r in points], [r['abs_rel'] for r in points], marker, label=series)
+        axes[1].plot([r['update_ms'] for r in points], [r['abs_rel'] for r in points], marker, label=series)
+    axes[0].set_xlabel('iteraciones (media)')
+    axes[1].set_xlabel('ms del DepthUpdateModule por imagen')
+    for ax in axes:
+        ax.set_ylabel('abs_rel')
+        ax.grid(True, alpha=0.3)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    print("Gráfico: {}".format(path))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    prog, cfg, compute_errors_pth = load_dcdepth(args.config, args.checkpoint)
+    model = prog.model
+    if cfg.dataset.name not in SPLITS:
+        raise SystemExit("ERROR: sin split de test conocido para el dataset '{}'".format(cfg.dataset.name))
+    split_file, depth_scale = SPLITS[cfg.dataset.name]
+    samples = read_split(args.split or split_file, args.data_path, args.gt_path, args.num_samples)
+    if not samples:
+        raise SystemExit("ERROR: el split no tiene imágenes con ground truth")
+
+    transform = transforms.Compose([
+        transforms.Resize((cfg.dataset.input_height, cfg.dataset.input_width)),
+        transforms.ToTensor(),
+        IMAGENET_NORMALIZE
+    ])
+    points = settings(model.update.n_steps, args.tols)
+    errors, iterations, latencies = defaultdict(list), defaultdict(list), defaultdict(list)
+    encoder_ms = []
+
+    with torch.no_grad():
+        for i, (rgb_path, gt_path) in enumerate(samples):
+            gt = torch.from_numpy(np.asarray(pil.open(gt_path), dtype=np.float32) / depth_scale)
+            valid = torch.logical_and(gt > cfg.dataset.min_depth, gt < cfg.dataset.max_depth)
+            image = transform(pil.open(rgb_path).convert('RGB')).unsqueeze(0)
+            start = time.perf_counter()
+            hidden = model.hidden_state(image)
+            encoder_ms.append((time.perf_counter() - start) * 1000)
+            if i == 0:
+                run_update(model.update, hidden, {})  # Warmup
+
+            for series, label, kwargs in points:
+                depth, iters, ms = run_update(model.update, hidden, kwargs)
+                depth = F.interpolate(prog.output2metric(depth), gt.shape, mode='bilinear', align_corners=False)
+                depth = depth.squeeze().clamp(cfg.dataset.min_depth, cfg.dataset.max_depth)
+                measures = compute_errors_pth(gt[valid], depth[valid])
+                errors[label, series].append([float(measures[m]) for m in METRICS])
+                iterations[label, series].append(iters)
+                latencies[label, series].append(ms)
+            print("{}/{} {}".format(i + 1, len(samples), os.path.basename(rgb_path)))
+
+    rows = []
+    for series, label, _ in points:
+        row = dict(serie=series, ajuste=label, iters=np.mean(iterations[label, series]),
+                   update_ms=np.mean(latencies[label, series]))
+        row.update(zip(METRICS, np.mean(errors[label, series], axis=0)))
+        rows.append(row)
+
+    print("\n=== DCDEPTH EARLY EXIT ({}, {} imágenes; backbone+CRF {:.0f} ms/imagen) ===".format(
+        cfg.dataset.name, len(samples), np.mean(encoder_ms)))
+    print("{:<8} {:<10} {:>6} {:>10} {:>8} {:>8} {:>8} {:>8}".format(
+        'serie', 'ajuste', 'iters', 'update_ms', 'abs_rel', 'rms', 'silog', 'd1'))
+    for r in rows:
+        print("{:<8} {:<10} {:6.2f} {:10.1f} {:8.4f} {:8.4f} {:8.3f} {:8.4f}".format(
+            r['serie'], r['ajuste'], r['iters'], r['update_ms'], r['abs_rel'], r['rms'], r['silog'], r['d1']))
+
+    with open(args.output + '.csv', 'w') as f:
+        writer = csv.DictWriter(f, fieldnames=['serie', 'ajuste', 'iters', 'update_ms'] + METRICS)
+        writer.writeheader()
+        writer.writerows(rows)
+    print("\nTabla: {}.csv".format(args.output))
+    save_plot(rows, args.output + '.png')
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""FPS efectivo de profundidad y error de la propagación por keyframes
+(keyframe_depth.KeyframeDepth) contra la inferencia completa en cada frame.
+
+    python benchmark_keyframes.py --model pixelformer --images ~/datasets/nyu_seq/ --max_frames 60
+    python benchmark_keyframes.py --model newcrfs --images ~/kitti_odometry/sequences/00/image_2 \\
+        --poses ~/kitti_odometry/poses/00.txt --intrinsics 718.856 718.856 607.193 185.216 \\
+        --intrinsics_size 376 1241
+
+Primero corre el modelo sobre todos los frames (la referencia y su tiempo por
+frame); después recorre la secuencia con KeyframeDepth, reusando la
+profundidad de referencia en los keyframes. El tiempo del modo keyframe es el
+medido de la propagación (pose, warping, relleno, control fotométrico) más,
+por keyframe, el tiempo medio del modelo. La pose sale de --poses (una pose
+cámara->mundo 3x4 por línea, formato de KITTI odometry) o del PoseNet de
+Monodepth2 (--pose_model_path).
+
+El error por antigüedad (abs_rel contra la inferencia completa del mismo
+frame) es la cota de error que acompaña a la antigüedad que informa cada
+resultado; con pesos aleatorios (sin --checkpoint) solo la latencia es
+representativa.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import glob
+import time
+import argparse
+from collections import Counter, defaultdict
+
+import numpy as np
+import PIL.Image as pil
+import torch
+from torchvision import transforms
+
+from keyframe_depth import KeyframeDepth, PoseNet, NYU_INTRINSICS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inferencia solo en keyframes vs en todos los frames.')
+    parser.add_argument('--model', type=str, choices=['newcrfs', 'pixelformer', 'dcdepth'], default='pixelformer')
+    parser.add_argument('--checkpoint', type=str, default=None, help='sin checkpoint, pesos aleatorios')
+    parser.add_argument('--images', type=str, required=True, help='carpeta con los frames (.jpg / .png, en orden)')
+    parser.add_argument('--max_frames', type=int, default=60)
+    parser.add_argument('--poses', type=str, default=None,
+                        help='poses cámara->mundo, 12 valores (3x4) por línea (KITTI odometry)')
+    parser.add_argument('--pose_model_path', type=str, default=None,
+                        help='carpeta de un modelo de Monodepth2 con pose_encoder.pth y pose.pth')
+    parser.add_argument('--intrinsics', type=float, nargs=4, default=list(NYU_INTRINSICS), help='fx fy cx cy')
+    parser.add_argument('--intrinsics_size', type=int, nargs=2, default=[480, 640],
+                        help='alto ancho de la imagen a la que corresponden --intrinsics')
+    parser.add_argument('--max_interval', type=int, default=10)
+    parser.add_argument('--max_rotation_deg', type=float, default=5.0)
+    parser.add_argument('--max_translation', type=float, default=0.1)
+    parser.add_argument('--max_hole_fraction', type=float, default=0.1)
+    parser.add_argument('--max_photometric_error', type=float, default=0.1)
+    return parser.parse_args()
+
+
+def load_frames(folder, max_frames):
+    paths = sorted(glob.glob(os.path.join(folder, '*.png')) + glob.glob(os.path.join(folder, '*.jpg')))
+    return paths[:max_frames]
+
+
+def load_poses(path, num_frames):
+    poses = np.loadtxt(path).reshape(-1, 3, 4)[:num_frames]
+    bottom = np.tile(np.array([[[0, 0, 0, 1]]], dtype=poses.dtype), (len(poses), 1, 1))
+    return torch.from_numpy(np.concatenate([poses, bottom], 1)).float()
+
+
+if __name__ == "__main__":
+    from benchmark_swin_caches import BUILDERS
+    from infer_multi import IMAGENET_NORMALIZE
+
+    args = parse_args()
+    paths = load_frames(args.images, args.max_frames)
+    if not paths:
+        raise SystemExit("No hay imágenes en {}".format(args.images))
+    poses = load_poses(args.poses, len(paths)) if args.poses else None
+    if poses is None and args.pose_model_path is None:
+        raise SystemExit("Hace falta --poses o --pose_model_path")
+
+    model, size = BUILDERS[args.model](args.checkpoint)
+    model.eval()
+    if args.model == 'dcdepth':
+        network = lambda x: torch.exp(model(x)[-1])  # dct_eigen_pff: espacio log
+    else:
+        network = model
+    to_tensor = transforms.Compose([transforms.Resize(size), transforms.ToTensor()])
+
+    # Referencia: el modelo en todos los frames
+    images, reference, model_ms = [], [], []
+    with torch.no_grad():
+        for path in paths:
+            image = to_tensor(pil.open(path).convert('RGB')).unsqueeze(0)
+            start = time.perf_counter()
+            depth = network(IMAGENET_NORMALIZE(image))
+            model_ms.append((time.perf_counter() - start) * 1000)
+            images.append(image)
+            reference.append(depth)
+    model_ms = float(np.mean(model_ms[1:] if len(model_ms) > 1 else model_ms))
+
+    pose_net = PoseNet(args.pose_model_path) if poses is None else None
+    keyframes = KeyframeDepth(args.intrinsics, args.intrinsics_size, pose_net, args.max_interval,
+                              args.max_rotation_deg, args.max_translation, args.max_hole_fraction,
+                              args.max_photometric_error)
+    propagation_ms, reasons = [], Counter()
+    by_age = defaultdict(lambda: defaultdict(list))
+    for i, (image, depth_ref) in enumerate(zip(images, reference)):
+        start = time.perf_counter()
+        with torch.no_grad():
+            depth, info = keyframes(image, lambda: depth_ref, None if poses is None else poses[i],
+                                    timestamp=i / 30.0)
+        elapsed = (time.perf_counter() - start) * 1000
+        if info["keyframe"]:
+            reasons[info["reason"]] += 1
+            continue
+        propagation_ms.append(elapsed)
+        stats = by_age[info["age"]]
+        stats["abs_rel"].append(float(((depth - depth_ref).abs() / depth_ref.clamp(min=1e-3)).mean()))
+        stats["hole_fraction"].append(info["hole_fraction"])
+        stats["photometric_error"].append(info["photometric_error"])
+
+    num_frames, num_keyframes = len(paths), sum(reasons.values())
+    keyframe_ms = (num_keyframes * model_ms + sum(propagation_ms)) / num_frames
+    print("{}: {} frames, {} keyframes ({})".format(
+        args.model, num_frames, num_keyframes, ", ".join("{} {}".format(n, r) for r, n in reasons.most_common())))
+    print("  inferencia completa  {:8.1f} ms/frame  {:6.2f} FPS".format(model_ms, 1000 / model_ms))
+    print("  solo keyframes       {:8.1f} ms/frame  {:6.2f} FPS  (x{:.1f}; propagación {:.1f} ms)".format(
+        keyframe_ms, 1000 / keyframe_ms, model_ms / keyframe_ms,
+        np.mean(propagation_ms) if propagation_ms else float('nan')))
+
+    print("{:>5} {:>7} {:>10} {:>10} {:>8} {:>12}".format(
+        'edad', 'frames', 'abs_rel', 'p95', 'huecos', 'fotométrico'))
+    for age in sorted(by_age):
+        stats = by_age[age]
+        print("{:5d} {:7d} {:10.4f} {:10.4f} {:8.4f} {:12.4f}".format(
+            age, len(stats["abs_rel"]), np.mean(stats["abs_rel"]), np.percentile(stats["abs_rel"], 95),
+            np.mean(stats["hole_fraction"]), np.mean(stats["photometric_error"])))
+    if by_age:
+        bound = max(np.percentile(by_age[age]["abs_rel"], 95) for age in by_age)
+        print("Cota (p95 de abs_rel hasta {} frames de antigüedad): {:.4f}".format(max(by_age), bound))
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""Iteraciones y tiempo del tracking inicial de DSO con y sin el prior de pose
+del PoseNet de Monodepth2 (/pose del servidor), sobre una secuencia de KITTI odometry.
+
+    python benchmark_pose_prior.py --sequence ~/kitti_odometry/sequences/00 \\
+        --poses ~/kitti_odometry/poses/00.txt --num_pairs 100
+
+DSO no corre acá, así que el benchmark reproduce en PyTorch lo que hace con el
+segundo frame (FullSystem::trackNewCoarse -> CoarseTracker::trackNewestCoarse):
+el primer frame es el keyframe con la profundidad de Monodepth2 (la misma que
+sirve infer_flask.py, sin STEREO_SCALE_FACTOR), y el segundo se alinea con
+Levenberg-Marquardt fotométrico de grueso a fino sobre puntos de alto
+gradiente: 6 grados de libertad más brillo afín (a, b), pesos de Huber
+(setting_huberTH = 9), corte de residuos setting_coarseCutoffTH = 20,
+maxIterations = {10, 20, 50, 50, 50}, lambda inicial 0.01 y corte con
+|inc| < 1e-3, como en CoarseTracker.cpp. Se parte de la identidad (lo que hace
+DSO hoy) o de la T del PoseNet.
+
+Para cada par (k, k+1) de la secuencia informa las iteraciones LM totales, el
+tiempo del tracking (más el del PoseNet en el caso con prior), el residuo final
+y el error contra el ground truth (rotación en grados; traslación en metros,
+con la escala 5.4 de los modelos mono+stereo). Con pesos aleatorios solo los
+tiempos son representativos.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import glob
+import math
+import time
+import argparse
+
+import numpy as np
+import PIL.Image as pil
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+
+from model_registry import isolated_imports
+from keyframe_depth import PoseNet, STEREO_SCALE_FACTOR, MONODEPTH2_PATH, rotation_angle_deg
+
+with isolated_imports(MONODEPTH2_PATH):
+    from layers import rot_from_axisangle
+
+# Parámetros de CoarseTracker::trackNewestCoarse (settings.cpp), nivel 0 = resolución completa
+MAX_ITERATIONS = [10, 20, 50, 50, 50]
+HUBER_TH = 9.0
+COARSE_CUTOFF_TH = 20.0
+# Umbral de selección de puntos: mediana del gradiente + setting_minGradHistAdd
+MIN_GRAD_HIST_ADD = 7.0
+LAMBDA_EXTRAPOLATION_LIMIT = 0.001
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Tracking inicial de DSO con y sin prior de pose.')
+    parser.add_argument('--sequence', type=str, required=True,
+                        help='carpeta de una secuencia de KITTI odometry (con calib.txt)')
+    parser.add_argument('--camera', type=str, default='image_2', choices=['image_0', 'image_2'])
+    parser.add_argument('--poses', type=str, required=True, help='poses/XX.txt de la secuencia')
+    parser.add_argument('--model_path', type=str,
+                        default=os.path.join(MONODEPTH2_PATH, 'models', 'mono+stereo_640x192'),
+                        help='modelo de Monodepth2 con encoder, depth, pose_encoder y pose')
+    parser.add_argument('--start', type=int, default=0)
+    parser.add_argument('--num_pairs', type=int, default=50)
+    parser.add_argument('--stride', type=int, default=1,
+                        help='frames entre pares consecutivos de la muestra')
+    parser.add_argument('--scale', type=float, default=1.0, help='escala de las imágenes para el tracking')
+    parser.add_argument('--levels', type=int, default=5, help='niveles de la pirámide')
+    parser.add_argument('--num_points', type=int, default=2000, help='puntos por nivel (setting_desiredPointDensity)')
+    return parser.parse_args()
+
+
+def read_intrinsics(sequence, camera):
+    """fx, fy, cx, cy de la cámara `camera` según calib.txt (P0 / P2)."""
+    key = 'P{}:'.format(camera[-1])
+    with open(os.path.join(sequence, 'calib.txt')) as f:
+        for line in f:
+            if line.startswith(key):
+                P = [float(v) for v in line.split()[1:]]
+                return P[0], P[5], P[2], P[6]
+    raise ValueError("{} no está en calib.txt".format(key))
+
+
+def load_poses(path):
+    poses = np.loadtxt(path).reshape(-1, 3, 4)
+    bottom = np.tile(np.array([[[0, 0, 0, 1]]], dtype=poses.dtype), (len(poses), 1, 1))
+    return torch.from_numpy(np.concatenate([poses, bottom], 1)).float()
+
+
+def image_pyramid(image, levels):
+    pyramid = [image]
+    for _ in range(levels - 1):
+        pyramid.append(F.avg_pool2d(pyramid[-1], 2))
+    return pyramid
+
+
+def image_gradients(image):
+    """Gradientes centrales (1, 2, H, W) de `image` (1, 1, H, W), como dIp de DSO."""
+    padded = F.pad(image, (1, 1, 1, 1), mode='replicate')
+    gx = (padded[:, :, 1:-1, 2:] - padded[:, :, 1:-1, :-2]) * 0.5
+    gy = (padded[:, :, 2:, 1:-1] - padded[:, :, :-2, 1:-1]) * 0.5
+    return torch.cat([gx, gy], 1)
+
+
+def select_points(image, idepth, num_points):
+    """Un punto por celda (el de mayor gradiente, si supera la mediana del
+    gradiente + MIN_GRAD_HIST_ADD), con ~`num_points` celdas, como PixelSelector.
+    Devuelve u, v, idepth e intensidad de los puntos."""
+    height, width = image.shape[-2:]
+    grad = image_gradients(image).norm(dim=1, keepdim=True)
+    cell = max(1, int(math.sqrt(height * width / float(num_points))))
+    grad = grad[:, :, 2:height - 2, 2:width - 2]
+    threshold = float(grad.median()) + MIN_GRAD_HIST_ADD
+    value, index = F.max_pool2d(grad, cell, return_indices=True)
+    value, index = value.view(-1), index.view(-1)
+    index = index[value > threshold]
+    inner_width = width - 4
+    v, u = index // inner_width + 2, index % inner_width + 2
+    return (u.float(), v.float(), idepth[0, 0, v, u], image[0, 0, v, u])
+
+
+def se3_exp(increment):
+    """T (4, 4) de un incremento (traslación, rotación) pequeño."""
+    T = rot_from_axisangle(increment[3:].view(1, 1, 3))[0]
+    T[:3, 3] = increment[:3]
+    return T
+
+
+class CoarseTracker:
+    """Alineamiento fotométrico de un frame nuevo contra un keyframe con
+    profundidad, con el esquema LM de CoarseTracker::trackNewestCoarse de DSO."""
+    def __init__(self, image, depth, intrinsics, levels=5, num_points=2000):
+        self.levels = levels
+        self.images = image_pyramid(image, levels)
+        idepths = image_pyramid(1.0 / depth.clamp(min=1e-3), levels)
+        self.points, self.K = [], []
+        fx, fy, cx, cy = intrinsics
+        for lvl in range(levels):
+            self.points.append(select_points(self.images[lvl], idepths[lvl], num_points))
+            s = 1.0 / (1 << lvl)
+            self.K.append((fx * s, fy * s, (cx + 0.5) * s - 0.5, (cy + 0.5) * s - 0.5))
+
+    def residuals(self, lvl, new_image, new_grads, T, affine):
+        """Residuos, pesos de Huber y jacobianos (N, 8) de los puntos del nivel `lvl`."""
+        u, v, idepth, ref_intensity = self.points[lvl]
+        fx, fy, cx, cy = self.K[lvl]
+        height, width = new_image.shape[-2:]
+        # Punto del keyframe llevado a la cámara nueva
+        X = torch.stack([(u - cx) / fx, (v - cy) / fy, torch.ones_like(u)]) / idepth
+        X = T[:3, :3] @ X + T[:3, 3:]
+        z_inv = 1.0 / X[2]
+        x, y = X[0] * z_inv, X[1] * z_inv
+        u_new, v_new = fx * x + cx, fy * y + cy
+        inside = (X[2] > 0) & (u_new > 1) & (v_new > 1) & (u_new < width - 2) & (v_new < height - 2)
+        grid = torch.stack([(u_new + 0.5) * (2.0 / width) - 1, (v_new + 0.5) * (2.0 / height) - 1], -1)
+        grid = grid.view(1, 1, -1, 2)
+        new_intensity = F.grid_sample(new_image, grid, align_corners=False)[0, 0, 0]
+        gx, gy = F.grid_sample(new_grads, grid, align_corners=False)[0, :, 0]
+
+        a, b = affine
+        r = new_intensity - (math.exp(a) * ref_intensity + b)
+        valid = inside & (r.abs() < COARSE_CUTOFF_TH)
+        weight = torch.where(r.abs() < HUBER_TH, torch.ones_like(r), HUBER_TH / r.abs())
+        energy = torch.where(valid, weight * (2 - weight) * r * r, torch.full_like(r, COARSE_CUTOFF_TH ** 2))
+        energy = torch.where(inside, energy, torch.zeros_like(r))
+
+        # d r / d (traslación, rotación, a, b) con la perturbación exp(inc) * T
+        dx, dy = gx * fx, gy * fy
+        J = torch.stack([
+            dx * z_inv, dy * z_inv, -(dx * x + dy * y) * z_inv,
+            -(dx * x * y + dy * (1 + y * y)), dx * (1 + x * x) + dy * x * y, dy * x - dx * y,
+            -math.exp(a) * ref_intensity, -torch.ones_like(r)], 1)
+        return r, weight * valid.float(), J, float(energy.sum() / inside.sum().clamp(min=1))
+
+    def track(self, new_image, T_init):
+        """(T, (a, b), iteraciones LM, rmse final) del frame `new_image` desde `T_init`."""
+        images = image_pyramid(new_image, self.levels)
+        T, affine, iterations, energy = T_init.clone(), (0.0, 0.0), 0, float('nan')
+        for lvl in range(self.levels - 1, -1, -1):
+            new_grads = image_gradients(images[lvl])
+            r, w, J, energy = self.residuals(lvl, images[lvl], new_grads, T, affine)
+            H, g = J.t() @ (J * w[:, None]), J.t() @ (w * r)
+            lam = 0.01
+            for _ in range(MAX_ITERATIONS[lvl]):
+                iterations += 1
+                H_damped = H + torch.diag(torch.diagonal(H) * lam + 1e-9)
+                inc = torch.linalg.solve(H_damped.double(), -g.double()).float()
+                if lam < LAMBDA_EXTRAPOLATION_LIMIT:
+                    inc = inc * math.sqrt(math.sqrt(LAMBDA_EXTRAPOLATION_LIMIT / lam))
+                if not torch.isfinite(inc).all():
+                    inc = torch.zeros_like(inc)
+                T_new = se3_exp(inc[:6]) @ T
+                affine_new = (affine[0] + float(inc[6]), affine[1] + float(inc[7]))
+                r_new, w_new, J_new, energy_new = self.residuals(lvl, images[lvl], new_grads, T_new, affine_new)
+                if energy_new < energy:
+                    T, affine, energy = T_new, affine_new, energy_new
+                    H, g = J_new.t() @ (J_new * w_new[:, None]), J_new.t() @ (w_new * r_new)
+                    lam *= 0.5
+                else:
+                    lam = max(lam * 4, LAMBDA_EXTRAPOLATION_LIMIT)
+                if not float(inc.norm()) > 1e-3:
+                    break
+        return T, affine, iterations, math.sqrt(energy)
+
+
+def pose_errors(T, T_gt):
+    """Error de rotación (grados) y de traslación (metros) de T respecto de T_gt."""
+    error = torch.inverse(T_gt) @ T
+    return (rotation_angle_deg(error.unsqueeze(0)),
+            float((T[:3, 3] * STEREO_SCALE_FACTOR - T_gt[:3, 3]).norm()))
+
+
+if __name__ == "__main__":
+    from depth_backends import load_monodepth2, Monodepth2Depth
+
+    args = parse_args()
+    paths = sorted(glob.glob(os.path.join(args.sequence, args.camera, '*.png')))
+    poses = load_poses(args.poses)
+    fx, fy, cx, cy = read_intrinsics(args.sequence, args.camera)
+    intrinsics = (fx * args.scale, fy * args.scale, (cx + 0.5) * args.scale - 0.5, (cy + 0.5) * args.scale - 0.5)
+
+    encoder, depth_decoder, feed_width, feed_height = load_monodepth2(args.model_path)
+    depth_model = Monodepth2Depth(encoder, depth_decoder).eval()
+    pose_net = PoseNet(args.model_path, scale=1.0)  # como /pose: escala de la profundidad servida
+    to_tensor = transforms.ToTensor()
+
+    def load(index):
+        image = pil.open(paths[index]).convert('RGB')
+        if args.scale != 1.0:
+            image = image.resize((int(image.width * args.scale), int(image.height * args.scale)), pil.BILINEAR)
+        rgb = to_tensor(image).unsqueeze(0)
+        gray = to_tensor(image.convert('L')).unsqueeze(0) * 255
+        return rgb, gray
+
+    results = {'identidad': [], 'PoseNet': []}
+    for k in range(args.start, min(args.start + args.num_pairs * args.stride, len(paths) - 1), args.stride):
+        (rgb_ref, gray_ref), (rgb_new, gray_new) = load(k), load(k + 1)
+        with torch.no_grad():
+            depth = depth_model(F.interpolate(rgb_ref, (feed_height, feed_width), mode='bilinear',
+                                              align_corners=False))
+            depth = F.interpolate(depth, gray_ref.shape[-2:], mode='bilinear', align_corners=False)
+            tracker = CoarseTracker(gray_ref, depth, intrinsics, args.levels, args.num_points)
+            T_gt = torch.inverse(poses[k + 1]) @ poses[k]
+
+            start = time.perf_counter()
+            T_prior = pose_net(rgb_ref, rgb_new)[0]
+            pose_ms = (time.perf_counter() - start) * 1000
+
+            for name, T_init, extra_ms in [('identidad', torch.eye(4), 0.0), ('PoseNet', T_prior, pose_ms)]:
+                start = time.perf_counter()
+                T, _, iterations, rmse = tracker.track(gray_new, T_init)
+                track_ms = (time.perf_counter() - start) * 1000
+                rot_error, trans_error = pose_errors(T, T_gt)
+                results[name].append((iterations, track_ms + extra_ms, rmse, rot_error, trans_error))
+        prior_rot, prior_trans = pose_errors(T_prior, T_gt)
+        print("par {:5d}: prior {:.2f}° {:.3f} m | iteraciones {} -> {}".format(
+            k, prior_rot, prior_trans, results['identidad'][-1][0], results['PoseNet'][-1][0]))
+
+    print("{:<10} {:>5} {:>8} {:>8} {:>9} {:>7} {:>9} {:>9}".format(
+        'inicio', 'pares', 'iter', 'iter_p95', 'ms', 'rmse', 'rot_deg', 'tras_m'))
+    for name, rows in results.items():
+        rows = np.array(rows)
+        if not len(rows):
+            continue
+        print("{:<10} {:5d} {:8.1f} {:8.1f} {:9.1f} {:7.2f} {:9.3f} {:9.3f}".format(
+            name, len(rows), rows[:, 0].mean(), np.percentile(rows[:, 0], 95), rows[:, 1].mean(),
+            rows[:, 2].mean(), rows[:, 3].mean(), rows[:, 4].mean()))
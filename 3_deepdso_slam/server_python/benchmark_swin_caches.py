@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Costo por forward de las máscaras SW-MSA y del relative_position_bias en los
+modelos Swin (NeWCRFs, PixelFormer, DCDepth), sin y con memoización.
+
+    python benchmark_swin_caches.py --models newcrfs pixelformer dcdepth
+
+Un forward inicial registra con qué (Hp, Wp, window, shift) se llama a cada
+BasicLayer / BasicCRFLayer a la resolución de servicio; después se mide lo que
+cuesta por forward construir todas las máscaras y juntar todos los bias:
+
+    sin caché   shifted_window_mask sin memoizar + gather del bias en cada atención
+    con caché   shifted_window_mask memoizada + bias guardado en modo eval
+
+Los pesos son aleatorios: el costo no depende de ellos. Los builders aceptan
+un checkpoint opcional para los benchmarks que sí los necesitan.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from fast_load import load_pretrained
+from model_registry import isolated_imports
+from infer_multi import NEWCRFS_PATH, PIXELFORMER_PATH, DCDEPTH_PATH
+
+
+def build(factory, checkpoint=None):
+    return load_pretrained(factory, checkpoint) if checkpoint else factory()
+
+
+def build_newcrfs(checkpoint=None):
+    with isolated_imports(NEWCRFS_PATH):
+        from networks.NewCRFDepth import NewCRFDepth
+    return build(lambda: NewCRFDepth(version='large07', inv_depth=False, max_depth=10.0), checkpoint), (480, 640)
+
+
+def build_pixelformer(checkpoint=None):
+    with isolated_imports(os.path.join(PIXELFORMER_PATH, 'pixelformer')):
+        from networks.PixelFormer import PixelFormer
+    return build(lambda: PixelFormer(version='large07', inv_depth=False, max_depth=10.0, pretrained=None),
+                 checkpoint), (480, 640)
+
+
+def build_dcdepth(checkpoint=None):
+    with isolated_imports(DCDEPTH_PATH):
+        try:
+            from mmcv import Config
+        except ImportError:
+            from mmengine import Config
+        from models import MODELS
+    cfg = Config.fromfile(os.path.join(DCDEPTH_PATH, 'configs', 'dct_eigen_pff.yaml'))
+    cfg.model.pretrain = None
+    model = build(lambda: MODELS.build({'type': cfg.model.type, 'cfg': cfg}), checkpoint).model
+    return model, (cfg.dataset.input_height, cfg.dataset.input_width)
+
+
+BUILDERS = {'newcrfs': build_newcrfs, 'pixelformer': build_pixelformer, 'dcdepth': build_dcdepth}
+
+
+def capture_mask_calls(model, size):
+    """[(shifted_window_mask, (Hp, Wp, window, shift, device, dtype))] de un forward a `size`."""
+    calls = []
+
+    def hook(module, inputs):
+        x, H, W = inputs[0], inputs[-2], inputs[-1]
+        Hp = int(np.ceil(H / module.window_size)) * module.window_size
+        Wp = int(np.ceil(W / module.window_size)) * module.window_size
+        mask_fn = type(module).forward.__globals__['shifted_window_mask']
+        calls.append((mask_fn, (Hp, Wp, module.window_size, module.shift_size, x.device, x.dtype)))
+
+    handles = [m.register_forward_pre_hook(hook) for m in model.modules()
+               if hasattr(m, 'blocks') and 'shifted_window_mask' in type(m).forward.__globals__]
+    with torch.no_grad():
+        model(torch.rand(1, 3, size[0], size[1]))
+    for handle in handles:
+        handle.remove()
+    return calls
+
+
+def time_overhead(fn, iterations):
+    fn()  # Warmup (y primer llenado de las cachés)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Costo de máscaras SW-MSA y relative_position_bias por forward.')
+    parser.add_argument('--models', type=str, nargs='+', choices=list(BUILDERS), default=list(BUILDERS))
+    parser.add_argument('--iterations', type=int, default=50)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print("{:<12} {:>6} {:>6} {:>14} {:>14} {:>10}".format(
+        'modelo', 'masks', 'biases', 'sin_cache_ms', 'con_cache_ms', 'speedup'))
+    for name in args.models:
+        model, size = BUILDERS[name]()
+        model.eval()
+        mask_calls = capture_mask_calls(model, size)
+        attentions = [m for m in model.modules() if hasattr(m, 'get_relative_position_bias')]
+
+        def uncached():
+            for mask_fn, key in mask_calls:
+                mask_fn.__wrapped__(*key)
+            for attn in attentions:
+                attn._gather_relative_position_bias()
+
+        def cached():
+            for mask_fn, key in mask_calls:
+                mask_fn(*key)
+            for attn in attentions:
+                attn.get_relative_position_bias()
+
+        with torch.no_grad():
+            before = time_overhead(uncached, args.iterations)
+            after = time_overhead(cached, args.iterations)
+        print("{:<12} {:>6} {:>6} {:14.3f} {:14.3f} {:9.0f}x".format(
+            name, len(mask_calls), len(attentions), before.mean(), after.mean(), before.mean() / after.mean()))
+        del model
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Compara la latencia por frame de los transportes del servidor de profundidad.
+
+    file -> imwrite(test.jpg) + curl + lectura de depthcrfs.txt (lo que hace getDepthMap)
+    raw  -> POST con el frame crudo y profundidad binaria en la respuesta
+    shm  -> anillo de memoria compartida + socket Unix
+
+El servidor debe estar corriendo con el transporte correspondiente, p. ej.:
+    python infer_flask.py --transport raw --shm_name depth_ring
+    python benchmark_transport.py --transports raw shm
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+import subprocess
+import urllib.request
+import numpy as np
+import cv2
+
+from shm_ring import ShmDepthClient
+
+BUILD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'client_cpp', 'build'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark de transportes del servidor de profundidad.')
+    parser.add_argument('--image_dir', type=str, default=os.path.expanduser("~/Documentos/benchmark_images"))
+    parser.add_argument('--transports', nargs='+', choices=['file', 'raw', 'shm'], default=['raw', 'shm'])
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:5000/predict')
+    parser.add_argument('--shm_name', type=str, default='depth_ring')
+    parser.add_argument('--shm_socket', type=str, default='/tmp/depth_shm.sock')
+    parser.add_argument('--iterations', type=int, default=50)
+    return parser.parse_args()
+
+
+def predict_file(frame, args):
+    # Replica la secuencia de FullSystem::getDepthMap
+    cv2.imwrite(os.path.join(BUILD_DIR, 'test.jpg'), cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    subprocess.run(['curl', '-s', '-X', 'POST', args.url], stdout=subprocess.DEVNULL, check=True)
+    fs = cv2.FileStorage(os.path.join(BUILD_DIR, 'depthcrfs.txt'), cv2.FILE_STORAGE_READ)
+    depth = fs.getNode('mat1').mat()
+    fs.release()
+    return depth
+
+
+def predict_raw(frame, args):
+    req = urllib.request.Request(args.url, data=frame.tobytes(), method='POST', headers={
+        'Content-Type': 'application/octet-stream',
+        'X-Frame-Width': str(frame.shape[1]),
+        'X-Frame-Height': str(frame.shape[0]),
+        'X-Frame-Channels': '1'})
+    with urllib.request.urlopen(req) as resp:
+        dtype = '<f2' if resp.headers['X-Depth-Dtype'] == 'float16' else '<f4'
+        shape = (int(resp.headers['X-Depth-Height']), int(resp.headers['X-Depth-Width']))
+        return np.frombuffer(resp.read(), dtype=dtype).reshape(shape)
+
+
+def run_benchmark(args):
+    images = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir) if f.endswith(".jpg"))
+    if not images:
+        print("ERROR: No hay imágenes en {}".format(args.image_dir))
+        return
+    # DSO envía frames en escala de grises
+    frames = [cv2.imread(p, cv2.IMREAD_GRAYSCALE) for p in images]
+
+    results = {}
+    for transport in args.transports:
+        if transport == 'shm':
+            client = ShmDepthClient(args.shm_name, args.shm_socket)
+            predict_fn = lambda frame, args: client.predict(frame)
+        else:
+            client = None
+            predict_fn = predict_file if transport == 'file' else predict_raw
+
+        # Warmup
+        predict_fn(frames[0], args)
+
+        times = []
+        for i in range(args.iterations):
+            frame = frames[i % len(frames)]
+            start = time.time()
+            depth = predict_fn(frame, args)
+            times.append(time.time() - start)
+            assert depth.shape == frame.shape
+
+        if client is not None:
+            client.close()
+        results[transport] = np.array(times) * 1000
+
+    print("\n" + "=" * 56)
+    print("{:<10}{:>10}{:>10}{:>10}{:>14}".format("Transporte", "media ms", "p50 ms", "p99 ms", "FPS"))
+    for transport, times in results.items():
+        print("{:<10}{:>10.2f}{:>10.2f}{:>10.2f}{:>14.2f}".format(
+            transport, times.mean(), np.percentile(times, 50), np.percentile(times, 99),
+            1000.0 / times.mean()))
+    print("=" * 56 + "\n")
+
+
+if __name__ == "__main__":
+    run_benchmark(parse_args())
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Barrido workers x threads del pool de inferencia de Monodepth2 en CPU.
+
+    python benchmark_workers.py --workers 1 2 4 --threads 1 2 4
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import argparse
+import PIL.Image as pil
+from torchvision import transforms
+
+import infer_flask
+from worker_pool import benchmark_pool
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark del pool de workers de Monodepth2.')
+    parser.add_argument('--image_dir', type=str, default=os.path.expanduser("~/Documentos/benchmark_images"))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='clientes concurrentes (por defecto, uno por worker)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    images = sorted(os.path.join(args.image_dir, f) for f in os.listdir(args.image_dir) if f.endswith(".jpg"))
+    if not images:
+        raise SystemExit("ERROR: No hay imágenes en {}".format(args.image_dir))
+
+    inputs = []
+    for path in images:
+        image = pil.open(path).convert('RGB').resize((infer_flask.feed_width, infer_flask.feed_height), pil.LANCZOS)
+        inputs.append(transforms.ToTensor()(image).unsqueeze(0))
+
+    print("=== BENCHMARK: POOL DE WORKERS (MONODEPTH2) ===")
+    benchmark_pool(infer_flask.run_model, inputs, args.workers, args.threads, args.requests, args.concurrency)
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""Backends intercambiables para la inferencia de Monodepth2.
+
+    eager        ResnetEncoder(18) + DepthDecoder de PyTorch (el modo original)
+    deploy       los mismos pesos convertidos para inferencia (deploy_monodepth2:
+                 normalización y BatchNorm plegadas, channels_last, Conv+ELU
+                 fusionadas) y congelados con TorchScript al cargar
+    torchscript  grafo congelado exportado con `export`
+    onnx         el mismo grafo en ONNX, ejecutado con ONNX Runtime en CPU
+
+El grafo exportado incluye encoder, decoder (escala 0), disp_to_depth y, si se
+pide, el upsample a una resolución fija. Todos los backends reciben el batch
+(B, 3, feed_height, feed_width) en [0, 1] y devuelven la profundidad (B, 1, h, w).
+
+Exportar (el tamaño de entrada queda guardado en el artefacto):
+
+    python depth_backends.py --format torchscript --output models/mono+stereo_640x192.ts
+    python depth_backends.py --format onnx --output models/mono+stereo_640x192.onnx
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import copy
+import json
+import argparse
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+monodepth2_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'implementation'))
+if monodepth2_path not in sys.path:
+    sys.path.insert(0, monodepth2_path)
+
+import networks
+from layers import disp_to_depth
+from worker_pool import single_threaded
+
+BACKENDS = ['eager', 'deploy', 'torchscript', 'onnx']
+
+
+def load_monodepth2(model_path):
+    """Encoder y decoder de Monodepth2 en CPU, en modo eval.
+
+    Returns:
+        (encoder, depth_decoder, feed_width, feed_height)
+    """
+    encoder = networks.ResnetEncoder(18, False)
+    loaded_dict_enc = torch.load(os.path.join(model_path, "encoder.pth"), map_location='cpu')
+    feed_height = loaded_dict_enc['height']
+    feed_width = loaded_dict_enc['width']
+    filtered_dict_enc = {k: v for k, v in loaded_dict_enc.items() if k in encoder.state_dict()}
+    encoder.load_state_dict(filtered_dict_enc)
+    encoder.to('cpu')
+    encoder.eval()
+
+    depth_decoder = networks.DepthDecoder(num_ch_enc=encoder.num_ch_enc, scales=range(4))
+    depth_decoder.load_state_dict(torch.load(os.path.join(model_path, "depth.pth"), map_location='cpu'))
+    depth_decoder.to('cpu')
+    depth_decoder.eval()
+    return encoder, depth_decoder, feed_width, feed_height
+
+
+class Monodepth2Depth(nn.Module):
+    """Encoder + decoder (escala 0) + disp_to_depth [+ upsample a `output_size` (H, W)]."""
+    def __init__(self, encoder, depth_decoder, min_depth=0.1, max_depth=100.0, output_size=None):
+        super(Monodepth2Depth, self).__init__()
+        self.encoder = encoder
+        self.depth_decoder = depth_decoder
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.output_size = output_size
+
+    def forward(self, input_image):
+        disp = self.depth_decoder(self.encoder(input_image), scales=(0,))[("disp", 0)]
+        _, depth = disp_to_depth(disp, self.min_depth, self.max_depth)
+        if self.output_size is not None:
+            depth = F.interpolate(depth, self.output_size, mode="bilinear", align_corners=False)
+        return depth
+
+
+class DeployEncoder(nn.Module):
+    """ResnetEncoder con la normalización de entrada y las BatchNorm plegadas en
+    las convoluciones (sobre una copia de los pesos; el encoder original no cambia).
+
+    (x - 0.45) / 0.225 entra en conv1 como W / 0.225 y b - 0.45 * sum(W / 0.225).
+    El zero-padding de conv1 sobre la entrada normalizada equivale a rellenar la
+    entrada cruda con 0.45, así que ese padding se hace aparte con ese valor.
+    """
+    def __init__(self, encoder, mean=0.45, std=0.225):
+        super(DeployEncoder, self).__init__()
+        resnet = copy.deepcopy(encoder.encoder).eval()
+        conv1 = fuse_conv_bn_eval(resnet.conv1, resnet.bn1)
+        conv1.weight.data /= std
+        conv1.bias.data -= mean * conv1.weight.data.sum((1, 2, 3))
+        self.input_padding = (conv1.padding[1], conv1.padding[1], conv1.padding[0], conv1.padding[0])
+        self.input_mean = mean
+        conv1.padding = (0, 0)
+        self.conv1 = conv1
+        self.relu = resnet.relu
+        self.maxpool = resnet.maxpool
+
+        for layer in (resnet.layer1, resnet.layer2, resnet.layer3, resnet.layer4):
+            for block in layer:
+                # BasicBlock (conv1/bn1, conv2/bn2) y Bottleneck (también conv3/bn3)
+                for i in (1, 2, 3):
+                    if hasattr(block, 'bn{}'.format(i)):
+                        conv, bn = getattr(block, 'conv{}'.format(i)), getattr(block, 'bn{}'.format(i))
+                        setattr(block, 'conv{}'.format(i), fuse_conv_bn_eval(conv, bn))
+                        setattr(block, 'bn{}'.format(i), nn.Identity())
+                if block.downsample is not None:
+                    block.downsample = fuse_conv_bn_eval(block.downsample[0], block.downsample[1])
+        self.layers = nn.ModuleList([resnet.layer1, resnet.layer2, resnet.layer3, resnet.layer4])
+
+    def forward(self, input_image):
+        x = F.pad(input_image, self.input_padding, value=self.input_mean)
+        features = [self.relu(self.conv1(x))]
+        features.append(self.layers[0](self.maxpool(features[-1])))
+        for layer in self.layers[1:]:
+            features.append(layer(features[-1]))
+        return features
+
+
+def padded_empty(like, channels, height, width):
+    """Tensor (B, channels, height + 2, width + 2) sin inicializar, en el formato de memoria de `like`."""
+    memory_format = torch.channels_last if like.is_contiguous(memory_format=torch.channels_last) \
+        else torch.contiguous_format
+    return torch.empty((like.shape[0], channels, height + 2, width + 2), dtype=like.dtype, device=like.device,
+                       memory_format=memory_format)
+
+
+def reflect_border(padded):
+    """Completa el borde de 1 píxel de `padded` como ReflectionPad2d(1) de su interior."""
+    padded[:, :, 0] = padded[:, :, 2]
+    padded[:, :, -1] = padded[:, :, -3]
+    padded[:, :, :, 0] = padded[:, :, :, 2]
+    padded[:, :, :, -1] = padded[:, :, :, -3]
+    return padded
+
+
+class DeployDepthDecoder(nn.Module):
+    """DepthDecoder solo para la escala 0, con las convoluciones sin padding y
+    lo que hay entre ellas escrito directo en la entrada ya paddeada de la
+    siguiente:
+
+        upconv_0   ELU in-place; upsample nearest, cat con el skip y reflection
+                   pad en un único buffer (en vez de tres tensores intermedios)
+        upconv_1   ELU escrita en el interior del buffer paddeado de la
+                   convolución siguiente (ELU y pad en una sola pasada)
+
+    oneDNN no acepta ELU como post-op de la convolución (mkldnn
+    _convolution_pointwise: "Fusion behavior undefined"), así que Conv+ELU se
+    fusiona hasta donde deja el backend: la ELU no materializa otro tensor.
+    """
+    def __init__(self, depth_decoder):
+        super(DeployDepthDecoder, self).__init__()
+        blocks = [depth_decoder.convs[("upconv", i, j)] for i in range(4, -1, -1) for j in (0, 1)]
+        blocks.append(depth_decoder.convs[("dispconv", 0)])
+        for block in blocks:
+            conv3x3 = block if hasattr(block, 'pad') else block.conv  # Conv3x3 o ConvBlock
+            if not isinstance(conv3x3.pad, nn.ReflectionPad2d):
+                raise ValueError("DeployDepthDecoder requiere Conv3x3 con ReflectionPad2d")
+        self.use_skips = depth_decoder.use_skips
+        self.upconvs_0 = nn.ModuleList([copy.deepcopy(block.conv.conv) for block in blocks[0:-1:2]])
+        self.upconvs_1 = nn.ModuleList([copy.deepcopy(block.conv.conv) for block in blocks[1:-1:2]])
+        self.dispconv = copy.deepcopy(blocks[-1].conv)
+
+    def forward(self, input_features, scales=(0,)):
+        """Misma interfaz que DepthDecoder.forward; solo calcula ("disp", 0)."""
+        x = F.pad(input_features[-1], (1, 1, 1, 1), mode='reflect')
+        for upconv_0, upconv_1, i in zip(self.upconvs_0, self.upconvs_1, range(4, -1, -1)):
+            y = F.elu(upconv_0(x), inplace=True)
+            B, C, h, w = y.shape
+            skip = input_features[i - 1] if self.use_skips and i > 0 else None
+            x = padded_empty(y, C if skip is None else C + skip.shape[1], 2 * h, 2 * w)
+            x[:, :C, 1:-1, 1:-1].view(B, C, h, 2, w, 2).copy_(y[:, :, :, None, :, None].expand(B, C, h, 2, w, 2))
+            if skip is not None:
+                x[:, C:, 1:-1, 1:-1].copy_(skip)
+            y = upconv_1(reflect_border(x))
+            x = padded_empty(y, y.shape[1], y.shape[2], y.shape[3])
+            torch.ops.aten.elu.out(y, out=x[:, :, 1:-1, 1:-1])  # F.elu escrita en la vista
+            reflect_border(x)
+        return {("disp", 0): torch.sigmoid(self.dispconv(x))}
+
+
+def deploy_monodepth2(encoder, depth_decoder, min_depth=0.1, max_depth=100.0, output_size=None):
+    """Monodepth2Depth para inferencia: DeployEncoder + DeployDepthDecoder en
+    channels_last. Espera la entrada en channels_last (ver DeployBackend)."""
+    model = Monodepth2Depth(DeployEncoder(encoder), DeployDepthDecoder(depth_decoder),
+                            min_depth, max_depth, output_size)
+    return model.eval().to(memory_format=torch.channels_last)
+
+
+class EagerBackend:
+    name = 'eager'
+
+    def __init__(self, model, feed_width, feed_height):
+        self.model = model
+        self.feed_width = feed_width
+        self.feed_height = feed_height
+
+    def __call__(self, input_image):
+        with torch.no_grad():
+            return self.model(input_image)
+
+
+class TorchScriptBackend(EagerBackend):
+    name = 'torchscript'
+
+    def __init__(self, path):
+        extra_files = {'meta.json': ''}
+        model = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        meta = json.loads(extra_files['meta.json'])
+        super(TorchScriptBackend, self).__init__(model, meta['feed_width'], meta['feed_height'])
+
+
+class DeployBackend(EagerBackend):
+    """deploy_monodepth2 congelado con TorchScript (trace a feed_height x
+    feed_width). Al cargar se compara contra eager sobre una entrada aleatoria.
+
+    El trace y la comparación corren con un solo hilo intra-op, así el proceso
+    puede crear un WorkerPool (fork) después de cargar el backend."""
+    name = 'deploy'
+
+    def __init__(self, encoder, depth_decoder, feed_width, feed_height, max_rel=1e-4):
+        with torch.no_grad(), single_threaded():
+            eager = Monodepth2Depth(encoder, depth_decoder).eval()
+            model = deploy_monodepth2(encoder, depth_decoder)
+            example = torch.rand(1, 3, feed_height, feed_width)
+            traced = torch.jit.freeze(torch.jit.trace(model, example.contiguous(memory_format=torch.channels_last)))
+            super(DeployBackend, self).__init__(traced, feed_width, feed_height)
+            reference = eager(example)
+            self.max_abs = float((self(example) - reference).abs().max())
+        if self.max_abs > max_rel * float(reference.abs().max()):
+            raise RuntimeError("deploy difiere de eager en {:.2e} m".format(self.max_abs))
+
+    def __call__(self, input_image):
+        with torch.no_grad():
+            return self.model(input_image.contiguous(memory_format=torch.channels_last)).contiguous()
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, path, num_threads=0):
+        if onnxruntime is None:
+            raise ImportError("El backend 'onnx' requiere el paquete onnxruntime")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        meta = self.session.get_modelmeta().custom_metadata_map
+        self.feed_width = int(meta['feed_width'])
+        self.feed_height = int(meta['feed_height'])
+
+    def __call__(self, input_image):
+        outputs = self.session.run(None, {'image': input_image.contiguous().numpy()})
+        return torch.from_numpy(outputs[0])
+
+
+def load_backend(name, model_path, artifact=None):
+    """Crea el backend `name`. `eager` y `deploy` leen los pesos de `model_path`;
+    los demás cargan el artefacto exportado (`artifact`)."""
+    if name == 'eager':
+        encoder, depth_decoder, feed_width, feed_height = load_monodepth2(model_path)
+        return EagerBackend(Monodepth2Depth(encoder, depth_decoder).eval(), feed_width, feed_height)
+    if name == 'deploy':
+        with single_threaded():  # Como en DeployBackend: construir los módulos también es paralelo
+            return DeployBackend(*load_monodepth2(model_path))
+    if artifact is None or not os.path.exists(artifact):
+        raise ValueError("El backend '{}' necesita un artefacto exportado (--artifact)".format(name))
+    if name == 'torchscript':
+        return TorchScriptBackend(artifact)
+    if name == 'onnx':
+        return OnnxBackend(artifact, torch.get_num_threads())
+    raise ValueError("Backend desconocido '{}', debe ser uno de {}".format(name, BACKENDS))
+
+
+def export(model_path, fmt, output, output_size=None):
+    """Exporta el grafo completo de `model_path` a TorchScript (congelado) u ONNX."""
+    encoder, depth_decoder, feed_width, feed_height = load_monodepth2(model_path)
+    model = Monodepth2Depth(encoder, depth_decoder, output_size=output_size).eval()
+    example = torch.rand(1, 3, feed_height, feed_width)
+    meta = {'feed_width': feed_width, 'feed_height': feed_height,
+            'output_size': list(output_size) if output_size else None}
+
+    if fmt == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.freeze(torch.jit.trace(model, example))
+        torch.jit.save(traced, output, _extra_files={'meta.json': json.dumps(meta)})
+    elif fmt == 'onnx':
+        import onnx
+        torch.onnx.export(model, example, output, input_names=['image'], output_names=['depth'],
+                          dynamic_axes={'image': {0: 'batch'}, 'depth': {0: 'batch'}},
+                          opset_version=17, dynamo=False)
+        onnx_model = onnx.load(output)
+        for key, value in meta.items():
+            entry = onnx_model.metadata_props.add()
+            entry.key, entry.value = key, str(value)
+        onnx.save(onnx_model, output)
+    else:
+        raise ValueError("Formato desconocido '{}'".format(fmt))
+    return meta
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Exporta Monodepth2 (encoder+decoder+disp_to_depth) a un grafo congelado.')
+    parser.add_argument('--model_name', type=str, default='mono+stereo_640x192')
+    parser.add_argument('--format', type=str, choices=['torchscript', 'onnx'], required=True)
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--upsample', type=int, nargs=2, default=None, metavar=('WIDTH', 'HEIGHT'),
+                        help='incluye en el grafo el upsample a esta resolución fija')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    model_path = os.path.join(monodepth2_path, "models", args.model_name)
+    output_size = (args.upsample[1], args.upsample[0]) if args.upsample else None
+    meta = export(model_path, args.format, args.output, output_size)
+    print("==> {} exportado a {} ({})".format(args.model_name, args.output, meta))
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Caché LRU de predicciones de profundidad indexada por el contenido del frame.
+
+La llave es un hash blake2b de los bytes de entrada más los datos que cambian
+la salida para los mismos bytes (id del modelo, resolución, formato). Las
+entradas se desalojan por orden de uso cuando se supera `max_bytes` y dejan de
+ser válidas pasados `ttl_s` segundos (0 = sin vencimiento).
+
+No depende de ningún modelo: los servidores guardan lo que les resulte más
+barato de reutilizar (arrays de NumPy o tensores de PyTorch).
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+
+
+def _nbytes(value):
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return value.element_size() * value.nelement()
+
+
+class DepthCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl_s=0):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.counters = Counter()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(data, *extra):
+        """Hash de `data` (bytes o cualquier buffer contiguo) y de los campos de `extra`."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(data)
+        for field in extra:
+            h.update(b'\x00' + str(field).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Devuelve el valor guardado o None. El valor se comparte: no modificarlo."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            value, nbytes, expires = entry
+            if expires is not None and expires < time.time():
+                self._remove(key)
+                self.counters['expired'] += 1
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        expires = time.time() + self.ttl_s if self.ttl_s > 0 else None
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, nbytes, expires)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+
+    def _remove(self, key):
+        _, nbytes, _ = self.entries.pop(key)
+        self.total_bytes -= nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                "hits": self.counters['hits'],
+                "misses": self.counters['misses'],
+                "hit_rate": round(self.counters['hits'] / lookups, 4) if lookups else 0.0,
+                "evictions": self.counters['evictions'],
+                "expired": self.counters['expired'],
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s
+            }
@@ -0,0 +1,54 @@
+"""
+Activation memory of a forward pass as seen by the PyTorch profiler.
+"""
+from torch.profiler import profile, ProfilerActivity
+
+
+def profile_memory(fn, *inputs):
+    """
+    Memory allocated by PyTorch during fn(*inputs)
+
+    Adds up, in time order, the self memory balance of every op (and the loose
+    frees) recorded by the profiler; memory allocated before the call is not
+    counted.
+
+    Parameters
+    ----------
+    fn : callable
+        Function to profile
+    inputs :
+        Arguments of `fn`
+
+    Returns
+    -------
+    stats : dict
+        'peak_bytes', 'allocations' (ops with a positive balance) and 'allocated_bytes'
+    output :
+        fn(*inputs)
+    """
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        output = fn(*inputs)
+    allocated = peak = allocations = allocated_bytes = 0
+    for event in sorted(prof.events(), key=lambda e: e.time_range.start):
+        usage = event.self_cpu_memory_usage
+        allocated += usage
+        peak = max(peak, allocated)
+        if usage > 0:
+            allocations += 1
+            allocated_bytes += usage
+    return dict(peak_bytes=peak, allocations=allocations, allocated_bytes=allocated_bytes), output
+
+
+def profile_peak_bytes(fn, *inputs):
+    """
+    Peak bytes allocated by PyTorch during fn(*inputs) (see profile_memory)
+
+    Returns
+    -------
+    peak_bytes : int
+        Peak of the allocated memory
+    output :
+        fn(*inputs)
+    """
+    stats, output = profile_memory(fn, *inputs)
+    return stats['peak_bytes'], output
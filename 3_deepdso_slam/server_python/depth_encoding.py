@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Codificaciones binarias compactas para mapas de profundidad.
+
+Cada codificación devuelve el body y los headers con la forma y la conversión a
+metros: profundidad = valor * X-Depth-Scale + X-Depth-Offset.
+
+    nombre     mimetype                        contenido
+    f32        application/x-depth-f32         float32 little-endian
+    f16        application/x-depth-f16         float16 little-endian
+    u16mm      application/x-depth-u16mm       uint16 little-endian en milímetros (*)
+    png16      image/png                       PNG de 16 bits en milímetros (*)
+    f16.lz4    application/x-depth-f16+lz4     float16 comprimido con lz4 (frame)
+    f16.zst    application/x-depth-f16+zstd    float16 comprimido con zstd
+
+(*) Con milímetros el máximo es 65.535 m: si el rango del modelo (`max_depth`)
+es mayor, el paso pasa a max_depth / 65535 y lo indica X-Depth-Scale (Monodepth2
+llega a 100 m), así la profundidad lejana no satura.
+
+lz4 y zstandard son opcionales: si no están instalados esas codificaciones no se
+anuncian ni se aceptan.
+"""
+from __future__ import absolute_import, division, print_function
+
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MIMETYPES = {
+    'f32': 'application/x-depth-f32',
+    'f16': 'application/x-depth-f16',
+    'u16mm': 'application/x-depth-u16mm',
+    'png16': 'image/png',
+    'f16.lz4': 'application/x-depth-f16+lz4',
+    'f16.zst': 'application/x-depth-f16+zstd',
+}
+
+
+def available_encodings():
+    encodings = ['f32', 'f16', 'u16mm', 'png16']
+    if lz4 is not None:
+        encodings.append('f16.lz4')
+    if zstandard is not None:
+        encodings.append('f16.zst')
+    return encodings
+
+
+def negotiate(format_param=None, accept_header=None):
+    """Elige la codificación a partir de `?format=` o, si no viene, del header Accept.
+    Devuelve None si el cliente no pidió ninguna codificación binaria conocida.
+
+    Raises:
+        ValueError si `format_param` no es una codificación disponible
+    """
+    encodings = available_encodings()
+    if format_param:
+        if format_param not in encodings:
+            raise ValueError("format debe ser uno de {}".format(encodings))
+        return format_param
+
+    if accept_header:
+        by_mimetype = {MIMETYPES[name]: name for name in encodings}
+        for entry in accept_header.split(','):
+            mimetype = entry.split(';')[0].strip()
+            if mimetype in by_mimetype:
+                return by_mimetype[mimetype]
+    return None
+
+
+U16_MAX = np.iinfo(np.uint16).max
+
+
+def u16_scale(max_depth=None):
+    """Metros por unidad de u16mm / png16: 1 mm, o max_depth / 65535 si 1 mm no alcanza."""
+    if max_depth is None or max_depth <= U16_MAX * 0.001:
+        return 0.001
+    return max_depth / float(U16_MAX)
+
+
+def _to_uint16(depth_map, scale):
+    return np.clip(np.rint(depth_map / scale), 0, U16_MAX).astype('<u2')
+
+
+def encode_depth(depth_map, encoding, max_depth=None):
+    """Codifica `depth_map` (H, W) en metros.
+
+    Args:
+        max_depth: profundidad máxima del modelo en metros; define el paso de
+            u16mm / png16 (ver u16_scale). None = milímetros
+
+    Returns:
+        (body, mimetype, headers)
+    """
+    scale = 1.0
+    if encoding == 'f32':
+        body = depth_map.astype('<f4').tobytes()
+    elif encoding == 'f16':
+        body = depth_map.astype('<f2').tobytes()
+    elif encoding == 'u16mm':
+        scale = u16_scale(max_depth)
+        body = _to_uint16(depth_map, scale).tobytes()
+    elif encoding == 'png16':
+        scale = u16_scale(max_depth)
+        buffered = BytesIO()
+        Image.fromarray(_to_uint16(depth_map, scale)).save(buffered, format="PNG")
+        body = buffered.getvalue()
+    elif encoding == 'f16.lz4' and lz4 is not None:
+        body = lz4.frame.compress(depth_map.astype('<f2').tobytes())
+    elif encoding == 'f16.zst' and zstandard is not None:
+        body = zstandard.ZstdCompressor(level=3).compress(depth_map.astype('<f2').tobytes())
+    else:
+        raise ValueError("Codificación no disponible: {}".format(encoding))
+
+    headers = {
+        'X-Depth-Encoding': encoding,
+        'X-Depth-Width': str(depth_map.shape[1]),
+        'X-Depth-Height': str(depth_map.shape[0]),
+        'X-Depth-Scale': repr(scale),
+        'X-Depth-Offset': '0.0',
+    }
+    return body, MIMETYPES[encoding], headers
+
+
+def decode_depth(body, headers):
+    """Inversa de `encode_depth` para clientes Python: devuelve la profundidad en metros."""
+    encoding = headers['X-Depth-Encoding']
+    shape = (int(headers['X-Depth-Height']), int(headers['X-Depth-Width']))
+    if encoding == 'f32':
+        values = np.frombuffer(body, dtype='<f4')
+    elif encoding == 'f16':
+        values = np.frombuffer(body, dtype='<f2')
+    elif encoding == 'u16mm':
+        values = np.frombuffer(body, dtype='<u2')
+    elif encoding == 'png16':
+        values = np.asarray(Image.open(BytesIO(body)), dtype=np.uint16)
+    elif encoding == 'f16.lz4':
+        values = np.frombuffer(lz4.frame.decompress(body), dtype='<f2')
+    elif encoding == 'f16.zst':
+        values = np.frombuffer(zstandard.ZstdDecompressor().decompress(body), dtype='<f2')
+    else:
+        raise ValueError("Codificación desconocida: {}".format(encoding))
+    scale = float(headers['X-Depth-Scale'])
+    offset = float(headers['X-Depth-Offset'])
+    return values.reshape(shape).astype(np.float32) * scale + offset
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Carga rápida de modelos para servir: sin inicialización y con pesos mapeados en memoria.
+
+Los servidores construían PixelFormer / NeWCRFs / DCDepth con el backbone Swin
+preentrenado (`init_weights` lee el .pth de ImageNet-22k e inicializa todo al
+azar) y después el checkpoint final pisaba cada parámetro con strict=True.
+`load_pretrained` evita ese trabajo:
+
+- los parámetros se registran en el device 'meta' (sin memoria ni init); los
+  buffers calculados en __init__ se construyen normalmente
+- el checkpoint se lee con `torch.load(mmap=True)` o desde .safetensors y se
+  asigna a los parámetros sin copiarlo (`load_state_dict(assign=True)`)
+
+Para pasar un checkpoint de entrenamiento a un formato mapeable:
+
+    python fast_load.py pretrained/checkpoints/nyu.pth pretrained/checkpoints/nyu.safetensors
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import time
+import inspect
+import argparse
+import resource
+import contextlib
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+try:
+    import safetensors.torch
+except ImportError:
+    safetensors = None
+
+# Los medidores de memoria viven en depth_common (los usa también su tiling)
+from depth_common.memory import profile_memory, profile_peak_bytes  # noqa: F401
+
+# load_state_dict(assign=True) y torch.load(mmap=True) existen desde PyTorch 2.1;
+# con versiones anteriores el modelo se inicializa y los pesos se copian.
+SUPPORTS_ASSIGN = 'assign' in inspect.signature(nn.Module.load_state_dict).parameters
+
+
+@contextlib.contextmanager
+def empty_parameters():
+    """Dentro del bloque los nn.Parameter que se registran quedan en el device
+    'meta': no ocupan memoria y las funciones de init sobre ellos no hacen nada.
+    """
+    register_parameter = nn.Module.register_parameter
+
+    def register_on_meta(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            module._parameters[name] = type(param)(param.to('meta'), requires_grad=param.requires_grad)
+
+    nn.Module.register_parameter = register_on_meta
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+
+def read_state_dict(path):
+    """state_dict de un checkpoint (.safetensors, o .pth/.ckpt con o sin 'model' /
+    'state_dict'), sin el prefijo 'module.' de DataParallel. Los .pth en formato
+    zip se mapean en memoria en lugar de leerse completos.
+    """
+    if path.endswith('.safetensors'):
+        if safetensors is None:
+            raise ImportError("Se necesita el paquete safetensors para leer {}".format(path))
+        state_dict = safetensors.torch.load_file(path, device='cpu')
+    else:
+        try:
+            checkpoint = torch.load(path, map_location='cpu', mmap=True)
+        except (RuntimeError, TypeError):
+            # Formato legacy (no zip) o PyTorch < 2.1: sin mmap
+            checkpoint = torch.load(path, map_location='cpu')
+        state_dict = checkpoint
+        for key in ('model', 'state_dict'):
+            if isinstance(checkpoint, dict) and key in checkpoint:
+                state_dict = checkpoint[key]
+                break
+    return OrderedDict((k[7:] if k.startswith('module.') else k, v) for k, v in state_dict.items())
+
+
+def load_pretrained(factory, checkpoint_path):
+    """Construye `factory()` sin inicializar sus parámetros y carga `checkpoint_path`.
+
+    `factory` no debe cargar pesos por su cuenta (p. ej. pretrained=None).
+
+    Raises:
+        RuntimeError si el checkpoint no cubre todos los parámetros del modelo
+    """
+    start_time = time.time()
+    if SUPPORTS_ASSIGN:
+        with empty_parameters():
+            model = factory()
+        model.load_state_dict(read_state_dict(checkpoint_path), strict=True, assign=True)
+    else:
+        model = factory()
+        model.load_state_dict(read_state_dict(checkpoint_path), strict=True)
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError("Parámetros sin valor después de cargar {}: {}".format(checkpoint_path, missing[:5]))
+    model.eval()
+    print("INFO: {} cargado en {:.2f}s (pico de RSS: {:.0f} MB)".format(
+        os.path.basename(checkpoint_path), time.time() - start_time, peak_rss_mb()))
+    return model
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def convert_checkpoint(src, dst):
+    """Guarda el state_dict de `src` en `dst` (.safetensors, o .pth en formato zip
+    mapeable con torch.load(mmap=True))."""
+    state_dict = OrderedDict((k, v.contiguous()) for k, v in read_state_dict(src).items())
+    if dst.endswith('.safetensors'):
+        if safetensors is None:
+            raise ImportError("Se necesita el paquete safetensors para escribir {}".format(dst))
+        # safetensors no admite tensores que compartan memoria
+        seen = set()
+        for k, v in state_dict.items():
+            if v.untyped_storage().data_ptr() in seen:
+                state_dict[k] = v.clone()
+            seen.add(state_dict[k].untyped_storage().data_ptr())
+        safetensors.torch.save_file(state_dict, dst)
+    else:
+        torch.save(state_dict, dst)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convierte un checkpoint a un formato mapeable en memoria.')
+    parser.add_argument('src', type=str, help='checkpoint de entrenamiento (.pth / .ckpt)')
+    parser.add_argument('dst', type=str, help='destino .safetensors o .pth')
+    args = parser.parse_args()
+    if not os.path.exists(args.src):
+        sys.exit("ERROR: No existe {}".format(args.src))
+    convert_checkpoint(args.src, args.dst)
+    print("==> {} -> {}".format(args.src, args.dst))
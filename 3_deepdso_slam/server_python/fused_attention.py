@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Atención fusionada (F.scaled_dot_product_attention) en las WindowAttention de
+los modelos Swin (NeWCRFs, PixelFormer con SAM, DCDepth).
+
+Cada WindowAttention tiene el flag `fused_attn` (False por defecto): con él
+activo, q·kᵀ + bias (+ máscara SW-MSA), softmax y ·v se hacen en una sola
+llamada a scaled_dot_product_attention en lugar de materializar varias veces
+el tensor (num_windows*B, heads, N, N). Requiere PyTorch >= 2.1 (argumento
+`scale`).
+
+Benchmark (paridad numérica, latencia y pico de memoria en CPU):
+
+    python fused_attention.py --models newcrfs pixelformer dcdepth \\
+        --newcrfs_checkpoint ../DeepDSO/newcrfs/model_nyu.ckpt ...
+
+Sin checkpoint se usan pesos aleatorios (sirve para latencia y memoria, no
+para juzgar la paridad sobre las profundidades reales).
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+
+import numpy as np
+import PIL.Image as pil
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+
+from fast_load import profile_peak_bytes
+
+
+def _probe_fused_attention():
+    try:
+        q = torch.zeros(1, 1, 2, 2)
+        F.scaled_dot_product_attention(q, q, q, attn_mask=torch.zeros(1, 1, 2, 2), scale=1.0)
+    except (AttributeError, TypeError):
+        return False
+    return True
+
+
+FUSED_ATTN_AVAILABLE = _probe_fused_attention()
+
+
+def set_fused_attention(model, enabled=True):
+    """Activa/desactiva `fused_attn` en todas las WindowAttention de `model`.
+
+    Returns:
+        cantidad de módulos tocados (0 si el modelo no tiene WindowAttention)
+
+    Raises:
+        RuntimeError si se pide activarla y PyTorch no la soporta
+    """
+    if enabled and not FUSED_ATTN_AVAILABLE:
+        raise RuntimeError("F.scaled_dot_product_attention con `scale` requiere PyTorch >= 2.1 "
+                           "(instalado: {})".format(torch.__version__))
+    modules = [m for m in model.modules() if hasattr(m, 'fused_attn')]
+    for module in modules:
+        module.fused_attn = enabled
+    return len(modules)
+
+
+def time_forward(model, inputs, iterations):
+    model(inputs[0])  # Warmup
+    times = []
+    for i in range(iterations):
+        start = time.time()
+        model(inputs[i % len(inputs)])
+        times.append(time.time() - start)
+    return np.array(times) * 1000
+
+
+def parse_args():
+    from benchmark_swin_caches import BUILDERS
+    from infer_multi import NEWCRFS_PATH, PIXELFORMER_PATH, DCDEPTH_PATH
+    parser = argparse.ArgumentParser(description='Atención fusionada vs original en las WindowAttention.')
+    parser.add_argument('--models', type=str, nargs='+', choices=list(BUILDERS), default=list(BUILDERS))
+    parser.add_argument('--newcrfs_checkpoint', type=str, default=os.path.join(NEWCRFS_PATH, 'model_nyu.ckpt'))
+    parser.add_argument('--pixelformer_checkpoint', type=str,
+                        default=os.path.join(PIXELFORMER_PATH, 'pretrained/checkpoints/nyu.pth'))
+    parser.add_argument('--dcdepth_checkpoint', type=str,
+                        default=os.path.join(DCDEPTH_PATH, 'checkpoints/dcdepth_eigen.pth'))
+    parser.add_argument('--random_weights', action='store_true',
+                        help='no carga checkpoints (solo latencia y memoria)')
+    parser.add_argument('--image_dir', type=str, default=os.path.expanduser("~/Documentos/benchmark_images"),
+                        help='imágenes de entrada; si no hay, se usa ruido')
+    parser.add_argument('--iterations', type=int, default=10)
+    return parser.parse_args()
+
+
+def load_inputs(image_dir, size):
+    normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    transform = transforms.Compose([transforms.Resize(size), transforms.ToTensor(), normalize])
+    paths = sorted(os.path.join(image_dir, f) for f in os.listdir(image_dir)
+                   if f.endswith(".jpg")) if os.path.isdir(image_dir) else []
+    if not paths:
+        print("AVISO: no hay imágenes en {}, se usa ruido".format(image_dir))
+        return [torch.rand(1, 3, size[0], size[1])]
+    return [transform(pil.open(p).convert('RGB')).unsqueeze(0) for p in paths]
+
+
+if __name__ == "__main__":
+    from benchmark_swin_caches import BUILDERS
+    args = parse_args()
+    if not FUSED_ATTN_AVAILABLE:
+        raise SystemExit("ERROR: PyTorch {} no soporta la atención fusionada".format(torch.__version__))
+
+    print("{:<12} {:>7} {:>11} {:>11} {:>10} {:>10} {:>10} {:>10}".format(
+        'modelo', 'modulos', 'max_abs', 'max_rel', 'orig_ms', 'fused_ms', 'orig_MB', 'fused_MB'))
+    for name in args.models:
+        checkpoint = None if args.random_weights else getattr(args, '{}_checkpoint'.format(name))
+        model, size = BUILDERS[name](checkpoint)
+        model.eval()
+        inputs = load_inputs(args.image_dir, size)
+        results = {}
+        with torch.no_grad():
+            for fused in (False, True):
+                num_modules = set_fused_attention(model, fused)
+                outputs = [model(x) for x in inputs]
+                # DCDepth devuelve la lista de profundidades de cada iteración
+                outputs = [o[-1] if isinstance(o, (list, tuple)) else o for o in outputs]
+                latencies = time_forward(model, inputs, args.iterations)
+                peak, _ = profile_peak_bytes(model, inputs[0])
+                results[fused] = (outputs, latencies.mean(), peak)
+
+        (original, orig_ms, orig_peak), (fused, fused_ms, fused_peak) = results[False], results[True]
+        max_abs = max(float((a - b).abs().max()) for a, b in zip(original, fused))
+        max_rel = max(float(((a - b).abs() / a.abs().clamp(min=1e-6)).max()) for a, b in zip(original, fused))
+        print("{:<12} {:>7} {:11.2e} {:11.2e} {:10.1f} {:10.1f} {:10.1f} {:10.1f}".format(
+            name, num_modules, max_abs, max_rel, orig_ms, fused_ms, orig_peak / 2**20, fused_peak / 2**20))
+        del model
@@ -18,6 +18,8 @@ def disp_to_depth(disp, min_depth, max_depth):
     The formula for this conversion is given in the 'additional considerations'
     section of the paper.
     """
+    # At least fp32: the reciprocal of a bf16 / fp16 disparity (autocast) loses too much precision
+    disp = disp.to(torch.promote_types(disp.dtype, torch.float32))
     min_disp = 1 / max_depth
     max_disp = 1 / min_depth
     scaled_disp = min_disp + (max_disp - min_disp) * disp
@@ -47,19 +47,25 @@ class DepthDecoder(nn.Module):
         self.decoder = nn.ModuleList(list(self.convs.values()))
         self.sigmoid = nn.Sigmoid()
 
-    def forward(self, input_features):
-        self.outputs = {}
+    def forward(self, input_features, scales=None):
+        """Returns {("disp", s): disparity} for each s in `scales` (default: all of
+        self.scales). The decoder stops at the finest requested scale and no
+        per-call state is kept on the module, so inference callers can ask for
+        just ("disp", 0) and share one instance across threads.
+        """
+        scales = self.scales if scales is None else scales
+        outputs = {}
 
         # decoder
         x = input_features[-1]
-        for i in range(4, -1, -1):
+        for i in range(4, min(scales) - 1, -1):
             x = self.convs[("upconv", i, 0)](x)
             x = [upsample(x)]
             if self.use_skips and i > 0:
                 x += [input_features[i - 1]]
             x = torch.cat(x, 1)
             x = self.convs[("upconv", i, 1)](x)
-            if i in self.scales:
-                self.outputs[("disp", i)] = self.sigmoid(self.convs[("dispconv", i)](x))
+            if i in scales:
+                outputs[("disp", i)] = self.sigmoid(self.convs[("dispconv", i)](x))
 
-        return self.outputs
+        return outputs
@@ -1,91 +1,517 @@
 # -*- coding: utf-8 -*-
-from __future__ import
+from __future__ import absolute_import, division, print_function
 
 import os
 import sys
+import argparse
+import threading
+from io import BytesIO
+from collections import OrderedDict
 import numpy as np
 import PIL.Image as pil
 import cv2
 import torch
 from torchvision import transforms
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 
 # --- Añadir Monodepth2 al path
 monodepth2_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'implementation'))
 if monodepth2_path not in sys.path:
     sys.path.insert(0, monodepth2_path)
 
-import networks
 from layers import disp_to_depth
+from shm_ring import ShmDepthServer
+from worker_pool import WorkerPool, single_threaded
+from depth_cache import DepthCache
+from depth_backends import BACKENDS, load_backend, load_monodepth2
+from precision import PRECISIONS, autocast
+from keyframe_depth import PoseNet
+from stage_metrics import StageMetrics, instrument_app, stage
 
 # Configuración del Servidor Flask
 app = Flask(__name__)
 
+# Modo de transporte de /predict:
+#   'file' -> lee client_cpp/build/test.jpg y escribe depthcrfs.txt (modo original)
+#   'raw'  -> bytes crudos del frame en el body, profundidad binaria en la respuesta
+TRANSPORT = 'file'
+DEPTH_DTYPES = {'float32': '<f4', 'float16': '<f2'}
+DEPTH_DTYPE = 'float32'
+
+# Pool de procesos de inferencia (--workers); None = inferencia en el proceso del servidor
+worker_pool = None
+# Caché de profundidad por contenido del frame (--cache_mb); None = desactivada
+depth_cache = None
+# Latencia por etapa de cada request, expuesta en /metrics
+metrics = StageMetrics()
+# Backend de inferencia (--backend deploy/torchscript/onnx); None = encoder y decoder eager
+backend = None
+# Precisión del encoder y el decoder eager (--precision); disp_to_depth siempre en fp32
+PRECISION = 'fp32'
+# PoseNet de Monodepth2 para /pose y X-Pose-From (--pose); None = desactivado
+pose_net = None
+# Entradas de red de los últimos frames de cada sesión, por (X-Session-Id, X-Frame-Id)
+pose_frames = OrderedDict()
+pose_frames_lock = threading.Lock()
+POSE_FRAMES = 32
+
 # --- Carga del Modelo Monodepth2
 model_name = "mono+stereo_640x192"
 model_path = os.path.join(monodepth2_path, "models", model_name)
 
 def load_model():
     print("==> Cargando modelo Monodepth2 en CPU...")
-    encoder_path = os.path.join(model_path, "encoder.pth")
-    depth_decoder_path = os.path.join(model_path, "depth.pth")
-
-    # Cargar ENCODER
-    encoder = networks.ResnetEncoder(18, False)
-    loaded_dict_enc = torch.load(encoder_path, map_location='cpu')
-    feed_height = loaded_dict_enc['height']
-    feed_width = loaded_dict_enc['width']
-    filtered_dict_enc = {k: v for k, v in loaded_dict_enc.items() if k in encoder.state_dict()}
-    encoder.load_state_dict(filtered_dict_enc)
-    encoder.to('cpu')
-    encoder.eval()
-
-    # Cargar DECODER
-    depth_decoder = networks.DepthDecoder(num_ch_enc=encoder.num_ch_enc, scales=range(4))
-    loaded_dict = torch.load(depth_decoder_path, map_location='cpu')
-    depth_decoder.load_state_dict(loaded_dict)
-    depth_decoder.to('cpu')
-    depth_decoder.eval()
-
+    # Un solo hilo intra-op: --workers hace fork de este proceso después (ver worker_pool.py)
+    with single_threaded():
+        encoder, depth_decoder, feed_width, feed_height = load_monodepth2(model_path)
     print("==> ¡Modelo cargado exitosamente!")
     return encoder, depth_decoder, feed_width, feed_height
 
 encoder, depth_decoder, feed_width, feed_height = load_model()
 
+
+def run_model(input_image):
+    """Encoder + decoder + disp_to_depth sobre un batch (B, 3, feed_height, feed_width).
+    Devuelve la profundidad a la resolución de la red.
+    """
+    if worker_pool is not None:
+        with stage('forward'):
+            return worker_pool.run(input_image)
+    if backend is not None:
+        with stage('forward'):
+            return backend(input_image)
+    with torch.no_grad():
+        with stage('encoder'), autocast(PRECISION):
+            features = encoder(input_image)
+        with stage('decoder'), autocast(PRECISION):
+            outputs = depth_decoder(features, scales=(0,))
+        with stage('postprocess'):
+            disp = outputs[("disp", 0)]
+            _, depth = disp_to_depth(disp, 0.1, 100)
+    return depth
+
+
+def run_model_cached(frame_key, make_input):
+    """run_model con la caché por contenido: `frame_key` es una tupla con los bytes
+    del frame y lo que define su formato; `make_input` construye la entrada de la
+    red y solo se llama si no hay acierto.
+    """
+    if depth_cache is None or frame_key is None:
+        return run_model(make_input())
+    key = DepthCache.key(frame_key[0], model_name, feed_width, feed_height,
+                         'eager' if backend is None else backend.name, *frame_key[1:])
+    depth = depth_cache.get(key)
+    if depth is None:
+        depth = run_model(make_input())
+        depth_cache.put(key, depth)
+    return depth
+
+
+def decode_raw_frame(data, width, height, channels):
+    """Convierte los bytes crudos (gris o BGR, uint8) del body en una imagen PIL RGB.
+    """
+    expected = width * height * channels
+    if len(data) != expected:
+        raise ValueError("El body tiene {} bytes, se esperaban {} ({}x{}x{})".format(
+            len(data), expected, width, height, channels))
+
+    frame = np.frombuffer(data, dtype=np.uint8)
+    if channels == 1:
+        frame = np.repeat(frame.reshape(height, width, 1), 3, axis=2)
+    elif channels == 3:
+        frame = frame.reshape(height, width, 3)[:, :, ::-1]
+    else:
+        raise ValueError("X-Frame-Channels debe ser 1 (gris) o 3 (BGR)")
+    return pil.fromarray(np.ascontiguousarray(frame), 'RGB')
+
+
+def preprocess(input_image):
+    with stage('preprocess'):
+        input_image = input_image.convert('RGB').resize((feed_width, feed_height), pil.LANCZOS)
+        return transforms.ToTensor()(input_image).unsqueeze(0).to('cpu')
+
+
+def session_frame():
+    """(sesión, id de frame) de los headers X-Session-Id y X-Frame-Id, o None."""
+    session, frame_id = request.headers.get('X-Session-Id'), request.headers.get('X-Frame-Id')
+    if session is None or frame_id is None:
+        return None
+    return session, frame_id
+
+
+def frame_input(input_image):
+    """make_input de run_model_cached para un frame de un request.
+
+    Con /pose activo y los headers X-Session-Id / X-Frame-Id, la entrada se
+    construye ya y se guarda: el PoseNet usa la misma (RGB en [0, 1] a la
+    resolución de la red), así que después se puede pedir la pose del frame sin
+    reenviarlo ni volver a preprocesarlo.
+    """
+    frame = session_frame()
+    if pose_net is None or frame is None:
+        return lambda: preprocess(input_image)
+    input_tensor = preprocess(input_image)
+    with pose_frames_lock:
+        pose_frames.pop(frame, None)
+        pose_frames[frame] = input_tensor
+        while len(pose_frames) > POSE_FRAMES:
+            pose_frames.popitem(last=False)
+    return lambda: input_tensor
+
+
+def cached_frame(session, frame_id):
+    with pose_frames_lock:
+        input_tensor = pose_frames.get((session, frame_id))
+    if input_tensor is None:
+        raise KeyError("El frame '{}' de la sesión '{}' no está en memoria (ver --pose_frames)".format(
+            frame_id, session))
+    return input_tensor
+
+
+def run_pose(inputs_a, inputs_b):
+    """T (N, 4, 4) de la cámara de cada `inputs_a[i]` a la de `inputs_b[i]`, en un solo forward."""
+    with stage('pose'):
+        return pose_net(torch.cat(inputs_a), torch.cat(inputs_b))
+
+
+def pose_prior_header(response):
+    """Si el request pide X-Pose-From, agrega a `response` la pose del frame
+    X-Pose-From al frame actual (X-Frame-Id) en el header X-Pose: 16 valores,
+    fila mayor, separados por espacios. Si faltan X-Session-Id / X-Frame-Id o
+    alguno de los dos frames ya no está en memoria, la respuesta va sin X-Pose
+    (el cliente arranca de su propia estimación).
+    """
+    previous = request.headers.get('X-Pose-From')
+    frame = session_frame()
+    if previous is None or pose_net is None or frame is None:
+        return response
+    session, frame_id = frame
+    try:
+        inputs_previous, inputs_current = [cached_frame(session, previous)], [cached_frame(session, frame_id)]
+    except KeyError:
+        return response
+    T = run_pose(inputs_previous, inputs_current)
+    response.headers['X-Pose'] = ' '.join('{:.7g}'.format(v) for v in T[0].reshape(-1).tolist())
+    return response
+
+
+def predict_depth(input_image, frame_key=None):
+    """Ejecuta Monodepth2 sobre una imagen PIL y devuelve la profundidad
+    (float32, resolución original) como array de NumPy.
+    """
+    original_width, original_height = input_image.size
+    depth = run_model_cached(frame_key, frame_input(input_image))
+
+    with torch.no_grad(), stage('upsample'):
+        depth_resized = torch.nn.functional.interpolate(depth, (original_height, original_width), mode="bilinear", align_corners=False)
+        return depth_resized.squeeze().cpu().numpy()
+
+
+def predict_depth_array(frame, depth_out):
+    """Variante para el anillo de memoria compartida: `frame` es la vista
+    (H, W) gris o (H, W, 3) BGR de la ranura y la profundidad se escribe en `depth_out`.
+
+    El redimensionado se hace con interpolación bilineal de PyTorch en lugar de
+    LANCZOS de PIL, así que el resultado difiere ligeramente del modo 'file'.
+    """
+    height, width = frame.shape[:2]
+
+    def make_input():
+        input_image = torch.from_numpy(frame)
+        if input_image.dim() == 2:
+            input_image = input_image.unsqueeze(2).expand(-1, -1, 3)
+        else:
+            input_image = input_image.flip(2)
+        input_image = input_image.permute(2, 0, 1).unsqueeze(0).float().div_(255)
+        return torch.nn.functional.interpolate(input_image, (feed_height, feed_width), mode="bilinear", align_corners=False)
+
+    with torch.no_grad():
+        depth = run_model_cached((frame, 'shm', frame.shape), make_input)
+
+        depth_resized = torch.nn.functional.interpolate(depth, (height, width), mode="bilinear", align_corners=False)
+        torch.from_numpy(depth_out).copy_(depth_resized[0, 0])
+    return height, width
+
+
+def sample_depth(depth, points, width, height):
+    """Profundidad en los puntos `points` (N, 2) = (u, v) en píxeles de un frame de
+    width x height, a partir de la profundidad (1, 1, h, w) a resolución de red.
+
+    Interpola bilinealmente la disparidad (1 / depth) con la misma convención de
+    píxeles que F.interpolate(align_corners=False), sin generar el mapa denso.
+    """
+    grid = torch.from_numpy(points).view(1, 1, -1, 2).clone()
+    grid[..., 0] = (grid[..., 0] + 0.5) * (2.0 / width) - 1
+    grid[..., 1] = (grid[..., 1] + 0.5) * (2.0 / height) - 1
+    with torch.no_grad():
+        disp = torch.nn.functional.grid_sample(1 / depth, grid, mode="bilinear",
+                                               padding_mode="border", align_corners=False)
+    return (1 / disp).view(-1).cpu().numpy()
+
+
+def predict_file():
+    # La ruta ahora debe apuntar a donde el cliente C++ deja la imagen
+    image_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'client_cpp', 'build', 'test.jpg'))
+    if not os.path.exists(image_path):
+        return jsonify({"error": "No se encontró test.jpg"}), 400
+
+    with stage('parse'):
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    with stage('decode'):
+        input_image = pil.open(BytesIO(data))
+        input_image.load()
+    depth_numpy = predict_depth(input_image, (data, 'file'))
+
+    output_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'client_cpp', 'build', 'depthcrfs.txt'))
+    with stage('encode'):
+        f = cv2.FileStorage(output_path, cv2.FILE_STORAGE_WRITE)
+        f.write('mat1', depth_numpy)
+        f.release()
+
+    return jsonify({"status": "success"})
+
+
+def parse_frame_headers():
+    """(width, height, channels) del frame crudo; ValueError si faltan los headers."""
+    try:
+        return (int(request.headers['X-Frame-Width']), int(request.headers['X-Frame-Height']),
+                int(request.headers.get('X-Frame-Channels', 1)))
+    except (KeyError, ValueError):
+        raise ValueError("Se requieren los headers X-Frame-Width y X-Frame-Height")
+
+
+def predict_raw():
+    # Formato del request: body = width*height*channels bytes uint8 (fila mayor)
+    try:
+        width, height, channels = parse_frame_headers()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    dtype = request.headers.get('X-Depth-Dtype', DEPTH_DTYPE)
+    if dtype not in DEPTH_DTYPES:
+        return jsonify({"error": "X-Depth-Dtype debe ser uno de {}".format(sorted(DEPTH_DTYPES))}), 400
+    if 'X-Pose-From' in request.headers and session_frame() is None:
+        return jsonify({"error": "X-Pose-From requiere X-Session-Id y X-Frame-Id"}), 400
+
+    try:
+        with stage('parse'):
+            data = request.get_data(cache=False)
+        with stage('decode'):
+            input_image = decode_raw_frame(data, width, height, channels)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    depth_numpy = predict_depth(input_image, (data, 'raw', width, height, channels))
+
+    # Formato de la respuesta: body = height*width valores little-endian (fila mayor)
+    with stage('encode'):
+        response = Response(depth_numpy.astype(DEPTH_DTYPES[dtype]).tobytes(),
+                            mimetype='application/octet-stream')
+    response.headers['X-Depth-Width'] = str(depth_numpy.shape[1])
+    response.headers['X-Depth-Height'] = str(depth_numpy.shape[0])
+    response.headers['X-Depth-Dtype'] = dtype
+    return pose_prior_header(response)
+
+
 # Ruta del Servidor
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        # La ruta ahora debe apuntar a donde el cliente C++ deja la imagen
-        image_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'client_cpp', 'build', 'test.jpg'))
-        if not os.path.exists(image_path):
-            return jsonify({"error": "No se encontró test.jpg"}), 400
-
-        input_image = pil.open(image_path).convert('RGB')
-        original_width, original_height = input_image.size
-        input_image = input_image.resize((feed_width, feed_height), pil.LANCZOS)
-        input_image = transforms.ToTensor()(input_image).unsqueeze(0)
-
-        with torch.no_grad():
-            input_image = input_image.to('cpu')
-            features = encoder(input_image)
-            outputs = depth_decoder(features)
-            disp = outputs[("disp", 0)]
-            _, depth = disp_to_depth(disp, 0.1, 100)
+        if TRANSPORT == 'raw':
+            return predict_raw()
+        return predict_file()
 
-            depth_resized = torch.nn.functional.interpolate(depth, (original_height, original_width), mode="bilinear", align_corners=False)
-            depth_numpy = depth_resized.squeeze().cpu().numpy()
+    except Exception as e:
+        print(f"Error en la predicción: {e}")
+        return jsonify({"error": str(e)}), 500
 
-            output_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'client_cpp', 'build', 'depthcrfs.txt'))
-            f = cv2.FileStorage(output_path, cv2.FILE_STORAGE_WRITE)
-            f.write('mat1', depth_numpy)
-            f.release()
 
-        return jsonify({"status": "success"})
+@app.route('/predict_points', methods=['POST'])
+def predict_points():
+    """Profundidad solo en los píxeles que pide DSO.
+
+    Body = frame crudo (como en modo raw) seguido de los puntos, según X-Point-Format:
+      'uv'   (por defecto) -> N pares (u, v) float32 little-endian en píxeles del frame
+      'mask' -> máscara de width*height bits (np.packbits, fila mayor); los puntos son
+                los píxeles activos en ese orden
+    Respuesta = N profundidades float32 little-endian, en el orden de los puntos.
+    """
+    try:
+        try:
+            width, height, channels = parse_frame_headers()
+            frame_bytes = width * height * channels
+            with stage('parse'):
+                data = request.get_data(cache=False)
+            with stage('decode'):
+                input_image = decode_raw_frame(data[:frame_bytes], width, height, channels)
+
+            point_format = request.headers.get('X-Point-Format', 'uv')
+            if point_format == 'uv':
+                points = np.frombuffer(data[frame_bytes:], dtype='<f4')
+                if points.size % 2:
+                    raise ValueError("Los puntos deben ser pares (u, v) float32")
+                points = points.reshape(-1, 2).astype(np.float32)
+            elif point_format == 'mask':
+                mask = np.unpackbits(np.frombuffer(data[frame_bytes:], dtype=np.uint8), count=width * height)
+                v, u = np.nonzero(mask.reshape(height, width))
+                points = np.stack([u, v], axis=1).astype(np.float32)
+            else:
+                raise ValueError("X-Point-Format debe ser 'uv' o 'mask'")
+            if 'X-Pose-From' in request.headers and session_frame() is None:
+                raise ValueError("X-Pose-From requiere X-Session-Id y X-Frame-Id")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        depth = run_model_cached((data[:frame_bytes], 'raw', width, height, channels),
+                                 frame_input(input_image))
+        with stage('postprocess'):
+            depths = sample_depth(depth, points, width, height) if len(points) else np.zeros(0, np.float32)
+
+        with stage('encode'):
+            response = Response(depths.astype('<f4').tobytes(), mimetype='application/octet-stream')
+        response.headers['X-Num-Points'] = str(len(depths))
+        return pose_prior_header(response)
 
     except Exception as e:
         print(f"Error en la predicción: {e}")
         return jsonify({"error": str(e)}), 500
 
+
+@app.route('/pose', methods=['POST'])
+def pose():
+    """Pose relativa entre frames con el PoseNet de Monodepth2 (--pose), como
+    prior para la inicialización y el tracking de DSO.
+
+    Dos formas de pedirla:
+      - body = dos frames crudos seguidos, con los headers X-Frame-* de /predict en modo raw
+      - X-Session-Id + X-Frame-Ids = 'a,b' (o varios pares 'a,b;b,c', en un solo forward)
+        de frames enviados antes a /predict o /predict_points con X-Session-Id y X-Frame-Id
+    Respuesta = por par, la T 4x4 que lleva puntos de la cámara del primer frame a
+    la del segundo (thisToNext de DSO), float32 little-endian, fila mayor. La
+    traslación está en la escala de la profundidad que devuelve el servidor.
+    """
+    if pose_net is None:
+        return jsonify({"error": "/pose no está activo (iniciar el servidor con --pose)"}), 404
+    try:
+        try:
+            frame_ids = request.headers.get('X-Frame-Ids')
+            if frame_ids is not None:
+                session = request.headers.get('X-Session-Id')
+                if session is None:
+                    raise ValueError("X-Frame-Ids requiere X-Session-Id")
+                pairs = [pair.split(',') for pair in frame_ids.split(';')]
+                if any(len(pair) != 2 for pair in pairs):
+                    raise ValueError("X-Frame-Ids debe tener la forma 'a,b' o 'a,b;b,c'")
+                inputs_a = [cached_frame(session, a.strip()) for a, _ in pairs]
+                inputs_b = [cached_frame(session, b.strip()) for _, b in pairs]
+            else:
+                width, height, channels = parse_frame_headers()
+                frame_bytes = width * height * channels
+                with stage('parse'):
+                    data = request.get_data(cache=False)
+                if len(data) != 2 * frame_bytes:
+                    raise ValueError("El body debe tener dos frames de {} bytes, tiene {}".format(
+                        frame_bytes, len(data)))
+                with stage('decode'):
+                    images = [decode_raw_frame(data[i * frame_bytes:(i + 1) * frame_bytes], width, height, channels)
+                              for i in range(2)]
+                inputs_a, inputs_b = [preprocess(images[0])], [preprocess(images[1])]
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except KeyError as e:
+            return jsonify({"error": e.args[0]}), 404
+
+        T = run_pose(inputs_a, inputs_b)
+        with stage('encode'):
+            response = Response(T.numpy().astype('<f4').tobytes(), mimetype='application/octet-stream')
+        response.headers['X-Num-Poses'] = str(T.shape[0])
+        return response
+
+    except Exception as e:
+        print(f"Error en la pose: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({"cache": None if depth_cache is None else depth_cache.stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Servidor de profundidad Monodepth2 para DSO.')
+    parser.add_argument('--transport', type=str, choices=['file', 'raw'], default='file',
+                        help="'file': test.jpg -> depthcrfs.txt (original); "
+                             "'raw': frame crudo en el body -> profundidad binaria en la respuesta")
+    parser.add_argument('--depth_dtype', type=str, choices=sorted(DEPTH_DTYPES), default='float32',
+                        help='tipo por defecto de la profundidad en modo raw '
+                             '(el cliente puede cambiarlo con X-Depth-Dtype)')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--shm_name', type=str, default=None,
+                        help='si se indica, atiende también el anillo de memoria compartida con este nombre')
+    parser.add_argument('--shm_socket', type=str, default='/tmp/depth_shm.sock',
+                        help='socket Unix del canal de control del anillo')
+    parser.add_argument('--shm_slots', type=int, default=4)
+    parser.add_argument('--shm_max_width', type=int, default=1280)
+    parser.add_argument('--shm_max_height', type=int, default=720)
+    parser.add_argument('--workers', type=int, default=0,
+                        help='procesos de inferencia (0 = inferir en el proceso del servidor)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='hilos intra-op de PyTorch por worker (cada worker se fija a sus propios núcleos)')
+    parser.add_argument('--cache_mb', type=float, default=0,
+                        help='memoria de la caché de profundidad por contenido del frame (0 = desactivada)')
+    parser.add_argument('--cache_ttl_s', type=float, default=0,
+                        help='vigencia de cada entrada de la caché (0 = sin vencimiento)')
+    parser.add_argument('--backend', type=str, choices=BACKENDS, default='eager',
+                        help='cómo se ejecuta el modelo (ver depth_backends.py)')
+    parser.add_argument('--artifact', type=str, default=None,
+                        help='grafo exportado para --backend torchscript / onnx')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='fp32',
+                        help='bf16: encoder y decoder bajo autocast de CPU, solo con --backend eager '
+                             '(ver precision.py)')
+    parser.add_argument('--pose', action='store_true',
+                        help='carga el PoseNet del modelo (pose_encoder.pth, pose.pth) y atiende /pose '
+                             'y X-Pose-From en los requests de profundidad')
+    parser.add_argument('--pose_frames', type=int, default=32,
+                        help='frames de sesión (X-Session-Id / X-Frame-Id) guardados para /pose')
+    parser.add_argument('--server_timing', action='store_true',
+                        help='agrega Server-Timing a todas las respuestas '
+                             '(si no, solo a los requests con X-Server-Timing: 1)')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    args = parse_args()
+    TRANSPORT = args.transport
+    DEPTH_DTYPE = args.depth_dtype
+    print("==> Transporte de /predict: {}".format(TRANSPORT))
+    instrument_app(app, metrics, args.server_timing)
+    if args.precision != 'fp32':
+        if args.backend != 'eager':
+            raise SystemExit("--precision {} solo está disponible con --backend eager".format(args.precision))
+        PRECISION = args.precision
+        print("==> Precisión: {} (autocast de CPU)".format(PRECISION))
+    if args.backend != 'eager':
+        backend = load_backend(args.backend, model_path, args.artifact)
+        feed_width, feed_height = backend.feed_width, backend.feed_height
+        print("==> Backend {}: {}".format(args.backend, args.artifact or model_path))
+    if args.cache_mb > 0:
+        depth_cache = DepthCache(int(args.cache_mb * 1024 * 1024), args.cache_ttl_s)
+    if args.workers > 0:
+        worker_pool = WorkerPool(run_model, args.workers, args.threads)
+        print("==> {} workers de inferencia con {} hilos cada uno".format(args.workers, args.threads))
+    if args.pose:
+        # Sin STEREO_SCALE_FACTOR: la traslación queda en la escala de la profundidad servida
+        pose_net = PoseNet(model_path, scale=1.0)
+        POSE_FRAMES = args.pose_frames
+        print("==> /pose activo (PoseNet de {})".format(model_path))
+    if args.shm_name:
+        shm_server = ShmDepthServer(args.shm_name, args.shm_socket, predict_depth_array,
+                                    args.shm_slots, args.shm_max_width, args.shm_max_height)
+        threading.Thread(target=shm_server.serve_forever, daemon=True).start()
+    app.run(host='0.0.0.0', port=args.port)
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""Servidor de profundidad multi-modelo (monodepth2, NeWCRFs, PixelFormer, DCDepth).
+
+Un solo proceso con un registro de modelos: cada request nombra el modelo con
+`?model=` (o el campo de formulario `model`), el modelo se carga la primera vez
+que se pide y los menos usados se desalojan cuando el RSS supera --rss_budget_mb.
+--preload carga modelos al arrancar y los deja residentes. --quantize pasa a
+int8 los nn.Linear de los modelos Swin si el control de abs_rel lo permite;
+--precision bf16 sirve los modelos bajo autocast de CPU (ver precision.py).
+
+    python infer_multi.py --rss_budget_mb 6000 --preload monodepth2
+
+    POST /predict?model=pixelformer&format=f16   imagen (campo 'image' o body)
+    POST /predict?model=newcrfs&tta=1            con flip-TTA (imagen + espejo)
+    GET  /models                                 estado del registro
+    GET  /metrics                                latencia por etapa (Prometheus)
+    POST /models/<nombre>/load[?pin=1]           hint de precarga
+    POST /models/<nombre>/unload
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+from io import BytesIO
+from collections import OrderedDict
+
+import PIL.Image as pil
+import torch
+import torch.nn.functional as F
+from torchvision import transforms
+from flask import Flask, Response, jsonify, request, g, has_request_context
+
+from model_registry import ModelRegistry, isolated_imports
+from fast_load import load_pretrained
+from fused_attention import set_fused_attention
+from quantize import quantize_dynamic, read_split, accuracy_gate, print_report
+from precision import PRECISIONS, autocast, with_precision
+from depth_encoding import available_encodings, encode_depth, negotiate
+from stage_metrics import StageMetrics, instrument_app, stage, time_encoder_decoder
+from depth_common.tta import flip_tta
+
+SERVER_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.abspath(os.path.join(SERVER_DIR, '..', '..'))
+
+MONODEPTH2_PATH = os.path.join(SERVER_DIR, 'implementation')
+NEWCRFS_PATH = os.path.join(REPO_DIR, '3_deepdso_slam', 'DeepDSO', 'newcrfs')
+PIXELFORMER_PATH = os.path.join(REPO_DIR, '2_benchmarks', 'pixelformer', 'implementation')
+DCDEPTH_PATH = os.path.join(REPO_DIR, '2_benchmarks', 'dcdepth', 'implementation')
+
+# Split y escala del ground truth con que se controla el int8 de cada modelo
+QUANT_SPLITS = {
+    'newcrfs': ('nyu', os.path.join(PIXELFORMER_PATH, 'data_splits', 'nyudepthv2_test_files_with_gt.txt'), 1000.0),
+    'pixelformer': ('nyu', os.path.join(PIXELFORMER_PATH, 'data_splits', 'nyudepthv2_test_files_with_gt.txt'), 1000.0),
+    'dcdepth': ('kitti', os.path.join(DCDEPTH_PATH, 'data_splits', 'eigen_test_files_with_gt.txt'), 256.0),
+}
+
+IMAGENET_NORMALIZE = transforms.Normalize((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+
+app = Flask(__name__)
+registry = None
+args = None
+metrics = StageMetrics()
+quantization = {}
+
+
+class DepthPredictor:
+    """Modelo cargado más su preprocesamiento.
+
+    `forward` recibe el batch (1, 3, H, W) ya transformado y devuelve la
+    profundidad (1, 1, h, w) en metros; `predict` la lleva al tamaño original.
+    Con `encoder` (el backbone de `forward`) /metrics separa encoder y decoder;
+    `flip_tta` es tta.flip_tta en los modelos que admiten flip-TTA (None = sin TTA).
+    """
+    def __init__(self, forward, transform, min_depth, max_depth, encoder=None, flip_tta=None):
+        self.forward = forward
+        self.transform = transform
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.flip_tta = flip_tta
+        if encoder is not None:
+            time_encoder_decoder(forward, encoder)
+
+    def predict(self, image, tta=False):
+        width, height = image.size
+        with stage('preprocess'):
+            input_tensor = self.transform(image.convert('RGB')).unsqueeze(0)
+        with torch.no_grad():
+            if tta:
+                depth = self.flip_tta(self.forward, input_tensor)
+            else:
+                depth = self.forward(input_tensor)
+            with stage('upsample'):
+                depth = F.interpolate(depth, (height, width), mode="bilinear", align_corners=False)
+        with stage('postprocess'):
+            return depth.squeeze().clamp(self.min_depth, self.max_depth).numpy()
+
+
+def maybe_quantize(name, model, make_predictor, root):
+    """`model` o su versión int8 si `name` está en --quantize y pasa el control.
+
+    `make_predictor(model)` arma el DepthPredictor sin hooks de /metrics (se
+    agregan después sobre el modelo elegido); `root` es el árbol del que se
+    importa `compute_errors`.
+    """
+    if name not in args.quantize:
+        return model
+    dataset, split_file, depth_scale = QUANT_SPLITS[name]
+    if dataset == 'nyu':
+        samples = read_split(split_file, args.nyu_data_path, num_samples=args.quant_samples) \
+            if args.nyu_data_path else []
+    else:
+        samples = read_split(split_file, args.kitti_data_path, args.kitti_gt_path, args.quant_samples) \
+            if args.kitti_data_path and args.kitti_gt_path else []
+    with isolated_imports(root):
+        from utils import compute_errors
+
+    quantized = quantize_dynamic(model)
+    fp32, int8 = make_predictor(model), make_predictor(quantized)
+    accepted, report = accuracy_gate(fp32.predict, int8.predict, samples, compute_errors, depth_scale,
+                                     fp32.min_depth, fp32.max_depth, args.quant_max_abs_rel_delta)
+    print_report(name, accepted, report)
+    quantization[name] = dict(report, enabled=accepted)
+    return quantized if accepted else model
+
+
+def maybe_fuse_attention(name, model):
+    """Activa la atención fusionada de las WindowAttention si `name` está en --fused_attn."""
+    if name in args.fused_attn:
+        print("INFO: {}: atención fusionada en {} WindowAttention".format(name, set_fused_attention(model)))
+    return model
+
+
+# --- Loaders: cada uno importa desde su propio árbol (ver isolated_imports).
+# Los modelos Swin se construyen sin backbone preentrenado ni init y el
+# checkpoint final se mapea en memoria (ver fast_load).
+
+def load_monodepth2():
+    # depth_backends importa networks / layers de Monodepth2: dentro del bloque
+    # quedan aislados de los `networks` de los otros árboles
+    with isolated_imports(MONODEPTH2_PATH):
+        from depth_backends import load_monodepth2 as load_monodepth2_weights
+        from layers import disp_to_depth
+
+    model_path = os.path.join(MONODEPTH2_PATH, "models", args.monodepth2_model)
+    encoder, depth_decoder, feed_width, feed_height = load_monodepth2_weights(model_path)
+
+    def forward(input_tensor):
+        with stage('encoder'), autocast(args.precision):
+            features = encoder(input_tensor)
+        with stage('decoder'), autocast(args.precision):
+            disp = depth_decoder(features, scales=(0,))[("disp", 0)]
+        with stage('postprocess'):
+            return disp_to_depth(disp, 0.1, 100)[1]
+
+    transform = transforms.Compose([
+        transforms.Resize((feed_height, feed_width), interpolation=pil.LANCZOS),
+        transforms.ToTensor()
+    ])
+    return DepthPredictor(forward, transform, 0.1, 100.0)
+
+
+def load_newcrfs():
+    with isolated_imports(NEWCRFS_PATH):
+        from networks.NewCRFDepth import NewCRFDepth
+
+    model = load_pretrained(lambda: NewCRFDepth(version='large07', inv_depth=False, max_depth=10.0),
+                            args.newcrfs_checkpoint)
+    maybe_fuse_attention('newcrfs', model)
+
+    transform = transforms.Compose([transforms.Resize((480, 640)), transforms.ToTensor(), IMAGENET_NORMALIZE])
+    model = maybe_quantize('newcrfs', model, lambda m: DepthPredictor(m, transform, 1e-3, 10.0), NEWCRFS_PATH)
+    model = with_precision(model, args.precision)
+    return DepthPredictor(model, transform, 1e-3, 10.0, encoder=model.backbone, flip_tta=flip_tta)
+
+
+def load_pixelformer():
+    root = os.path.join(PIXELFORMER_PATH, 'pixelformer')
+    with isolated_imports(root):
+        from networks.PixelFormer import PixelFormer
+
+    model = load_pretrained(lambda: PixelFormer(version='large07', inv_depth=False, max_depth=10.0, pretrained=None),
+                            args.pixelformer_checkpoint)
+    maybe_fuse_attention('pixelformer', model)
+
+    transform = transforms.Compose([transforms.Resize((480, 640)), transforms.ToTensor(), IMAGENET_NORMALIZE])
+    model = maybe_quantize('pixelformer', model, lambda m: DepthPredictor(m, transform, 1e-3, 10.0), root)
+    model = with_precision(model, args.precision)
+    return DepthPredictor(model, transform, 1e-3, 10.0, encoder=model.backbone, flip_tta=flip_tta)
+
+
+def load_dcdepth():
+    with isolated_imports(DCDEPTH_PATH):
+        try:
+            from mmcv import Config
+        except ImportError:
+            from mmengine import Config
+        from models import MODELS
+
+    cfg = Config.fromfile(os.path.join(DCDEPTH_PATH, 'configs', '{}.yaml'.format(args.dcdepth_config)))
+    # El checkpoint trae también el backbone
+    cfg.model.pretrain = None
+    model = load_pretrained(lambda: MODELS.build({'type': cfg.model.type, 'cfg': cfg}),
+                            args.dcdepth_checkpoint).model
+    maybe_fuse_attention('dcdepth', model)
+    transform = transforms.Compose([
+        transforms.Resize((cfg.dataset.input_height, cfg.dataset.input_width)),
+        transforms.ToTensor(),
+        IMAGENET_NORMALIZE
+    ])
+
+    def make_predictor(model):
+        def forward(input_tensor):
+            if args.dcdepth_tol > 0:
+                # Early exit del refinamiento DCT; las iteraciones usadas van en X-Iterations
+                depths, num_iters = model(input_tensor, tol=args.dcdepth_tol, per_patch=args.dcdepth_per_patch)
+                output = depths[-1]
+                if has_request_context():
+                    g.iterations = max(g.get('iterations', 0.0), num_iters.float().mean().item())
+            else:
+                output = model(input_tensor)[-1]
+            with stage('postprocess'):
+                return torch.exp(output) if cfg.model.output_space == 'log' else output
+        return DepthPredictor(forward, transform, cfg.dataset.min_depth, cfg.dataset.max_depth,
+                              flip_tta=flip_tta)
+
+    model = maybe_quantize('dcdepth', model, make_predictor, DCDEPTH_PATH)
+    model = with_precision(model, args.precision)
+    time_encoder_decoder(model, model.backbone)
+    return make_predictor(model)
+
+
+LOADERS = OrderedDict([
+    ('monodepth2', load_monodepth2),
+    ('newcrfs', load_newcrfs),
+    ('pixelformer', load_pixelformer),
+    ('dcdepth', load_dcdepth),
+])
+
+
+def error_response(message, status):
+    return jsonify({"status": "error", "message": message}), status
+
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    name = request.args.get('model') or request.form.get('model') or args.default_model
+    if name not in LOADERS:
+        return error_response("Modelo desconocido '{}'. Disponibles: {}".format(name, list(LOADERS)), 404)
+    try:
+        encoding = negotiate(request.args.get('format'), request.headers.get('Accept')) or 'f32'
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    with stage('parse'):
+        if 'image' in request.files:
+            data = request.files['image'].read()
+        else:
+            data = request.get_data()
+    try:
+        with stage('decode'):
+            image = pil.open(BytesIO(data))
+            image.load()
+    except Exception:
+        return error_response("No se pudo decodificar la imagen", 400)
+
+    start_time = time.time()
+    try:
+        predictor = registry.get(name)
+    except Exception as e:
+        return error_response("No se pudo cargar '{}': {}".format(name, e), 503)
+    get_time = time.time()
+    # ?tta=1/0 decide por request; si no viene, --tta en los modelos que lo admiten
+    tta = request.values.get('tta')
+    if tta is None:
+        tta = args.tta and predictor.flip_tta is not None
+    elif tta in ('1', 'true'):
+        if predictor.flip_tta is None:
+            return error_response("El modelo '{}' no admite tta".format(name), 400)
+        tta = True
+    else:
+        tta = False
+    depth_map = predictor.predict(image, tta)
+    end_time = time.time()
+
+    with stage('encode'):
+        body, mimetype, headers = encode_depth(depth_map, encoding, predictor.max_depth)
+    headers['X-Model'] = name
+    headers['X-TTA'] = '1' if tta else '0'
+    if 'iterations' in g:
+        headers['X-Iterations'] = '{:.2f}'.format(g.iterations)
+    headers['X-Model-Get-Ms'] = '{:.2f}'.format((get_time - start_time) * 1000)
+    headers['X-Inference-Ms'] = '{:.2f}'.format((end_time - get_time) * 1000)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+
+@app.route('/models', methods=['GET'])
+def models():
+    return jsonify(dict(registry.stats(), depth_encodings=available_encodings(), quantization=quantization))
+
+
+@app.route('/models/<name>/load', methods=['POST'])
+def load(name):
+    if name not in LOADERS:
+        return error_response("Modelo desconocido '{}'".format(name), 404)
+    try:
+        if request.args.get('pin', '0') == '1':
+            registry.pin(name)
+        else:
+            registry.get(name)
+    except Exception as e:
+        return error_response("No se pudo cargar '{}': {}".format(name, e), 503)
+    return jsonify(registry.stats()["models"][name])
+
+
+@app.route('/models/<name>/unload', methods=['POST'])
+def unload(name):
+    if name not in LOADERS:
+        return error_response("Modelo desconocido '{}'".format(name), 404)
+    return jsonify({"evicted": registry.evict(name)})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({"status": "ok", "models": list(LOADERS)})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Servidor de profundidad multi-modelo.')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--rss_budget_mb', type=float, default=0,
+                        help='RSS máximo del proceso antes de desalojar modelos (0 = sin límite)')
+    parser.add_argument('--preload', type=str, nargs='*', default=[], choices=list(LOADERS),
+                        help='modelos que se cargan al arrancar y no se desalojan')
+    parser.add_argument('--default_model', type=str, default='monodepth2', choices=list(LOADERS))
+    parser.add_argument('--monodepth2_model', type=str, default='mono+stereo_640x192')
+    parser.add_argument('--newcrfs_checkpoint', type=str, default=os.path.join(NEWCRFS_PATH, 'model_nyu.ckpt'))
+    parser.add_argument('--pixelformer_checkpoint', type=str,
+                        default=os.path.join(PIXELFORMER_PATH, 'pretrained/checkpoints/nyu.pth'))
+    parser.add_argument('--dcdepth_config', type=str, default='dct_eigen_pff')
+    parser.add_argument('--dcdepth_checkpoint', type=str,
+                        default=os.path.join(DCDEPTH_PATH, 'checkpoints/dcdepth_eigen.pth'))
+    parser.add_argument('--dcdepth_tol', type=float, default=0,
+                        help='early exit de DCDepth: corta el refinamiento cuando un paso cambia la profundidad '
+                             'menos que esto (RMS en espacio log); 0 = siempre todas las iteraciones '
+                             '(ver benchmark_early_exit.py)')
+    parser.add_argument('--dcdepth_per_patch', action='store_true',
+                        help='aplica --dcdepth_tol por parche de 8x8 en lugar de por imagen')
+    parser.add_argument('--tta', action='store_true',
+                        help='flip-TTA por defecto en los modelos Swin (cada request puede pedir ?tta=0/1)')
+    parser.add_argument('--fused_attn', type=str, nargs='*', default=[], choices=['newcrfs', 'pixelformer', 'dcdepth'],
+                        help='modelos Swin con la atención de ventanas en F.scaled_dot_product_attention')
+    parser.add_argument('--quantize', type=str, nargs='*', default=[], choices=list(QUANT_SPLITS),
+                        help='modelos Swin que se sirven con los nn.Linear en int8 (si pasan el control de abs_rel)')
+    parser.add_argument('--quant_samples', type=int, default=16,
+                        help='imágenes del split de test usadas en el control de precisión')
+    parser.add_argument('--quant_max_abs_rel_delta', type=float, default=0.01,
+                        help='empeoramiento máximo de abs_rel aceptado para int8')
+    parser.add_argument('--nyu_data_path', type=str, default=None,
+                        help='raíz de NYU Depth v2 (test) para el control de NeWCRFs / PixelFormer')
+    parser.add_argument('--kitti_data_path', type=str, default=None,
+                        help='raíz de KITTI raw para el control de DCDepth')
+    parser.add_argument('--kitti_gt_path', type=str, default=None,
+                        help='raíz del ground truth de KITTI (data_depth_annotated)')
+    parser.add_argument('--precision', type=str, choices=PRECISIONS, default='fp32',
+                        help='bf16: todos los modelos bajo autocast de CPU (no se combina con --quantize)')
+    parser.add_argument('--server_timing', action='store_true',
+                        help='agrega Server-Timing a todas las respuestas '
+                             '(si no, solo a los requests con X-Server-Timing: 1)')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.quantize and args.precision != 'fp32':
+        raise SystemExit("--quantize (int8) y --precision {} no se combinan".format(args.precision))
+    registry = ModelRegistry(int(args.rss_budget_mb * 2**20))
+    instrument_app(app, metrics, args.server_timing)
+    for name, loader in LOADERS.items():
+        registry.register(name, loader)
+    for name in args.preload:
+        registry.pin(name)
+
+    print("==> Modelos: {} (presupuesto RSS: {})".format(
+        list(LOADERS), "{} MB".format(args.rss_budget_mb) if args.rss_budget_mb else "sin límite"))
+    app.run(host='0.0.0.0', port=args.port, threaded=True)
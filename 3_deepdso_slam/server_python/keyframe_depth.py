@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""Profundidad a ritmo de cámara: inferencia completa solo en keyframes y
+propagación por pose a los frames intermedios.
+
+PixelFormer / NeWCRFs tardan segundos por frame en CPU. KeyframeDepth corre el
+modelo solo cuando hace falta y, en el resto de los frames, reproyecta la
+profundidad del último keyframe a la cámara actual (forward warping con
+z-buffer, con BackprojectDepth / Project3D de Monodepth2). La pose relativa la
+da quien llama (pose cámara->mundo de cada frame, p. ej. la de DSO) o, si no
+hay, el PoseNet de Monodepth2 (ResnetEncoder(18, False, 2) + PoseDecoder,
+encadenado frame a frame).
+
+Un frame pasa a ser keyframe si:
+    - pasaron `max_interval` frames desde el último (cota de antigüedad)
+    - la rotación supera `max_rotation_deg` o la traslación supera
+      `max_translation` veces la mediana de la profundidad del keyframe
+    - la reproyección deja más de `max_hole_fraction` de píxeles sin dato
+    - el residuo fotométrico del warp (imagen del keyframe llevada a la cámara
+      actual con la profundidad propagada) supera `max_photometric_error`
+
+Los huecos que quedan se rellenan con el vecino más lejano (max-pool 3x3
+iterado: los huecos de desoclusión muestran fondo) y lo que sigue vacío, con
+la profundidad del keyframe en el mismo píxel. Cada resultado trae la
+antigüedad (frames y ms), la fracción de huecos y el residuo fotométrico;
+benchmark_keyframes.py mide el error contra la inferencia completa según la
+antigüedad, que es la cota de error de `max_interval`.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import math
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from model_registry import isolated_imports
+
+MONODEPTH2_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'implementation')
+
+with isolated_imports(MONODEPTH2_PATH):
+    import networks
+    from layers import BackprojectDepth, Project3D, transformation_from_parameters
+
+# Traslaciones del PoseNet de los modelos mono+stereo a metros (como STEREO_SCALE_FACTOR de evaluate_depth.py)
+STEREO_SCALE_FACTOR = 5.4
+# fx, fy, cx, cy de NYU Depth v2 a 640x480 (los de PixelFormer / NeWCRFs entrenados en NYU)
+NYU_INTRINSICS = (518.8579, 519.4696, 325.5824, 253.7362)
+
+
+def intrinsics_matrix(fx, fy, cx, cy):
+    """K (1, 4, 4) en píxeles, en el formato de los datasets de Monodepth2."""
+    K = torch.eye(4)
+    K[0, 0], K[1, 1], K[0, 2], K[1, 2] = fx, fy, cx, cy
+    return K.unsqueeze(0)
+
+
+def rotation_angle_deg(T):
+    """Ángulo (grados) de la rotación de T (1, 4, 4)."""
+    cos = (torch.diagonal(T[0, :3, :3]).sum() - 1) / 2
+    return math.degrees(math.acos(float(cos.clamp(-1.0, 1.0))))
+
+
+class PoseNet:
+    """Pose relativa entre dos frames con el encoder y el decoder de pose de
+    Monodepth2 (pose_encoder.pth y pose.pth de `model_path`, como en evaluate_pose.py).
+
+    Los modelos mono+stereo dan traslaciones en metros con `scale` = 5.4;
+    los mono, en una escala arbitraria.
+    """
+    def __init__(self, model_path, device='cpu', scale=STEREO_SCALE_FACTOR, num_layers=18):
+        self.encoder = networks.ResnetEncoder(num_layers, False, 2)
+        self.encoder.load_state_dict(torch.load(os.path.join(model_path, "pose_encoder.pth"), map_location='cpu'))
+        self.decoder = networks.PoseDecoder(self.encoder.num_ch_enc, 1, 2)
+        self.decoder.load_state_dict(torch.load(os.path.join(model_path, "pose.pth"), map_location='cpu'))
+        self.encoder.to(device).eval()
+        self.decoder.to(device).eval()
+        # Resolución de entrenamiento (la guarda encoder.pth, el de profundidad)
+        encoder_dict = torch.load(os.path.join(model_path, "encoder.pth"), map_location='cpu')
+        self.feed_height, self.feed_width = encoder_dict['height'], encoder_dict['width']
+        self.scale = scale
+
+    def __call__(self, image_a, image_b):
+        """T (B, 4, 4) que lleva puntos de la cámara de `image_a` a la de `image_b`.
+
+        Args:
+            image_a, image_b: (B, 3, H, W) RGB en [0, 1]
+        """
+        pair = torch.cat([image_a, image_b], 1)
+        if pair.shape[-2:] != (self.feed_height, self.feed_width):
+            pair = F.interpolate(pair, (self.feed_height, self.feed_width), mode='bilinear', align_corners=False)
+        with torch.no_grad():
+            axisangle, translation = self.decoder([self.encoder(pair)])
+        return transformation_from_parameters(axisangle[:, 0], translation[:, 0] * self.scale)
+
+
+class DepthWarper(nn.Module):
+    """Reproyección de profundidad entre dos cámaras con intrínsecos `intrinsics`
+    (fx, fy, cx, cy en píxeles de height x width)."""
+    def __init__(self, height, width, intrinsics):
+        super(DepthWarper, self).__init__()
+        self.height = height
+        self.width = width
+        self.backproject_depth = BackprojectDepth(1, height, width)
+        self.project_3d = Project3D(1, height, width)
+        K = intrinsics_matrix(*intrinsics)
+        self.register_buffer('K', K)
+        self.register_buffer('inv_K', torch.inverse(K))
+
+    def forward(self, depth, T):
+        """Forward warping con z-buffer de `depth` (1, 1, H, W) a la cámara destino.
+
+        Args:
+            T: (1, 4, 4) lleva puntos de la cámara de `depth` a la destino
+
+        Returns:
+            (profundidad en la cámara destino (1, 1, H, W), huecos (1, 1, H, W) bool)
+        """
+        points = self.backproject_depth(depth, self.inv_K)
+        z = torch.matmul(T, points)[:, 2].reshape(-1)
+        pix_coords = self.project_3d(points, self.K, T)
+        x = ((pix_coords[..., 0] + 1) * (0.5 * (self.width - 1))).round_().reshape(-1)
+        y = ((pix_coords[..., 1] + 1) * (0.5 * (self.height - 1))).round_().reshape(-1)
+        valid = (z > 1e-3) & (x >= 0) & (x <= self.width - 1) & (y >= 0) & (y <= self.height - 1)
+        # Los puntos inválidos van a una celda extra en lugar de filtrarse (la selección con máscara es más lenta)
+        num_pixels = self.height * self.width
+        index = torch.where(valid, y * self.width + x, num_pixels).long()
+
+        # El punto más cercano gana cuando varios caen en el mismo píxel
+        warped = depth.new_full((num_pixels + 1,), float('inf'))
+        warped.scatter_reduce_(0, index, z, 'amin')
+        warped = warped[:num_pixels].view(1, 1, self.height, self.width)
+        return warped, torch.isinf(warped)
+
+    def inverse_warp(self, image, depth, T):
+        """`image` (1, C, H, W) de la cámara de origen vista desde la destino,
+        con `depth` en la destino y T de origen a destino.
+
+        Returns:
+            (imagen muestreada, máscara (1, 1, H, W) de píxeles que caen dentro de `image`)
+        """
+        points = self.backproject_depth(depth, self.inv_K)
+        pix_coords = self.project_3d(points, self.K, torch.inverse(T))
+        inside = (pix_coords.abs() <= 1).all(-1).unsqueeze(1)
+        return F.grid_sample(image, pix_coords, padding_mode="border", align_corners=True), inside
+
+
+def max_filter3x3(x):
+    """Máximo 3x3 de un mapa no negativo (B, C, H, W), separable: en CPU
+    F.max_pool2d sobre un solo canal es ~10x más lento."""
+    padded = F.pad(x, (1, 1, 1, 1))
+    rows = torch.maximum(torch.maximum(padded[..., :-2], padded[..., 1:-1]), padded[..., 2:])
+    return torch.maximum(torch.maximum(rows[..., :-2, :], rows[..., 1:-1, :]), rows[..., 2:, :])
+
+
+def fill_holes(depth, holes, fallback, iterations=4):
+    """Rellena `holes` con el máximo (el más lejano) de los vecinos 3x3 con dato,
+    `iterations` veces; lo que sigue vacío toma el valor de `fallback`."""
+    depth = depth.masked_fill(holes, 0)
+    for _ in range(iterations):
+        if not holes.any():
+            break
+        grown = max_filter3x3(depth)
+        depth = torch.where(holes, grown, depth)
+        holes = depth == 0
+    return torch.where(holes, fallback, depth)
+
+
+class KeyframeDepth:
+    """Profundidad de una secuencia de frames (una sesión / cámara) con
+    inferencia solo en keyframes.
+
+    Args:
+        intrinsics: (fx, fy, cx, cy) en píxeles de una imagen de `size` (alto, ancho);
+                    se escalan a la resolución de la profundidad del modelo
+        pose_net: PoseNet para los frames que llegan sin pose (None = esos frames
+                  son keyframes)
+    """
+    def __init__(self, intrinsics, size, pose_net=None, max_interval=10, max_rotation_deg=5.0, max_translation=0.1,
+                 max_hole_fraction=0.1, max_photometric_error=0.1, fill_iterations=4):
+        self.intrinsics = intrinsics
+        self.size = size
+        self.pose_net = pose_net
+        self.max_interval = max_interval
+        self.max_rotation_deg = max_rotation_deg
+        self.max_translation = max_translation
+        self.max_hole_fraction = max_hole_fraction
+        self.max_photometric_error = max_photometric_error
+        self.fill_iterations = fill_iterations
+        self.warper = None
+        self.keyframes = 0
+        self.frames = 0
+        self.reset()
+
+    def reset(self):
+        """Olvida el keyframe: el próximo frame corre el modelo."""
+        self.keyframe = None  # dict con image, depth, camera_pose, median_depth, time
+        self.previous_image = None
+        self.relative_pose = None  # T del keyframe al último frame (PoseNet encadenado)
+        self.age = 0
+
+    def __call__(self, image, depth_fn, camera_pose=None, timestamp=None):
+        """Profundidad del frame `image`.
+
+        Args:
+            image: (1, 3, H, W) RGB en [0, 1]
+            depth_fn: función sin argumentos que corre el modelo sobre este frame
+                      y devuelve la profundidad (1, 1, h, w)
+            camera_pose: (4, 4) o (1, 4, 4) cámara->mundo de este frame, o None
+            timestamp: segundos (por defecto time.time())
+
+        Returns:
+            (profundidad (1, 1, h, w), info) con info['keyframe'] True si corrió el
+            modelo (y 'reason'), o la antigüedad ('age' frames, 'age_ms'), 'hole_fraction',
+            'photometric_error', 'rotation_deg' y 'translation' de la propagación
+        """
+        now = time.time() if timestamp is None else timestamp
+        self.frames += 1
+        if camera_pose is not None:
+            camera_pose = torch.as_tensor(camera_pose, dtype=torch.float32).view(1, 4, 4)
+        if self.keyframe is None:
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'inicio')
+        if (camera_pose is None) != (self.keyframe['camera_pose'] is None) or \
+                (camera_pose is None and self.pose_net is None):
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'sin pose')
+
+        keyframe = self.keyframe
+        image = self.resize(image).to(keyframe['depth'].device)
+        T = self.pose_from_keyframe(image, camera_pose)
+        info = {
+            "keyframe": False,
+            "age": self.age + 1,
+            "age_ms": round((now - keyframe['time']) * 1000, 1),
+            "rotation_deg": round(rotation_angle_deg(T), 3),
+            "translation": round(float(T[0, :3, 3].norm()) / keyframe['median_depth'], 4),
+        }
+        if info["age"] > self.max_interval:
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'intervalo')
+        if info["rotation_deg"] > self.max_rotation_deg:
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'rotación')
+        if info["translation"] > self.max_translation:
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'traslación')
+
+        T = T.to(keyframe['depth'].device)
+        warped, holes = self.warper(keyframe['depth'], T)
+        info["hole_fraction"] = round(float(holes.float().mean()), 4)
+        if info["hole_fraction"] > self.max_hole_fraction:
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'huecos')
+        depth = fill_holes(warped, holes, keyframe['depth'], self.fill_iterations)
+
+        predicted, inside = self.warper.inverse_warp(keyframe['image'], depth, T)
+        residual = (predicted - image).abs().mean(1, keepdim=True)
+        info["photometric_error"] = round(float(residual[inside].mean()) if inside.any() else 1.0, 4)
+        if info["photometric_error"] > self.max_photometric_error:
+            return self.new_keyframe(image, depth_fn, camera_pose, now, 'fotométrico')
+
+        self.age += 1
+        return depth, info
+
+    def new_keyframe(self, image, depth_fn, camera_pose, now, reason):
+        depth = depth_fn().float().contiguous()
+        _, _, height, width = depth.shape
+        if self.warper is None or (self.warper.height, self.warper.width) != (height, width):
+            sy, sx = height / float(self.size[0]), width / float(self.size[1])
+            fx, fy, cx, cy = self.intrinsics
+            self.warper = DepthWarper(height, width, (fx * sx, fy * sy, cx * sx, cy * sy))
+        self.warper.to(depth.device)
+        image = self.resize(image).to(depth.device)
+        self.keyframe = {
+            "image": image,
+            "depth": depth,
+            "camera_pose": camera_pose,
+            "median_depth": float(depth.median()),
+            "time": now,
+        }
+        self.previous_image = image
+        self.relative_pose = None
+        self.age = 0
+        self.keyframes += 1
+        return depth, {"keyframe": True, "reason": reason}
+
+    def resize(self, image):
+        if self.warper is not None and image.shape[-2:] != (self.warper.height, self.warper.width):
+            image = F.interpolate(image, (self.warper.height, self.warper.width), mode='bilinear',
+                                  align_corners=False)
+        return image
+
+    def pose_from_keyframe(self, image, camera_pose):
+        """T (1, 4, 4) de la cámara del keyframe a la del frame actual."""
+        if camera_pose is not None:
+            return torch.matmul(torch.inverse(camera_pose), self.keyframe['camera_pose'])
+        step = self.pose_net(self.previous_image, image).cpu()
+        self.relative_pose = step if self.relative_pose is None else torch.matmul(step, self.relative_pose)
+        self.previous_image = image
+        return self.relative_pose
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "keyframe_ratio": round(self.keyframes / float(max(self.frames, 1)), 4),
+        }
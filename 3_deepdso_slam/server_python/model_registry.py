@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Registro de modelos de profundidad con carga perezosa y presupuesto de memoria.
+
+Cada modelo se registra con un loader (callable sin argumentos que devuelve el
+predictor ya listo) y se carga la primera vez que un request lo pide. Después
+de cada carga se mide el RSS del proceso; si supera `rss_budget_bytes` se
+desalojan los modelos menos usados recientemente hasta volver al presupuesto.
+Los modelos fijados (`pin`, p. ej. con --preload) no se desalojan nunca.
+
+Un request que ya tiene el predictor en la mano termina aunque el modelo se
+desaloje mientras tanto: el registro sólo suelta su referencia.
+
+Las cargas se hacen de a una (un solo lock de carga para todo el registro):
+isolated_imports modifica sys.path y sys.modules, que son globales, así que
+dos loaders en paralelo podrían importar el `networks` del otro modelo.
+"""
+from __future__ import absolute_import, division, print_function
+
+import gc
+import os
+import sys
+import time
+import ctypes
+import threading
+import contextlib
+from collections import OrderedDict, Counter
+
+# Paquetes de primer nivel que se repiten entre los árboles de los modelos
+# (monodepth2, NeWCRFs, PixelFormer y DCDepth tienen cada uno su `networks`).
+SHADOWED_MODULES = ('networks', 'layers', 'utils', 'models', 'dataloaders')
+
+# Serializa los bloques isolated_imports de todo el proceso (reentrante: un
+# loader puede anidar otro, p. ej. el PoseNet dentro del modelo de profundidad)
+_IMPORT_LOCK = threading.RLock()
+
+
+def current_rss():
+    """RSS actual del proceso en bytes (0 si /proc no está disponible)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def _release_memory():
+    gc.collect()
+    # glibc no devuelve al sistema la memoria liberada de la arena principal
+    # hasta un malloc_trim; sin esto el RSS no baja después de desalojar.
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+@contextlib.contextmanager
+def isolated_imports(root, names=SHADOWED_MODULES):
+    """Importa desde `root` sin chocar con los módulos homónimos de otro modelo.
+
+    Durante el bloque `root` va primero en sys.path y los módulos de `names`
+    ya importados se apartan de sys.modules; al salir se restauran. Los objetos
+    creados dentro conservan la referencia a sus propios módulos. Un solo bloque
+    a la vez en todo el proceso: los demás hilos esperan.
+    """
+    def owned():
+        return [n for n in sys.modules if n.split('.')[0] in names]
+
+    with _IMPORT_LOCK:
+        saved = {n: sys.modules.pop(n) for n in owned()}
+        sys.path.insert(0, root)
+        try:
+            yield
+        finally:
+            sys.path.remove(root)
+            for n in owned():
+                del sys.modules[n]
+            sys.modules.update(saved)
+
+
+class ModelRegistry:
+    def __init__(self, rss_budget_bytes=0):
+        self.rss_budget_bytes = rss_budget_bytes
+        self.loaders = {}
+        self.loaded = OrderedDict()    # nombre -> predictor, en orden de uso
+        self.pinned = set()
+        self.info = {}
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def register(self, name, loader):
+        self.loaders[name] = loader
+        self.info[name] = {"load_ms": None, "rss_delta_mb": None, "loads": 0, "last_used": None}
+
+    def names(self):
+        return sorted(self.loaders)
+
+    def get(self, name):
+        """Devuelve el predictor de `name`, cargándolo si hace falta.
+
+        Raises:
+            KeyError si `name` no está registrado
+        """
+        if name not in self.loaders:
+            raise KeyError(name)
+
+        with self.lock:
+            model = self.loaded.get(name)
+            if model is not None:
+                self.loaded.move_to_end(name)
+                self.info[name]["last_used"] = time.time()
+                self.counters['hits'] += 1
+                return model
+
+        # Un solo lock de carga para todo el registro: dos requests al mismo
+        # modelo frío cargan una sola vez y dos loaders nunca se pisan los
+        # imports. Los modelos residentes se sirven sin esperarlo (arriba).
+        with self.load_lock:
+            with self.lock:
+                model = self.loaded.get(name)
+                if model is not None:
+                    # Lo cargó otro request mientras esperábamos
+                    self.loaded.move_to_end(name)
+                    self.info[name]["last_used"] = time.time()
+            if model is None:
+                model = self._load(name)
+        self.enforce_budget(keep=name)
+        return model
+
+    def _load(self, name):
+        print("INFO: Cargando modelo '{}'...".format(name))
+        rss_before = current_rss()
+        start_time = time.time()
+        model = self.loaders[name]()
+        load_ms = (time.time() - start_time) * 1000
+        # Alta y marca de uso en la misma sección crítica: un desalojo o un
+        # /unload concurrente no puede quedar en medio
+        with self.lock:
+            self.loaded[name] = model
+            self.loaded.move_to_end(name)
+            self.info[name]["last_used"] = time.time()
+            self.counters['loads'] += 1
+            self.info[name].update({
+                "load_ms": round(load_ms, 1),
+                "rss_delta_mb": round((current_rss() - rss_before) / 2**20, 1),
+                "loads": self.info[name]["loads"] + 1
+            })
+        print("INFO: Modelo '{}' cargado en {:.0f} ms".format(name, load_ms))
+        return model
+
+    def pin(self, name):
+        """Carga `name` y lo deja residente (no se desaloja por presupuesto)."""
+        model = self.get(name)
+        with self.lock:
+            self.pinned.add(name)
+        return model
+
+    def unpin(self, name):
+        with self.lock:
+            self.pinned.discard(name)
+
+    def evict(self, name):
+        with self.lock:
+            if self.loaded.pop(name, None) is None:
+                return False
+            self.pinned.discard(name)
+            self.counters['evictions'] += 1
+        _release_memory()
+        print("INFO: Modelo '{}' desalojado (RSS={:.0f} MB)".format(name, current_rss() / 2**20))
+        return True
+
+    def enforce_budget(self, keep=None):
+        """Desaloja modelos LRU no fijados mientras el RSS supere el presupuesto.
+        `keep` (el modelo recién pedido) nunca se desaloja."""
+        if not self.rss_budget_bytes:
+            return
+        while current_rss() > self.rss_budget_bytes:
+            with self.lock:
+                victims = [n for n in self.loaded if n not in self.pinned and n != keep]
+            if not victims:
+                break
+            self.evict(victims[0])
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rss_mb": round(current_rss() / 2**20, 1),
+                "rss_budget_mb": round(self.rss_budget_bytes / 2**20, 1) if self.rss_budget_bytes else None,
+                "loaded": list(self.loaded),
+                "pinned": sorted(self.pinned),
+                "loads": self.counters['loads'],
+                "hits": self.counters['hits'],
+                "evictions": self.counters['evictions'],
+                "models": {n: dict(self.info[n], loaded=n in self.loaded, pinned=n in self.pinned)
+                           for n in sorted(self.loaders)}
+            }
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Modo de inferencia bfloat16 (autocast de CPU) con reporte de precisión y latencia.
+
+Con --precision bf16 el forward corre bajo torch.autocast(dtype=bfloat16): las
+convoluciones y los matmul (WindowAttention, Mlp, CRF, SAM, PQI) pasan a bf16,
+que en CPUs con AVX512-BF16 / AMX es varias veces más rápido que fp32; las
+operaciones que autocast considera inestables (softmax, normalizaciones,
+sumas) quedan en fp32. Además se mantienen en fp32 a mano las partes sensibles
+de cada modelo: la softmax y el cumsum de los bins de PixelFormer (BCP y
+DispHead), disp_to_depth de Monodepth2 y la DCT inversa (y el mapa de
+frecuencias acumulado) de DCDepth. La salida siempre se devuelve en fp32.
+
+float16 no se ofrece: en CPU no acelera los matmul y su rango (máx. 65504)
+desborda en las atenciones sin escalar. Para elegir el modo por modelo:
+
+    python precision.py --models monodepth2 newcrfs pixelformer dcdepth \\
+        --nyu_data_path ~/datasets/nyu_test --kitti_data_path ~/datasets/kitti_raw \\
+        --kitti_gt_path ~/datasets/kitti_gt
+
+NeWCRFs y PixelFormer se evalúan sobre el split de test de NYU, DCDepth y
+Monodepth2 sobre el de Eigen (KITTI); las métricas son las de compute_errors de
+NeWCRFs para todos. Sin checkpoints (--random_weights) solo la latencia es
+representativa.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import argparse
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision import transforms
+
+PRECISIONS = ['fp32', 'bf16']
+
+
+def autocast(precision, device_type='cpu'):
+    """Contexto de autocast para `precision` (con 'fp32' no hace nada)."""
+    if precision not in PRECISIONS:
+        raise ValueError("Precisión desconocida '{}', debe ser una de {}".format(precision, PRECISIONS))
+    return torch.autocast(device_type, dtype=torch.bfloat16, enabled=precision != 'fp32')
+
+
+def to_float(outputs):
+    """Pasa a fp32 los tensores de punto flotante de `outputs` (tensor, lista, tupla o dict)."""
+    if torch.is_tensor(outputs):
+        return outputs.float() if outputs.is_floating_point() else outputs
+    if isinstance(outputs, (list, tuple)):
+        return type(outputs)(to_float(o) for o in outputs)
+    if isinstance(outputs, dict):
+        return type(outputs)((k, to_float(v)) for k, v in outputs.items())
+    return outputs
+
+
+class AutocastModel(nn.Module):
+    """`model` ejecutado bajo autocast con salidas en fp32.
+
+    Los atributos que no son del wrapper (backbone, img_size, ...) se leen y
+    escriben en el modelo envuelto, así que sigue sirviendo donde se esperaba
+    el original (hooks de /metrics, flip_tta, tiled_forward).
+    """
+    def __init__(self, model, precision):
+        super(AutocastModel, self).__init__()
+        self.model = model
+        self.precision = precision
+
+    def __getattr__(self, name):
+        try:
+            return super(AutocastModel, self).__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules['model'], name)
+
+    def __setattr__(self, name, value):
+        model = self.__dict__.get('_modules', {}).get('model')
+        if model is not None and name not in self.__dict__ and hasattr(model, name):
+            setattr(model, name, value)
+        else:
+            super(AutocastModel, self).__setattr__(name, value)
+
+    def forward(self, x, *args, **kwargs):
+        with autocast(self.precision, x.device.type):
+            outputs = self.model(x, *args, **kwargs)
+        return to_float(outputs)
+
+
+def with_precision(model, precision):
+    """`model` tal cual con 'fp32'; si no, envuelto en AutocastModel."""
+    if precision == 'fp32':
+        return model
+    autocast(precision)  # Valida el nombre
+    return AutocastModel(model, precision)
+
+
+# --- Reporte: fp32 vs bf16 por modelo sobre los splits de test
+
+# Escala de los modelos mono+stereo de Monodepth2 a metros (evaluate_depth.py)
+STEREO_SCALE_FACTOR = 5.4
+
+
+def load_models(args):
+    """Genera (nombre, (forward: batch -> profundidad (1, 1, h, w) en metros, transform, dataset, min, max))
+    de a un modelo, para no tenerlos todos en memoria a la vez."""
+    from benchmark_swin_caches import BUILDERS
+    from infer_multi import QUANT_SPLITS, IMAGENET_NORMALIZE
+
+    for name in args.models:
+        if name == 'monodepth2':
+            from depth_backends import load_monodepth2, Monodepth2Depth
+            encoder, depth_decoder, feed_width, feed_height = load_monodepth2(args.monodepth2_model_path)
+            model = Monodepth2Depth(encoder, depth_decoder).eval()
+            transform = transforms.Compose([transforms.Resize((feed_height, feed_width)), transforms.ToTensor()])
+            yield name, (lambda x: model(x) * STEREO_SCALE_FACTOR, transform, 'kitti', 1e-3, 80.0)
+            continue
+
+        model, size = BUILDERS[name](None if args.random_weights else getattr(args, '{}_checkpoint'.format(name)))
+        model.eval()
+        transform = transforms.Compose([transforms.Resize(size), transforms.ToTensor(), IMAGENET_NORMALIZE])
+        if name == 'dcdepth':
+            # dct_eigen_pff: salida en espacio log
+            yield name, (lambda x: torch.exp(model(x)[-1]), transform, 'kitti', 1e-3, 80.0)
+        else:
+            yield name, (model, transform, QUANT_SPLITS[name][0], 1e-3, 10.0)
+
+
+def parse_args():
+    from infer_multi import MONODEPTH2_PATH, NEWCRFS_PATH, PIXELFORMER_PATH, DCDEPTH_PATH
+    parser = argparse.ArgumentParser(description='Inferencia fp32 vs bf16 (autocast de CPU): precisión y latencia.')
+    parser.add_argument('--models', type=str, nargs='+', default=['monodepth2', 'newcrfs', 'pixelformer', 'dcdepth'],
+                        choices=['monodepth2', 'newcrfs', 'pixelformer', 'dcdepth'])
+    parser.add_argument('--precisions', type=str, nargs='+', choices=PRECISIONS, default=PRECISIONS)
+    parser.add_argument('--monodepth2_model_path', type=str,
+                        default=os.path.join(MONODEPTH2_PATH, 'models', 'mono+stereo_640x192'))
+    parser.add_argument('--newcrfs_checkpoint', type=str, default=os.path.join(NEWCRFS_PATH, 'model_nyu.ckpt'))
+    parser.add_argument('--pixelformer_checkpoint', type=str,
+                        default=os.path.join(PIXELFORMER_PATH, 'pretrained/checkpoints/nyu.pth'))
+    parser.add_argument('--dcdepth_checkpoint', type=str,
+                        default=os.path.join(DCDEPTH_PATH, 'checkpoints/dcdepth_eigen.pth'))
+    parser.add_argument('--random_weights', action='store_true',
+                        help='modelos Swin sin checkpoint (solo latencia)')
+    parser.add_argument('--nyu_data_path', type=str, default=None, help='raíz de NYU Depth v2 (test)')
+    parser.add_argument('--nyu_split', type=str,
+                        default=os.path.join(PIXELFORMER_PATH, 'data_splits', 'nyudepthv2_test_files_with_gt.txt'))
+    parser.add_argument('--kitti_data_path', type=str, default=None, help='raíz de KITTI raw')
+    parser.add_argument('--kitti_gt_path', type=str, default=None,
+                        help='raíz del ground truth de KITTI (data_depth_annotated)')
+    parser.add_argument('--kitti_split', type=str,
+                        default=os.path.join(DCDEPTH_PATH, 'data_splits', 'eigen_test_files_with_gt.txt'))
+    parser.add_argument('--num_samples', type=int, default=16, help='imágenes de cada split')
+    parser.add_argument('--iterations', type=int, default=3,
+                        help='pasadas cronometradas sobre las imágenes (una de ruido si no hay split)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import PIL.Image as pil
+    from model_registry import isolated_imports
+    from quantize import read_split, evaluate
+    from tiled_inference import time_calls
+    from infer_multi import NEWCRFS_PATH
+
+    args = parse_args()
+    with isolated_imports(NEWCRFS_PATH):
+        from utils import compute_errors
+
+    splits = {
+        'nyu': (read_split(args.nyu_split, args.nyu_data_path, num_samples=args.num_samples)
+                if args.nyu_data_path else [], 1000.0),
+        'kitti': (read_split(args.kitti_split, args.kitti_data_path, args.kitti_gt_path, args.num_samples)
+                  if args.kitti_data_path and args.kitti_gt_path else [], 256.0),
+    }
+
+    print("{:<12} {:<5} {:>5} {:>8} {:>8} {:>8} {:>7} {:>9}".format(
+        'modelo', 'prec', 'imgs', 'ms', 'abs_rel', 'rms', 'd1', 'rel_fp32'))
+    for name, (forward, transform, dataset, min_depth, max_depth) in load_models(args):
+        samples, depth_scale = splits[dataset]
+        if samples:
+            inputs = [transform(pil.open(rgb_path).convert('RGB')).unsqueeze(0) for rgb_path, _ in samples]
+        else:
+            np.random.seed(0)
+            inputs = [transform(pil.fromarray(np.uint8(np.random.rand(480, 640, 3) * 255))).unsqueeze(0)]
+
+        reference = None
+        for precision in args.precisions:
+            def predict_tensor(x):
+                with torch.no_grad(), autocast(precision):
+                    return forward(x).float()
+
+            def predict(image):
+                depth = predict_tensor(transform(image).unsqueeze(0))
+                depth = F.interpolate(depth, (image.size[1], image.size[0]), mode='bilinear', align_corners=False)
+                return depth.squeeze().numpy()
+
+            # Latencia de la red sola (sin lectura ni preprocesamiento)
+            ms = time_calls(lambda: [predict_tensor(x) for x in inputs], args.iterations).mean() / len(inputs)
+            errors = evaluate(predict, samples, compute_errors, depth_scale, min_depth, max_depth) if samples \
+                else dict.fromkeys(['abs_rel', 'rms', 'd1'], float('nan'))
+
+            # abs_rel medio de la salida respecto de fp32 (no necesita ground truth)
+            outputs = [predict_tensor(x) for x in inputs]
+            reference = outputs if reference is None else reference
+            rel = np.mean([float(((o - r).abs() / r.abs().clamp(min=1e-6)).mean()) for o, r in zip(outputs, reference)])
+            print("{:<12} {:<5} {:5d} {:8.1f} {:8.4f} {:8.3f} {:7.4f} {:9.2e}".format(
+                name, precision, len(samples), ms, errors['abs_rel'], errors['rms'], errors['d1'], rel))
+        del forward  # Antes de construir el siguiente modelo
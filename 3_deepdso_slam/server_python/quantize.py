@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Modo de inferencia int8 (cuantización dinámica) con control de precisión.
+
+`quantize_dynamic` convierte los nn.Linear (WindowAttention, Mlp, las capas de
+CRF y SAM de los modelos Swin) a int8 con escalas de activación calculadas en
+cada llamada; las convoluciones quedan en fp32. `accuracy_gate` evalúa el
+modelo original y el cuantizado con `compute_errors` sobre unas pocas imágenes
+de un split con ground truth y solo acepta el int8 si abs_rel no empeora más
+de `max_abs_rel_delta`.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+try:
+    from torch.ao.quantization import quantize_dynamic as _quantize_dynamic
+except ImportError:
+    from torch.quantization import quantize_dynamic as _quantize_dynamic
+
+# Orden de la lista que devuelve compute_errors en NeWCRFs y PixelFormer (DCDepth devuelve un dict)
+METRICS = ['silog', 'abs_rel', 'log10', 'rms', 'sq_rel', 'log_rms', 'd1', 'd2', 'd3']
+
+
+def quantize_dynamic(model):
+    """Copia de `model` con los nn.Linear en int8 (el original no se modifica)."""
+    return _quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def read_split(split_file, data_path, gt_path=None, num_samples=16):
+    """Hasta `num_samples` pares (imagen, ground truth) repartidos a lo largo de
+    un split de los data_splits ('rgb gt focal' por línea; gt 'None' se omite).
+    """
+    gt_path = gt_path or data_path
+    with open(split_file) as f:
+        entries = [line.split() for line in f if line.strip()]
+    entries = [e for e in entries if len(e) > 1 and e[1] != 'None']
+    if not entries:
+        return []
+    step = max(1, len(entries) // num_samples)
+    return [(os.path.join(data_path, e[0].lstrip('/')), os.path.join(gt_path, e[1].lstrip('/')))
+            for e in entries[::step][:num_samples]]
+
+
+def evaluate(predict, samples, compute_errors, depth_scale, min_depth, max_depth):
+    """Promedio de `compute_errors` de `predict(PIL) -> profundidad (H, W)` sobre `samples`.
+
+    Args:
+        depth_scale: divisor de los PNG de ground truth (1000 en NYU, 256 en KITTI)
+    """
+    errors = []
+    for rgb_path, gt_path in samples:
+        gt = np.asarray(Image.open(gt_path), dtype=np.float32) / depth_scale
+        pred = predict(Image.open(rgb_path).convert('RGB'))
+        if pred.shape != gt.shape:
+            pred = np.asarray(Image.fromarray(pred).resize((gt.shape[1], gt.shape[0]), Image.BILINEAR))
+        pred = np.clip(pred, min_depth, max_depth)
+        valid = np.logical_and(gt > min_depth, gt < max_depth)
+        sample_errors = compute_errors(gt[valid], pred[valid])
+        if isinstance(sample_errors, dict):
+            sample_errors = [sample_errors[m] for m in METRICS]
+        errors.append(sample_errors)
+    return dict(zip(METRICS, [float(v) for v in np.mean(errors, axis=0)]))
+
+
+def accuracy_gate(predict_fp32, predict_int8, samples, compute_errors, depth_scale,
+                  min_depth, max_depth, max_abs_rel_delta=0.01):
+    """Compara fp32 e int8 sobre `samples`.
+
+    Returns:
+        (aceptado, reporte) con las métricas de ambos y el tiempo medio por imagen
+    """
+    report = {"samples": len(samples), "max_abs_rel_delta": max_abs_rel_delta}
+    if not samples:
+        report["error"] = "sin imágenes de validación"
+        return False, report
+    for name, predict in (('fp32', predict_fp32), ('int8', predict_int8)):
+        start_time = time.time()
+        report[name] = evaluate(predict, samples, compute_errors, depth_scale, min_depth, max_depth)
+        report[name]["ms_per_image"] = round((time.time() - start_time) * 1000 / len(samples), 1)
+    report["abs_rel_delta"] = report['int8']['abs_rel'] - report['fp32']['abs_rel']
+    return report["abs_rel_delta"] <= max_abs_rel_delta, report
+
+
+def print_report(name, accepted, report):
+    if "error" in report:
+        print("ERROR: No se activa int8 para {}: {}".format(name, report["error"]))
+        return
+    print("INFO: Control int8 de {} ({} imágenes): abs_rel fp32={:.4f} int8={:.4f} (delta {:+.4f}, "
+          "máx {:.4f}); {:.0f} -> {:.0f} ms/imagen -> {}".format(
+              name, report["samples"], report['fp32']['abs_rel'], report['int8']['abs_rel'],
+              report["abs_rel_delta"], report["max_abs_rel_delta"], report['fp32']['ms_per_image'],
+              report['int8']['ms_per_image'], "int8 ACTIVO" if accepted else "se mantiene fp32"))
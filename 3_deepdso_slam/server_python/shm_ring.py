@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""Transporte local por memoria compartida entre DSO y el servidor de profundidad.
+
+Un segmento POSIX (multiprocessing.shared_memory) contiene un anillo de
+`num_slots` ranuras de frame (uint8, gris o BGR) y otras tantas ranuras de
+profundidad (float32). El canal de control es un socket Unix por el que solo
+viajan mensajes de tamaño fijo:
+
+    request  = <IIII  (slot, width, height, channels)
+    response = <IiII  (slot, status, depth_width, depth_height)
+
+El cliente escribe el frame en `frame_view(slot)`, envía el request y, al
+recibir la respuesta con status == 0, lee la profundidad de `depth_view(slot)`.
+Ningún byte de imagen pasa por el socket ni por disco.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import socket
+import struct
+
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+REQUEST = struct.Struct('<IIII')
+RESPONSE = struct.Struct('<IiII')
+
+STATUS_OK = 0
+STATUS_BAD_REQUEST = 1
+STATUS_ERROR = 2
+
+# Cabecera del segmento: magic, num_slots, max_width, max_height
+HEADER = struct.Struct('<4sIII')
+MAGIC = b'DSHM'
+
+
+def _recv_exact(conn, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            return None
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+class ShmRing:
+    """Anillo de ranuras frame/profundidad en un segmento de memoria compartida.
+    """
+    def __init__(self, name, num_slots=4, max_width=1280, max_height=720, create=False):
+        self.frame_bytes = max_width * max_height * 3
+        self.depth_bytes = max_width * max_height * 4
+
+        if create:
+            size = HEADER.size + num_slots * (self.frame_bytes + self.depth_bytes)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, num_slots, max_width, max_height)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Solo el proceso que crea el segmento debe destruirlo al salir
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+            magic, num_slots, max_width, max_height = HEADER.unpack_from(self.shm.buf, 0)
+            if magic != MAGIC:
+                raise ValueError("El segmento '{}' no es un anillo de profundidad".format(name))
+            self.frame_bytes = max_width * max_height * 3
+            self.depth_bytes = max_width * max_height * 4
+
+        self.name = name
+        self.owner = create
+        self.num_slots = num_slots
+        self.max_width = max_width
+        self.max_height = max_height
+
+    def _check(self, slot, width, height):
+        if not 0 <= slot < self.num_slots:
+            raise ValueError("slot {} fuera del anillo (num_slots={})".format(slot, self.num_slots))
+        if width > self.max_width or height > self.max_height:
+            raise ValueError("{}x{} excede la ranura de {}x{}".format(
+                width, height, self.max_width, self.max_height))
+
+    def frame_view(self, slot, width, height, channels):
+        """Vista NumPy (sin copia) de la ranura de frame `slot`.
+        """
+        self._check(slot, width, height)
+        if channels not in (1, 3):
+            raise ValueError("channels debe ser 1 (gris) o 3 (BGR)")
+        offset = HEADER.size + slot * self.frame_bytes
+        shape = (height, width) if channels == 1 else (height, width, 3)
+        return np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=offset)
+
+    def depth_view(self, slot, width, height):
+        """Vista NumPy (sin copia) de la ranura de profundidad `slot`.
+        """
+        self._check(slot, width, height)
+        offset = HEADER.size + self.num_slots * self.frame_bytes + slot * self.depth_bytes
+        return np.ndarray((height, width), dtype=np.float32, buffer=self.shm.buf, offset=offset)
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ShmDepthServer:
+    """Atiende requests del canal de control y ejecuta `predict_fn` sobre las ranuras.
+
+    `predict_fn(frame, depth_out)` recibe la vista del frame (H, W[, 3]) uint8 y
+    debe escribir la profundidad en `depth_out` y devolver su forma (h, w).
+    """
+    def __init__(self, shm_name, socket_path, predict_fn, num_slots=4, max_width=1280, max_height=720):
+        self.ring = ShmRing(shm_name, num_slots, max_width, max_height, create=True)
+        self.socket_path = socket_path
+        self.predict_fn = predict_fn
+
+    def _handle(self, conn):
+        while True:
+            msg = _recv_exact(conn, REQUEST.size)
+            if msg is None:
+                return
+            slot, width, height, channels = REQUEST.unpack(msg)
+            try:
+                frame = self.ring.frame_view(slot, width, height, channels)
+                depth_out = self.ring.depth_view(slot, width, height)
+            except ValueError as e:
+                print("Error en request shm: {}".format(e))
+                conn.sendall(RESPONSE.pack(slot, STATUS_BAD_REQUEST, 0, 0))
+                continue
+            try:
+                depth_height, depth_width = self.predict_fn(frame, depth_out)
+                conn.sendall(RESPONSE.pack(slot, STATUS_OK, depth_width, depth_height))
+            except Exception as e:
+                print("Error en la predicción (shm): {}".format(e))
+                conn.sendall(RESPONSE.pack(slot, STATUS_ERROR, 0, 0))
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(1)
+        print("==> Anillo shm '{}' ({} ranuras de {}x{}) escuchando en {}".format(
+            self.ring.name, self.ring.num_slots, self.ring.max_width, self.ring.max_height,
+            self.socket_path))
+        try:
+            while True:
+                conn, _ = listener.accept()
+                with conn:
+                    self._handle(conn)
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+            self.ring.close()
+
+
+class ShmDepthClient:
+    """Cliente de referencia: el mismo protocolo que debe seguir el cliente C++.
+    """
+    def __init__(self, shm_name, socket_path):
+        self.ring = ShmRing(shm_name)
+        self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.conn.connect(socket_path)
+        self.next_slot = 0
+
+    def submit(self, frame):
+        """Copia `frame` (H, W) o (H, W, 3) uint8 a la siguiente ranura y envía el request.
+        Se pueden tener hasta `num_slots` requests en vuelo.
+        """
+        height, width = frame.shape[:2]
+        channels = 1 if frame.ndim == 2 else frame.shape[2]
+        slot = self.next_slot
+        self.next_slot = (self.next_slot + 1) % self.ring.num_slots
+        self.ring.frame_view(slot, width, height, channels)[...] = frame
+        self.conn.sendall(REQUEST.pack(slot, width, height, channels))
+        return slot
+
+    def receive(self):
+        """Espera la siguiente respuesta y devuelve (slot, vista de la profundidad).
+        La vista sigue siendo válida hasta que el anillo vuelva a usar esa ranura.
+        """
+        msg = _recv_exact(self.conn, RESPONSE.size)
+        if msg is None:
+            raise ConnectionError("El servidor de profundidad cerró el canal de control")
+        slot, status, depth_width, depth_height = RESPONSE.unpack(msg)
+        if status != STATUS_OK:
+            raise RuntimeError("El servidor devolvió status {} para la ranura {}".format(status, slot))
+        return slot, self.ring.depth_view(slot, depth_width, depth_height)
+
+    def predict(self, frame):
+        self.submit(frame)
+        return self.receive()[1]
+
+    def close(self):
+        self.conn.close()
+        self.ring.close()
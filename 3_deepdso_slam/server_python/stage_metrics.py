@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""Latencia por etapa de los servidores de profundidad, en formato Prometheus.
+
+Etapas que registran los servidores (las que no aplican simplemente no aparecen):
+
+    parse        leer el body / los headers del request
+    decode       decodificar la imagen (JPEG/PNG/frame crudo -> PIL)
+    preprocess   redimensionar y normalizar
+    encoder      backbone (ResNet / Swin)
+    decoder      decoder de profundidad, CRF o SAM + cabeza
+    forward      forward completo cuando no se puede separar (pool, micro-batching)
+    propagate    pose y reproyección de la profundidad del keyframe (frames que no corren el modelo)
+    pose         PoseNet de Monodepth2 (/pose y X-Pose-From)
+    postprocess  disp_to_depth, flip, recorte, muestreo de puntos
+    upsample     interpolación a la resolución original
+    encode       serializar la respuesta (JSON, PNG, binario)
+
+Uso desde un servidor Flask:
+
+    metrics = StageMetrics()
+    instrument_app(app, metrics)        # timer por request + Server-Timing opcional
+
+    with stage('decode'):
+        ...
+
+`stage` mide en el timer del request activo en el hilo actual; fuera de un
+request (anillo de memoria compartida, workers del pool, hilo del batcher) no
+hace nada.
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+import bisect
+import threading
+import contextlib
+from collections import OrderedDict, defaultdict
+
+# Límites de los buckets en segundos
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, le, cumulative))
+        lines.append('{}_sum{{{}}} {!r}'.format(name, labels, self.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return lines
+
+
+class RequestTimer:
+    """Tiempos de un request por etapa (ms). Si una etapa se repite, se acumula."""
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start_time = time.perf_counter()
+        self.stages = OrderedDict()
+
+    def add(self, name, ms):
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def total_ms(self):
+        return (time.perf_counter() - self.start_time) * 1000
+
+    def server_timing(self):
+        """Valor del header Server-Timing (W3C)."""
+        entries = ['{};dur={:.2f}'.format(name, ms) for name, ms in self.stages.items()]
+        entries.append('total;dur={:.2f}'.format(self.total_ms()))
+        return ', '.join(entries)
+
+
+class StageMetrics:
+    def __init__(self, prefix='depth', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.stage_histograms = defaultdict(lambda: Histogram(self.buckets))
+        self.request_histograms = defaultdict(lambda: Histogram(self.buckets))
+        self.responses = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def observe(self, timer, status):
+        with self.lock:
+            for name, ms in timer.stages.items():
+                self.stage_histograms[(timer.endpoint, name)].observe(ms / 1000.0)
+            self.request_histograms[timer.endpoint].observe(timer.total_ms() / 1000.0)
+            self.responses[(timer.endpoint, status)] += 1
+
+    def render(self):
+        """Texto de exposición de Prometheus (version 0.0.4)."""
+        stage_name = '{}_stage_duration_seconds'.format(self.prefix)
+        request_name = '{}_request_duration_seconds'.format(self.prefix)
+        responses_name = '{}_responses_total'.format(self.prefix)
+        with self.lock:
+            lines = ['# HELP {} Duración de cada etapa del request.'.format(stage_name),
+                     '# TYPE {} histogram'.format(stage_name)]
+            for (endpoint, name), histogram in sorted(self.stage_histograms.items()):
+                lines += histogram.render(stage_name, 'endpoint="{}",stage="{}"'.format(endpoint, name))
+            lines += ['# HELP {} Duración total del request.'.format(request_name),
+                      '# TYPE {} histogram'.format(request_name)]
+            for endpoint, histogram in sorted(self.request_histograms.items()):
+                lines += histogram.render(request_name, 'endpoint="{}"'.format(endpoint))
+            lines += ['# HELP {} Respuestas por endpoint y código HTTP.'.format(responses_name),
+                      '# TYPE {} counter'.format(responses_name)]
+            for (endpoint, status), count in sorted(self.responses.items()):
+                lines.append('{}{{endpoint="{}",status="{}"}} {}'.format(responses_name, endpoint, status, count))
+        return '\n'.join(lines) + '\n'
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Mide el bloque como la etapa `name` del request activo (no-op si no hay)."""
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - start_time) * 1000)
+
+
+def record(name, ms):
+    """Agrega `ms` a la etapa `name` del request activo (p. ej. tiempos del batcher)."""
+    timer = current_timer()
+    if timer is not None:
+        timer.add(name, ms)
+
+
+def time_encoder_decoder(model, encoder):
+    """Registra hooks que reparten el forward de `model` en 'encoder' (el
+    submódulo `encoder`, p. ej. el backbone Swin) y 'decoder' (todo lo demás).
+    """
+    def start(module, inputs):
+        if current_timer() is not None:
+            _local.starts = getattr(_local, 'starts', {})
+            _local.starts[id(module)] = time.perf_counter()
+
+    def elapsed_ms(module):
+        return (time.perf_counter() - _local.starts.pop(id(module))) * 1000
+
+    def encoder_done(module, inputs, outputs):
+        if current_timer() is not None:
+            _local.encoder_ms = elapsed_ms(module)
+            record('encoder', _local.encoder_ms)
+
+    def model_done(module, inputs, outputs):
+        if current_timer() is not None:
+            record('decoder', elapsed_ms(module) - getattr(_local, 'encoder_ms', 0.0))
+            _local.encoder_ms = 0.0
+
+    model.register_forward_pre_hook(start)
+    model.register_forward_hook(model_done)
+    encoder.register_forward_pre_hook(start)
+    encoder.register_forward_hook(encoder_done)
+
+
+def instrument_app(app, metrics, server_timing=False):
+    """Activa un RequestTimer en cada request de `app` y lo vuelca en `metrics`.
+
+    El header Server-Timing se agrega si `server_timing` es True o si el cliente
+    lo pide con 'X-Server-Timing: 1'. /metrics no se instrumenta a sí mismo.
+    """
+    from flask import request
+
+    @app.before_request
+    def start_timer():
+        if request.path != '/metrics':
+            _local.timer = RequestTimer(request.endpoint or 'unknown')
+
+    @app.after_request
+    def finish_timer(response):
+        timer = current_timer()
+        if timer is not None:
+            if server_timing or request.headers.get('X-Server-Timing') == '1':
+                response.headers['Server-Timing'] = timer.server_timing()
+            metrics.observe(timer, response.status_code)
+        return response
+
+    @app.teardown_request
+    def clear_timer(exc):
+        _local.timer = None
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import subprocess
+import textwrap
+
+# Los módulos del servidor se importan por nombre (como hacen los servidores)
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+
+def run_script(*parts, timeout=120):
+    """Corre los fragmentos `parts` en otro intérprete con dos hilos intra-op y los módulos del
+    servidor importables. Para los casos que dejan armado el equipo de hilos de
+    OpenMP: en el proceso de pytest envenenarían los forks de los demás tests.
+    """
+    prelude = "import sys, torch\nsys.path.insert(0, {!r})\ntorch.set_num_threads(2)\n".format(SERVER_DIR)
+    return subprocess.run([sys.executable, '-c', prelude + ''.join(textwrap.dedent(p) for p in parts)],
+                          capture_output=True, text=True, timeout=timeout)
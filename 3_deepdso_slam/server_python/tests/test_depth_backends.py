@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Backends de Monodepth2 con pesos aleatorios (no hacen falta los modelos entrenados)."""
+import os
+
+import pytest
+import torch
+
+from conftest import run_script
+from depth_backends import load_backend
+import networks
+
+
+@pytest.fixture(scope='module')
+def model_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('monodepth2')
+    torch.manual_seed(0)
+    encoder = networks.ResnetEncoder(18, False)
+    decoder = networks.DepthDecoder(num_ch_enc=encoder.num_ch_enc, scales=range(4))
+    torch.save(dict(encoder.state_dict(), height=96, width=320), os.path.join(path, 'encoder.pth'))
+    torch.save(decoder.state_dict(), os.path.join(path, 'depth.pth'))
+    return str(path)
+
+
+def test_deploy_matches_eager(model_path):
+    eager, deploy = load_backend('eager', model_path), load_backend('deploy', model_path)
+    x = torch.rand(2, 3, 96, 320)
+    assert (deploy.feed_width, deploy.feed_height) == (320, 96)
+    assert torch.allclose(deploy(x), eager(x), rtol=1e-4, atol=1e-4)
+
+
+def test_worker_pool_after_loading_deploy_backend(model_path):
+    # --backend deploy --workers N: el trace y el control de deploy no pueden dejar
+    # hilos intra-op armados en el proceso que después hace fork
+    result = run_script("""
+        from depth_backends import load_backend
+        from worker_pool import WorkerPool
+        backend = load_backend('deploy', {!r})
+        pool = WorkerPool(backend, 2, 2, start_timeout=30)
+        print("OK", tuple(pool.run(torch.rand(1, 3, 96, 320)).shape))
+        pool.close()
+    """.format(model_path))
+    assert "OK (1, 1, 96, 320)" in result.stdout, result.stderr
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Las copias de depth_common en los árboles de los modelos son idénticas a la
+de server_python y se importan sin tocar sys.path."""
+import os
+import filecmp
+
+import pytest
+
+from conftest import SERVER_DIR, run_script
+
+REPO = os.path.abspath(os.path.join(SERVER_DIR, '..', '..'))
+SOURCE = os.path.join(SERVER_DIR, 'depth_common')
+TREES = ['3_deepdso_slam/DeepDSO/newcrfs',
+         '2_benchmarks/pixelformer/implementation/pixelformer',
+         '2_benchmarks/dcdepth/implementation']
+
+
+def source_files():
+    return sorted(f for f in os.listdir(SOURCE) if f.endswith('.py'))
+
+
+@pytest.mark.parametrize('tree', TREES)
+def test_vendored_copy_matches(tree):
+    copy = os.path.join(REPO, tree, 'depth_common')
+    vendored = sorted(f for f in os.listdir(copy) if f.endswith('.py'))
+    assert vendored == source_files()
+    _, mismatch, errors = filecmp.cmpfiles(SOURCE, copy, vendored, shallow=False)
+    assert not mismatch and not errors, 'copiar server_python/depth_common a {}'.format(tree)
+
+
+@pytest.mark.parametrize('tree', TREES)
+def test_tree_utils_import_from_its_copy(tree):
+    # El árbol en sys.path[0], como cuando se corre uno de sus scripts, sin server_python
+    tree = os.path.join(REPO, tree)
+    result = run_script("""
+        sys.path[:] = [{!r}] + [p for p in sys.path if 'server_python' not in p]
+        from utils import flip_lr, fuse_inv_depth, post_process_depth, flip_tta
+        import depth_common
+        print(depth_common.__file__)
+    """.format(tree))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == os.path.join(tree, 'depth_common', '__init__.py')
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Codificaciones de profundidad: ida y vuelta y rango de las de 16 bits."""
+import numpy as np
+import pytest
+
+from depth_encoding import available_encodings, decode_depth, encode_depth, negotiate
+
+
+@pytest.mark.parametrize('encoding', available_encodings())
+def test_round_trip(encoding):
+    depth = np.random.RandomState(0).uniform(0.1, 10.0, (24, 32)).astype(np.float32)
+    body, _, headers = encode_depth(depth, encoding, max_depth=10.0)
+    assert np.allclose(decode_depth(body, headers), depth, atol=5e-3, rtol=1e-3)
+
+
+@pytest.mark.parametrize('encoding', ['u16mm', 'png16'])
+def test_millimetres_up_to_65_m(encoding):
+    depth = np.array([[0.0, 1.2345, 65.0]], dtype=np.float32)
+    body, _, headers = encode_depth(depth, encoding, max_depth=65.0)
+    assert float(headers['X-Depth-Scale']) == 0.001
+    assert np.allclose(decode_depth(body, headers), depth, atol=5e-4)
+
+
+@pytest.mark.parametrize('encoding', ['u16mm', 'png16'])
+def test_far_depth_does_not_saturate(encoding):
+    # Monodepth2 llega a 100 m: con milímetros fijos todo lo que pasa de 65.5 m se recortaba
+    depth = np.array([[0.1, 50.0, 80.0, 100.0]], dtype=np.float32)
+    body, _, headers = encode_depth(depth, encoding, max_depth=100.0)
+    scale = float(headers['X-Depth-Scale'])
+    assert scale == pytest.approx(100.0 / 65535)
+    assert np.allclose(decode_depth(body, headers), depth, atol=scale)
+
+
+def test_negotiate():
+    assert negotiate('f16', None) == 'f16'
+    assert negotiate(None, 'text/html, application/x-depth-u16mm;q=0.9') == 'u16mm'
+    assert negotiate(None, 'application/json') is None
+    with pytest.raises(ValueError):
+        negotiate('jpeg', None)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""KeyframeDepth: reproyección con z-buffer, relleno de huecos y decisión de keyframe."""
+import math
+
+import torch
+
+from keyframe_depth import DepthWarper, KeyframeDepth, fill_holes
+
+SIZE = (48, 64)
+INTRINSICS = (50.0, 50.0, 32.0, 24.0)
+
+
+def pose(yaw_deg=0.0, tx=0.0, tz=0.0):
+    """(4, 4) con giro alrededor de y y traslación en x / z."""
+    c, s = math.cos(math.radians(yaw_deg)), math.sin(math.radians(yaw_deg))
+    T = torch.eye(4)
+    T[0, 0], T[0, 2], T[2, 0], T[2, 2] = c, s, -s, c
+    T[0, 3], T[2, 3] = tx, tz
+    return T
+
+
+def plane(depth=5.0):
+    return torch.full((1, 1) + SIZE, depth)
+
+
+def test_identity_warp_keeps_depth():
+    warper = DepthWarper(*SIZE, INTRINSICS)
+    depth = plane() + torch.rand(1, 1, *SIZE)
+    warped, holes = warper(depth, torch.eye(4).unsqueeze(0))
+    assert not holes.any()
+    assert torch.allclose(warped, depth)
+
+
+def test_rotation_warp_matches_the_rotated_plane():
+    warper = DepthWarper(*SIZE, INTRINSICS)
+    T = pose(yaw_deg=2.0).unsqueeze(0)
+    warped, holes = warper(plane(), T)
+    # Plano z = 5 de la cámara de origen visto desde la destino: n' . X' = 5 con n' = R n
+    fx, fy, cx, cy = INTRINSICS
+    v, u = torch.meshgrid(torch.arange(SIZE[0], dtype=torch.float32),
+                          torch.arange(SIZE[1], dtype=torch.float32), indexing='ij')
+    rays = torch.stack([(u - cx) / fx, (v - cy) / fy, torch.ones_like(u)])
+    normal = T[0, :3, :3] @ torch.tensor([0.0, 0.0, 1.0])
+    expected = 5.0 / torch.einsum('c,chw->hw', normal, rays)
+    filled = ~holes[0, 0]
+    # Solo queda sin dato la franja que la rotación trae desde fuera de la imagen
+    assert 0 < holes.float().mean() < 0.1
+    relative = ((warped[0, 0] - expected).abs() / expected)[filled]
+    assert float(relative.max()) < 2e-3
+
+
+def test_z_buffer_keeps_the_nearest_point():
+    warper = DepthWarper(*SIZE, INTRINSICS)
+    depth = plane(10.0)
+    depth[..., 20:28, 28:36] = 2.0   # objeto cercano delante del fondo
+    warped, _ = warper(depth, pose(tx=-0.2).unsqueeze(0))
+    # El objeto se corre 50 * 0.2 / 2 = 5 px (el fondo, 1 px) y tapa el fondo que cae en el mismo lugar
+    assert torch.equal(warped[..., 20:28, 23:31], torch.full((1, 1, 8, 8), 2.0))
+    assert torch.equal(warped[..., 20:28, 31:35], torch.full((1, 1, 8, 4), float('inf')))
+
+
+def test_fill_holes_takes_the_farthest_neighbour_then_the_fallback():
+    depth = torch.full((1, 1, 9, 9), 3.0)
+    depth[..., :, 5:] = 8.0
+    holes = torch.zeros(1, 1, 9, 9, dtype=torch.bool)
+    holes[..., 3:6, 4] = True
+    filled = fill_holes(depth, holes, torch.zeros_like(depth))
+    # Hueco de desoclusión en el borde: muestra el fondo (el más lejano)
+    assert torch.all(filled[..., 3:6, 4] == 8.0)
+    assert torch.equal(filled[~holes], depth[~holes])
+
+    everything = torch.ones(1, 1, 9, 9, dtype=torch.bool)
+    fallback = torch.full((1, 1, 9, 9), 4.0)
+    assert torch.equal(fill_holes(depth, everything, fallback), fallback)
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return plane()
+
+
+def run(keyframes, image, camera_pose, depth_fn):
+    return keyframes(image, depth_fn, camera_pose=camera_pose)[1]
+
+
+def test_propagates_until_a_threshold_asks_for_a_keyframe():
+    torch.manual_seed(0)
+    image = torch.rand(1, 3, *SIZE)
+    depth_fn = Counter()
+    keyframes = KeyframeDepth(INTRINSICS, SIZE, max_interval=2, max_rotation_deg=5.0, max_translation=0.1,
+                              max_hole_fraction=1.0, max_photometric_error=1.0)
+    assert run(keyframes, image, pose(), depth_fn)['reason'] == 'inicio'
+    info = run(keyframes, image, pose(), depth_fn)
+    assert not info['keyframe'] and info['age'] == 1 and info['photometric_error'] == 0
+    assert run(keyframes, image, pose(), depth_fn)['age'] == 2
+    assert run(keyframes, image, pose(), depth_fn)['reason'] == 'intervalo'
+    assert run(keyframes, image, pose(yaw_deg=10.0), depth_fn)['reason'] == 'rotación'
+    # 1 m con mediana de 5 m: 0.2 > 0.1
+    assert run(keyframes, image, pose(yaw_deg=10.0, tz=1.0), depth_fn)['reason'] == 'traslación'
+    assert run(keyframes, image, None, depth_fn)['reason'] == 'sin pose'
+    assert depth_fn.calls == 5
+    assert keyframes.stats()['keyframes'] == 5 and keyframes.stats()['frames'] == 7
+
+
+def test_holes_and_photometric_error_ask_for_a_keyframe():
+    torch.manual_seed(0)
+    image = torch.rand(1, 3, *SIZE)
+    keyframes = KeyframeDepth(INTRINSICS, SIZE, max_translation=1.0, max_hole_fraction=0.05,
+                              max_photometric_error=0.1)
+    run(keyframes, image, pose(), Counter())
+    # 0.5 m de costado a 5 m: 5 px de 64 sin dato
+    info = run(keyframes, image, pose(tx=0.5), Counter())
+    assert info['reason'] == 'huecos'
+    assert run(keyframes, torch.rand(1, 3, *SIZE), pose(tx=0.5), Counter())['reason'] == 'fotométrico'
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""ModelRegistry: carga perezosa, LRU, presupuesto y cargas concurrentes."""
+import sys
+import time
+import threading
+
+from model_registry import ModelRegistry, isolated_imports
+
+
+def run_threads(fn, args_list):
+    errors = []
+
+    def target(*args):
+        try:
+            fn(*args)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=target, args=args) for args in args_list]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=30)
+    return errors
+
+
+def test_loads_lazily_and_counts_hits():
+    calls = []
+    registry = ModelRegistry()
+    registry.register('a', lambda: calls.append('a') or 'modelo a')
+    assert registry.stats()['loaded'] == []
+    assert registry.get('a') == 'modelo a'
+    assert registry.get('a') == 'modelo a'
+    stats = registry.stats()
+    assert calls == ['a']
+    assert (stats['loads'], stats['hits'], stats['loaded']) == (1, 1, ['a'])
+
+
+def test_budget_evicts_least_recently_used_but_not_pinned():
+    registry = ModelRegistry(rss_budget_bytes=1)  # siempre excedido
+    for name in 'abc':
+        registry.register(name, lambda name=name: name)
+    registry.pin('a')
+    registry.get('b')
+    registry.get('c')
+    stats = registry.stats()
+    assert stats['loaded'] == ['a', 'c']
+    assert stats['evictions'] == 1
+
+
+def test_unload_right_after_load_does_not_break_get():
+    # Un /unload (o el desalojo de otro request) entre la carga y la marca LRU
+    registry = ModelRegistry()
+    registry.register('a', lambda: 'modelo a')
+    load = registry._load
+
+    def load_then_unload(name):
+        model = load(name)
+        registry.evict(name)
+        return model
+
+    registry._load = load_then_unload
+    assert registry.get('a') == 'modelo a'
+    assert registry.stats()['loaded'] == []
+
+
+def test_concurrent_gets_and_evictions():
+    registry = ModelRegistry()
+    for name in 'abcd':
+        registry.register(name, lambda name=name: name)
+
+    def worker(i):
+        for j in range(60):
+            name = 'abcd'[(i + j) % 4]
+            assert registry.get(name) == name
+            if j % 3 == 0:
+                registry.evict(name)
+
+    assert run_threads(worker, [(i,) for i in range(8)]) == []
+
+
+def test_cold_model_loads_once_under_concurrent_requests():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'modelo'
+
+    registry = ModelRegistry()
+    registry.register('a', loader)
+    assert run_threads(registry.get, [('a',)] * 4) == []
+    assert calls == [1]
+
+
+def test_loads_never_overlap():
+    active, overlaps = [], []
+
+    def loader():
+        active.append(1)
+        if len(active) > 1:
+            overlaps.append(1)
+        time.sleep(0.1)
+        active.pop()
+        return 'modelo'
+
+    registry = ModelRegistry()
+    for name in 'abcd':
+        registry.register(name, loader)
+    assert run_threads(registry.get, [(name,) for name in 'abcd']) == []
+    assert overlaps == []
+    assert registry.stats()['loads'] == 4
+
+
+def test_concurrent_loads_import_their_own_modules(tmp_path):
+    # Dos árboles con un `networks` homónimo, como monodepth2 y NeWCRFs
+    for name in 'ab':
+        root = tmp_path / name
+        root.mkdir()
+        (root / 'networks.py').write_text("import time\ntime.sleep(0.1)\nNAME = {!r}\n".format(name))
+
+    def loader(name):
+        with isolated_imports(str(tmp_path / name)):
+            import networks
+            time.sleep(0.05)
+            return networks.NAME
+
+    registry = ModelRegistry()
+    for name in 'ab':
+        registry.register(name, lambda name=name: loader(name))
+    results, before = {}, sys.modules.get('networks')
+    assert run_threads(lambda name: results.update({name: registry.get(name)}), [('a',), ('b',)]) == []
+    assert results == {'a': 'a', 'b': 'b'}
+    assert sys.modules.get('networks') is before
+    assert str(tmp_path / 'a') not in sys.path
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Inferencia por tiles (depth_common/tiling.py): partición, blending y elección del tile por memoria."""
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from depth_common.tiling import feather_weights, fit_tiles, num_tiles, tile_starts, tiled_forward, window_alignment
+
+
+def pointwise(x):
+    # Sin contexto espacial: por tiles tiene que dar lo mismo que entera
+    return x.mean(1, keepdim=True) * 2 + x[:, :1] ** 2
+
+
+def swin_like(patch_size, window_size):
+    layer = SimpleNamespace(window_size=window_size)
+    return SimpleNamespace(backbone=SimpleNamespace(patch_embed=SimpleNamespace(patch_size=(patch_size,) * 2),
+                                                    layers=[layer]))
+
+
+def test_window_alignment_is_lcm_of_stride_and_window():
+    assert window_alignment(swin_like(4, 12)) == 96    # Large12
+    assert window_alignment(swin_like(4, 7)) == 224    # Large07
+    assert window_alignment(SimpleNamespace(module=swin_like(4, 12))) == 96
+
+
+def test_tile_starts_cover_with_overlap_and_alignment():
+    starts = tile_starts(1216, 384, 32, 96)
+    assert starts[0] == 0 and starts[-1] == 1216 - 384
+    assert all(s % 96 == 0 for s in starts[:-1])
+    assert all(b - a <= 384 - 32 for a, b in zip(starts, starts[1:]))
+    assert len(starts) == num_tiles(1216, 384, 32, 96)
+    assert tile_starts(352, 352, 32, 96) == [0]
+    with pytest.raises(ValueError):
+        tile_starts(1216, 96, 32, 96)
+
+
+def test_feather_weights_ramp_only_towards_neighbours():
+    inner = feather_weights(64, 32, 256, 16)
+    assert float(inner.min()) > 0 and float(inner.max()) == 1
+    assert inner[0] < inner[16] and inner[-1] < inner[-17]
+    first, last = feather_weights(64, 0, 256, 16), feather_weights(64, 192, 256, 16)
+    assert float(first[0]) == 1 and float(first[-1]) < 1
+    assert float(last[0]) < 1 and float(last[-1]) == 1
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_tiled_forward_matches_whole_image_for_pointwise_model(batch_size):
+    image = torch.rand(2, 3, 160, 224)
+    depth = tiled_forward(pointwise, image, (64, 96), overlap=16, align=32, batch_size=batch_size)
+    assert depth.shape == (2, 1, 160, 224)
+    assert torch.allclose(depth, pointwise(image), atol=1e-6)
+
+
+def test_tiled_forward_runs_whole_image_when_tile_covers_it():
+    calls = []
+    image = torch.rand(1, 3, 64, 64)
+    tiled_forward(lambda x: calls.append(x.shape) or pointwise(x), image, (128, 128))
+    assert calls == [image.shape]
+
+
+def test_tiled_forward_rejects_output_of_other_size():
+    with pytest.raises(ValueError):
+        tiled_forward(lambda x: x[:, :1, ::2, ::2], torch.rand(1, 3, 128, 128), (64, 64), overlap=16)
+
+
+def test_fit_tiles_meets_memory_target():
+    model = torch.nn.Sequential(torch.nn.Conv2d(3, 32, 3, padding=1), torch.nn.ReLU(), torch.nn.Conv2d(32, 1, 1))
+    size = (256, 256)
+    tile, batch, peak = fit_tiles(model, size, 1024)
+    assert (tile, batch) == (size, 1)
+
+    full_mb = peak / 2 ** 20
+    tile, batch, peak = fit_tiles(model, size, full_mb / 3, overlap=16, align=32, max_batch=2)
+    assert tile != size and peak <= full_mb / 3 * 2 ** 20
+    assert tile[0] % 32 == 0 and tile[1] % 32 == 0
+    image = torch.rand(1, 3, *size)
+    with torch.no_grad():
+        assert tiled_forward(model, image, tile, 16, 32, batch).shape == (1, 1) + size
+
+    with pytest.raises(ValueError):
+        fit_tiles(model, size, full_mb / 1000)
+
+
+def test_fit_tiles_without_smaller_tiles_raises():
+    model = torch.nn.Conv2d(3, 8, 3, padding=1)
+    with pytest.raises(ValueError):
+        fit_tiles(model, (96, 96), 1e-3, overlap=32, align=96)
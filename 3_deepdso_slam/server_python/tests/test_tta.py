@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Flip-TTA compartido (depth_common/tta.py)."""
+import torch
+
+import pytest
+
+from depth_common.tta import flip_lr, flip_tta, fuse_inv_depth, post_process_depth
+
+
+def depth_model(x):
+    # Profundidad que depende de la posición horizontal: el espejo la cambia
+    return x.mean(1, keepdim=True) + torch.linspace(0, 1, x.shape[-1])
+
+
+def test_batched_and_sequential_passes_agree():
+    image = torch.rand(2, 3, 32, 48)
+    sequential = flip_tta(depth_model, image, batched=False)
+    batched = flip_tta(depth_model, image, batched=True)
+    assert sequential.shape == (2, 1, 32, 48)
+    assert torch.allclose(sequential, batched, atol=1e-6)
+
+
+def test_batched_defaults_to_the_device():
+    shapes = []
+
+    def model(x):
+        shapes.append(x.shape[0])
+        return depth_model(x)
+
+    flip_tta(model, torch.rand(1, 3, 16, 16))
+    assert shapes == [1, 1]
+    flip_tta(model, torch.rand(1, 3, 16, 16), batched=True)
+    assert shapes[2:] == [2]
+
+
+def test_flip_invariant_model_is_unchanged():
+    image = torch.rand(1, 3, 16, 24)
+    model = lambda x: x.mean(1, keepdim=True)
+    assert torch.allclose(flip_tta(model, image), model(image), atol=1e-6)
+
+
+def test_borders_use_the_prediction_that_sees_them():
+    depth, depth_flipped = torch.zeros(1, 1, 4, 100), torch.ones(1, 1, 4, 100)
+    blended = post_process_depth(depth, depth_flipped)
+    # Borde izquierdo: la predicción del espejo; derecho: la de la imagen
+    assert float(blended[..., 0].min()) == 1 and float(blended[..., -1].max()) == 0
+    assert torch.allclose(blended[..., 50], torch.full((1, 1, 4), 0.5))
+    assert torch.equal(flip_lr(flip_lr(depth_flipped)), depth_flipped)
+
+
+def test_fusion_methods():
+    a, b = torch.tensor([[[[1., 4.]]]]), torch.tensor([[[[3., 2.]]]])
+    assert torch.equal(fuse_inv_depth(a, b), torch.tensor([[[[2., 3.]]]]))
+    assert torch.equal(fuse_inv_depth(a, b, method='max'), torch.tensor([[[[3., 4.]]]]))
+    assert torch.equal(fuse_inv_depth(a, b, method='min'), torch.tensor([[[[1., 2.]]]]))
+    with pytest.raises(ValueError):
+        fuse_inv_depth(a, b, method='median')
+    image = torch.rand(1, 3, 16, 100)
+    assert torch.all(flip_tta(depth_model, image, method='max') >= flip_tta(depth_model, image, method='min'))
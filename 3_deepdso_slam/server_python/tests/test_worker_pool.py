@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""WorkerPool: resultados, errores y orden del fork respecto de los hilos intra-op.
+
+Los casos que dejan al proceso con el equipo de OpenMP armado corren en un
+intérprete aparte: si no, envenenarían los forks del resto de los tests.
+"""
+import os
+
+import pytest
+import torch
+
+from conftest import run_script
+from worker_pool import WorkerPool, run_forked
+
+PRELUDE = """
+from worker_pool import WorkerPool, single_threaded, run_forked
+model = torch.nn.Conv2d(3, 16, 3)
+x = torch.rand(1, 3, 128, 128)
+"""
+
+
+def double(x):
+    return x * 2
+
+
+def fail(x):
+    raise ValueError("entrada inválida")
+
+
+def die_on_negative(x):
+    if float(x[0]) < 0:
+        os._exit(3)  # Como el OOM killer: sin excepción ni resultado
+    return x * 2
+
+
+def test_pool_returns_outputs_in_request_order():
+    pool = WorkerPool(double, num_workers=2, num_threads=1)
+    try:
+        futures = [pool.submit(torch.full((2,), float(i))) for i in range(8)]
+        assert [float(f.result(timeout=30)[0]) for f in futures] == [2.0 * i for i in range(8)]
+    finally:
+        pool.close()
+
+
+def test_pool_propagates_worker_exceptions():
+    pool = WorkerPool(fail, num_workers=1, num_threads=1)
+    try:
+        with pytest.raises(RuntimeError, match="entrada inválida"):
+            pool.submit(torch.zeros(1)).result(timeout=30)
+    finally:
+        pool.close()
+
+
+def test_pool_fails_pending_requests_when_a_worker_dies():
+    pool = WorkerPool(die_on_negative, num_workers=2, num_threads=1)
+    try:
+        assert float(pool.run(torch.ones(1))[0]) == 2.0
+        future = pool.submit(-torch.ones(1))
+        with pytest.raises(RuntimeError, match="exitcode 3"):
+            future.result(timeout=30)
+        with pytest.raises(RuntimeError, match="inutilizable"):
+            pool.submit(torch.ones(1))
+    finally:
+        pool.close()
+    assert not any(worker.is_alive() for worker in pool.workers)
+
+
+def test_pool_after_parallel_inference_in_parent_fails_instead_of_hanging():
+    result = run_script(PRELUDE, """
+        with torch.no_grad():
+            model(x)
+        try:
+            WorkerPool(model, 2, 2, start_timeout=5)
+        except RuntimeError as e:
+            print("ERROR", e)
+    """)
+    assert "ERROR Los workers no arrancaron" in result.stdout, result.stderr
+
+
+def test_pool_after_single_threaded_inference_in_parent_works():
+    result = run_script(PRELUDE, """
+        with torch.no_grad(), single_threaded():
+            reference = model(x)
+        pool = WorkerPool(model, 2, 2, start_timeout=30)
+        print("OK", bool(torch.allclose(pool.run(x), reference, atol=1e-5)))
+        pool.close()
+    """)
+    assert "OK True" in result.stdout, result.stderr
+
+
+def test_pool_after_run_forked_inference_works():
+    result = run_script(PRELUDE, """
+        def checksum():
+            with torch.no_grad():
+                return float(model(x).sum())
+        value = run_forked(checksum)
+        pool = WorkerPool(model, 2, 2, start_timeout=30)
+        with torch.no_grad():
+            print("OK", abs(float(pool.run(x).sum()) - value) < 1e-2)
+        pool.close()
+    """)
+    assert "OK True" in result.stdout, result.stderr
+
+
+def test_run_forked_returns_result_and_reraises():
+    assert run_forked(lambda a, b: {"sum": a + b, "pid": os.getpid()}, 2, 3)["sum"] == 5
+    assert run_forked(lambda: os.getpid()) != os.getpid()
+    with pytest.raises(RuntimeError, match="ValueError: entrada inválida"):
+        run_forked(fail, None)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Inferencia por tiles con memoria acotada para los modelos Swin (NeWCRFs,
+DCDepth) a resolución alta.
+
+tiled_forward divide la imagen en tiles solapados, con posición y tamaño
+múltiplos de window_alignment(model) (mcm del stride total 32 y
+patch_size * window_size, 96 px en Large12, 224 px en Large07), los procesa
+de a `batch_size` y los mezcla con pesos lineales en el solapamiento. fit_tiles
+elige el tile para un objetivo de pico de memoria de activaciones. Ambos están
+en depth_common/tiling.py, que el infer.py de NeWCRFs y el test.py de DCDepth
+importan de su copia de depth_common; este script compara contra la imagen
+entera:
+
+    python tiled_inference.py --models newcrfs dcdepth --size 352 1216 \\
+        --max_memory_mb 1024 512 --image ~/Documentos/benchmark_images/0001.jpg
+
+Sin --<modelo>_checkpoint se usan pesos aleatorios: sirve para memoria y
+latencia, no para juzgar la diferencia con la imagen entera (abs_rel medio contra
+ella; el PPM de NeWCRFs y el PFF de DCDepth tienen contexto global, que por
+tile se pierde).
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+import PIL.Image as pil
+import torch
+from torchvision import transforms
+
+from fast_load import peak_rss_mb, profile_peak_bytes
+from depth_common.tiling import window_alignment, tiled_forward, num_tiles, fit_tiles  # noqa: F401
+
+
+def current_rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2.0 ** 20
+
+
+def rss_growth_mb(fn):
+    """Cuánto sube el pico de RSS (MB) sobre el RSS inicial durante fn(). Se
+    mide en un proceso hijo (fork) porque ru_maxrss no se puede reiniciar."""
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+
+    def child():
+        before = current_rss_mb()
+        with torch.no_grad():
+            fn()
+        queue.put(peak_rss_mb() - before)
+
+    process = ctx.Process(target=child)
+    process.start()
+    growth = queue.get()
+    process.join()
+    return growth
+
+
+def time_calls(fn, iterations):
+    fn()  # Warmup
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def load_model(name, checkpoint):
+    """(depth_fn: imagen -> profundidad (N,1,H,W), modelo)."""
+    from benchmark_swin_caches import BUILDERS
+    model, _ = BUILDERS[name](checkpoint)
+    model.eval()
+    if name == 'dcdepth':
+        model.img_size = None  # Acepta el tamaño de cada tile
+        return lambda x: model(x)[-1], model
+    return model, model
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Inferencia por tiles vs imagen entera: pico, RSS y latencia.')
+    parser.add_argument('--models', type=str, nargs='+', choices=['newcrfs', 'dcdepth'], default=['newcrfs', 'dcdepth'])
+    parser.add_argument('--size', type=int, nargs=2, default=[352, 1216], help='alto ancho (KITTI, kbcrop)')
+    parser.add_argument('--max_memory_mb', type=float, nargs='+', default=[1024, 512],
+                        help='objetivos de pico de memoria de activaciones')
+    parser.add_argument('--overlap', type=int, default=32)
+    parser.add_argument('--max_batch', type=int, default=1, help='tiles por forward como máximo')
+    parser.add_argument('--newcrfs_checkpoint', type=str, default=None)
+    parser.add_argument('--dcdepth_checkpoint', type=str, default=None)
+    parser.add_argument('--image', type=str, default=None, help='imagen de entrada; si no hay, ruido')
+    parser.add_argument('--iterations', type=int, default=3)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    height, width = args.size
+    if args.image:
+        normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        transform = transforms.Compose([transforms.Resize((height, width)), transforms.ToTensor(), normalize])
+        image = transform(pil.open(args.image).convert('RGB')).unsqueeze(0)
+    else:
+        image = torch.rand(1, 3, height, width)
+
+    print("{:<9} {:<12} {:>10} {:>5} {:>5} {:>8} {:>8} {:>9} {:>9}".format(
+        'modelo', 'modo', 'tile', 'batch', 'tiles', 'peak_MB', 'rss_MB', 'ms', 'abs_rel'))
+    for name in args.models:
+        depth_fn, model = load_model(name, getattr(args, '{}_checkpoint'.format(name)))
+        align = window_alignment(model)
+
+        runs = [('entera', (height, width), 1)]
+        for max_memory_mb in args.max_memory_mb:
+            try:
+                tile, batch, _ = fit_tiles(depth_fn, (height, width), max_memory_mb, args.overlap, align,
+                                           args.max_batch)
+            except ValueError as e:
+                print("{:<9} <={:<10g} {}".format(name, max_memory_mb, e))
+                continue
+            runs.append(('<={:g}MB'.format(max_memory_mb), tile, batch))
+
+        reference = None
+        for mode, tile, batch in runs:
+            forward = lambda x: tiled_forward(depth_fn, x, tile, args.overlap, align, batch)
+            with torch.no_grad():
+                peak, depth = profile_peak_bytes(forward, image)
+                latencies = time_calls(lambda: forward(image), args.iterations)
+            rss = rss_growth_mb(lambda: forward(image))
+            reference = depth if reference is None else reference
+            abs_rel = float(((depth - reference).abs() / reference.abs().clamp(min=1e-6)).mean())
+            count = num_tiles(height, tile[0], args.overlap, align) * num_tiles(width, tile[1], args.overlap, align)
+            print("{:<9} {:<12} {:>10} {:5d} {:5d} {:8.1f} {:8.1f} {:9.1f} {:9.2e}".format(
+                name, mode, '{}x{}'.format(*tile), batch, count, peak / 2 ** 20, rss, latencies.mean(), abs_rel))
+        del model, depth_fn
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""Pool de procesos de inferencia para servir en CPU.
+
+Cada worker es un fork del proceso del servidor, así que hereda el modelo ya
+cargado (copy-on-write) sin volver a leer los pesos. Antes de atender requests
+fija su máscara de afinidad a `num_threads` núcleos propios y llama a
+`torch.set_num_threads(num_threads)`, de modo que N requests concurrentes usan
+N grupos de núcleos disjuntos en lugar de competir por el mismo pool intra-op.
+
+Los tensores viajan por `torch.multiprocessing`, que los pasa por memoria
+compartida en lugar de serializarlos.
+
+El fork tiene una condición: el proceso padre no puede haber ejecutado
+operaciones con varios hilos intra-op (el equipo de hilos de OpenMP no
+sobrevive al fork y el worker se bloquea en su primera región paralela). Por
+eso cada worker corre una operación paralela de prueba al arrancar y, si no
+responde en `start_timeout` segundos, WorkerPool falla con un error en vez de
+dejar colgados los requests. La inferencia que el padre necesite antes de crear
+el pool (trazas, controles de precisión) va dentro de `single_threaded()` o se
+delega a un hijo con `run_forked()`.
+
+Si un worker muere (OOM killer, segfault en una extensión) no se sabe qué
+request tenía tomado: el pool falla todos los pendientes con RuntimeError,
+termina los demás workers y rechaza los submit siguientes, como el
+BrokenProcessPool de concurrent.futures. Así run() nunca queda esperando un
+resultado que no va a llegar.
+"""
+from __future__ import absolute_import, division, print_function
+
+import os
+import time
+import queue
+import threading
+import itertools
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+
+@contextlib.contextmanager
+def single_threaded():
+    """Un solo hilo intra-op mientras dura el bloque: OpenMP no arma su equipo de
+    hilos y el proceso puede crear un WorkerPool después."""
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(num_threads)
+
+
+def run_forked(fn, *args):
+    """Ejecuta `fn(*args)` en un proceso hijo (fork) y devuelve su resultado, que
+    debe poder serializarse. Los hilos intra-op que use quedan en el hijo, así que
+    el padre puede crear un WorkerPool después.
+
+    Raises:
+        RuntimeError: si `fn` lanza una excepción o el hijo termina sin resultado
+    """
+    ctx = mp.get_context('fork')
+    receiver, sender = ctx.Pipe(duplex=False)
+
+    def target():
+        try:
+            sender.send((fn(*args), None))
+        except Exception as e:
+            sender.send((None, "{}: {}".format(type(e).__name__, e)))
+
+    process = ctx.Process(target=target)
+    process.start()
+    sender.close()
+    try:
+        result, error = receiver.recv()
+    except EOFError:
+        result, error = None, "el proceso hijo terminó sin resultado"
+    finally:
+        process.join()
+        receiver.close()
+    if error is not None:
+        raise RuntimeError(error)
+    return result
+
+
+def _parallel_probe():
+    # Suma elemento a elemento por encima del grain size de at::parallel_for:
+    # con más de un hilo entra en una región paralela de OpenMP
+    return float(torch.ones(1 << 18).add_(1).sum())
+
+
+def _worker_loop(forward_fn, cpus, num_threads, tasks, results, ready):
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(num_threads)
+    _parallel_probe()
+    ready.put(os.getpid())
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        job_id, inputs = task
+        try:
+            with torch.no_grad():
+                results.put((job_id, forward_fn(inputs), None))
+        except Exception as e:
+            results.put((job_id, None, str(e)))
+
+
+class WorkerPool:
+    """Reparte llamadas a `forward_fn(tensor)` entre `num_workers` procesos.
+
+    `forward_fn` se ejecuta dentro del worker; como los workers se crean con
+    fork puede ser cualquier callable que cierre sobre el modelo cargado.
+    Hay que crear el pool antes de ejecutar inferencia multihilo en el proceso
+    padre (ver single_threaded y run_forked).
+
+    Raises:
+        RuntimeError: si algún worker no termina la prueba de arranque en
+            `start_timeout` segundos (el padre ya usó hilos intra-op)
+    """
+    poll_interval = 0.5  # Cada cuánto el colector revisa que los workers sigan vivos
+
+    def __init__(self, forward_fn, num_workers=2, num_threads=1, pin=True, start_timeout=30.0):
+        ctx = mp.get_context('fork')
+        self.num_workers = num_workers
+        self.num_threads = num_threads
+        self.tasks = ctx.Queue()
+        self.results = ctx.Queue()
+        ready = ctx.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.broken = None  # Motivo, si murió un worker
+        self.closing = False
+        self.job_ids = itertools.count()
+
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+        self.workers = []
+        for i in range(num_workers):
+            cpus = None
+            if pin and cores:
+                cpus = {cores[(i * num_threads + j) % len(cores)] for j in range(num_threads)}
+            worker = ctx.Process(target=_worker_loop,
+                                 args=(forward_fn, cpus, num_threads, self.tasks, self.results, ready),
+                                 daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+        deadline = time.time() + start_timeout
+        try:
+            for _ in range(num_workers):
+                ready.get(timeout=max(deadline - time.time(), 0.0))
+        except queue.Empty:
+            for worker in self.workers:
+                worker.terminate()
+                worker.join()
+            raise RuntimeError(
+                "Los workers no arrancaron en {:.0f} s: el proceso padre ya ejecutó operaciones con varios "
+                "hilos intra-op antes del fork. Crear el WorkerPool antes de cualquier inferencia, o hacerla "
+                "dentro de single_threaded() / run_forked()".format(start_timeout))
+
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, inputs):
+        """Encola `inputs` y devuelve un Future con la salida de `forward_fn`.
+
+        Raises:
+            RuntimeError: si el pool quedó inutilizable porque murió un worker
+        """
+        future = Future()
+        job_id = next(self.job_ids)
+        with self.lock:
+            if self.broken is not None:
+                raise RuntimeError(self.broken)
+            self.pending[job_id] = future
+        self.tasks.put((job_id, inputs))
+        return future
+
+    def run(self, inputs):
+        return self.submit(inputs).result()
+
+    def _collect(self):
+        while True:
+            try:
+                self._resolve(*self.results.get(timeout=self.poll_interval))
+            except queue.Empty:
+                pass
+            dead = [worker for worker in self.workers if not worker.is_alive()]
+            if self.closing:
+                if len(dead) == len(self.workers):
+                    return
+            elif dead:
+                # Lo que el worker alcanzó a mandar antes de morir sigue valiendo
+                try:
+                    while True:
+                        self._resolve(*self.results.get_nowait())
+                except queue.Empty:
+                    pass
+                self._break("El worker {} terminó con exitcode {}".format(dead[0].pid, dead[0].exitcode))
+                return
+
+    def _resolve(self, job_id, output, error):
+        with self.lock:
+            future = self.pending.pop(job_id, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(output)
+
+    def _break(self, reason):
+        """Falla los requests pendientes y termina los workers que quedan."""
+        with self.lock:
+            self.broken = "{}: el pool de workers quedó inutilizable".format(reason)
+            pending, self.pending = self.pending, {}
+        for worker in self.workers:
+            worker.terminate()
+        for future in pending.values():
+            future.set_exception(RuntimeError(self.broken))
+
+    def close(self):
+        self.closing = True
+        for worker in self.workers:
+            if worker.is_alive():
+                self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+def benchmark_pool(forward_fn, inputs, worker_counts, thread_counts, num_requests=50, concurrency=None):
+    """Barrido workers x threads: lanza `num_requests` requests con `concurrency`
+    clientes concurrentes (por defecto, uno por worker) y mide throughput y latencia.
+
+    Returns:
+        lista de dicts con workers, threads, throughput (req/s), p50_ms y p99_ms
+    """
+    rows = []
+    for num_workers in worker_counts:
+        for num_threads in thread_counts:
+            pool = WorkerPool(forward_fn, num_workers, num_threads)
+            # Warmup: una inferencia por worker
+            for future in [pool.submit(inputs[0]) for _ in range(num_workers)]:
+                future.result()
+
+            def timed(i):
+                start = time.time()
+                pool.run(inputs[i % len(inputs)])
+                return time.time() - start
+
+            start = time.time()
+            with ThreadPoolExecutor(concurrency or num_workers) as clients:
+                latencies = np.array(list(clients.map(timed, range(num_requests)))) * 1000
+            elapsed = time.time() - start
+            pool.close()
+
+            rows.append({
+                "workers": num_workers,
+                "threads": num_threads,
+                "throughput": num_requests / elapsed,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p99_ms": float(np.percentile(latencies, 99))
+            })
+            print("workers={workers:<3} threads={threads:<3} {throughput:8.2f} req/s  "
+                  "p50={p50_ms:9.2f} ms  p99={p99_ms:9.2f} ms".format(**rows[-1]))
+    return rows